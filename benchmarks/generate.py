@@ -0,0 +1,207 @@
+"""
+Generates synthetic SABANGNET-like product DB workbooks (and a matching template) for the benchmarks.
+
+Usage:
+    python -m benchmarks.generate --rows 100000 --output benchmarks/data/PRODUCT_DB_100000.xlsx
+"""
+from __future__ import annotations
+
+import os
+
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from openpyxl import Workbook
+from openpyxl.styles import Alignment, Font, PatternFill
+
+
+if TYPE_CHECKING:
+    from typing import Final
+
+# ? Same columns as run.bat
+FIRST_COLUMN: Final[str] = "원본 상품명"
+SECOND_COLUMN: Final[str] = "원가\n[필수]"
+OUTPUT_COLUMN: Final[str] = "옵션상세명칭(1)\n[사방넷]"
+JOIN_BY: Final[str] = ","
+COLUMN_TO_DROPNA: Final[str] = "원본 상품명"
+COLUMNS_TO_DROP_DULICATES: Final[list[str]] = [
+    "원본 상품명",
+    "옵션상세명칭(1)",
+    "물류처ID",
+    "모델NO",
+]
+
+TEMPLATE_COLUMNS: Final[list[str]] = [
+    "모델NO",
+    "원본 상품명",
+    "옵션상세명칭(1)\n[사방넷]",
+    "원가\n[필수]",
+    "판매가\n[필수]",
+    "물류처ID",
+    "브랜드명",
+    "사방넷 전용 컬럼",  # ? Not in the product DB, it stays empty
+]
+
+PRODUCT_WORDS: Final[list[str]] = [
+    "프리미엄",
+    "데일리",
+    "오가닉",
+    "슬림핏",
+    "캠핑",
+    "무선",
+    "대용량",
+    "스테인리스",
+    "유아용",
+    "국내산",
+]
+PRODUCT_NOUNS: Final[list[str]] = [
+    "티셔츠",
+    "텀블러",
+    "이어폰",
+    "냄비",
+    "의자",
+    "쌀",
+    "샴푸",
+    "운동화",
+    "가방",
+    "노트",
+]
+COLORS: Final[list[str]] = ["빨강", "파랑", "검정", "흰색", "베이지", "네이비"]
+SIZES: Final[list[str]] = ["S", "M", "L", "XL", "FREE", "230mm", "1kg"]
+BRANDS: Final[list[str]] = ["한빛", "누리", "Apple", "다온", "새봄", ""]
+
+
+@dataclass(slots=True, frozen=True, kw_only=True)
+class ProductDBSpec:
+    """
+    Args:
+        rows (int): Number of rows of the sheet, including the duplicated and empty rows.
+        groups_per_key (int): Average number of option rows per (first_column, second_column) key.
+        duplicate_ratio (float): Share of the rows that repeat a previous row of the same key.
+        empty_ratio (float): Share of the rows that are blank or have no `COLUMN_TO_DROPNA` value.
+        seed (int): Seed of the random generator, the same spec always gives the same file.
+    """
+
+    rows: int
+    groups_per_key: int = 4
+    duplicate_ratio: float = 0.05
+    empty_ratio: float = 0.02
+    seed: int = 0
+
+    @property
+    def stem(self) -> str:
+        return "PRODUCT_DB_{rows}_g{groups_per_key}_d{duplicate_ratio}_e{empty_ratio}_s{seed}".format(
+            **asdict(self)
+        )
+
+
+def generate_product_db(spec: ProductDBSpec) -> pd.DataFrame:
+    rng = np.random.default_rng(spec.seed)
+    n_keys = max(1, spec.rows // max(1, spec.groups_per_key))
+
+    key_ids = np.sort(rng.integers(0, n_keys, spec.rows))
+    words = np.array(PRODUCT_WORDS, dtype=object)[key_ids % len(PRODUCT_WORDS)]
+    nouns = np.array(PRODUCT_NOUNS, dtype=object)[
+        (key_ids // len(PRODUCT_WORDS)) % len(PRODUCT_NOUNS)
+    ]
+    names = [
+        f"{word} {noun} {key:06d}" for word, noun, key in zip(words, nouns, key_ids)
+    ]
+    prices = (key_ids % 50 + 1) * 1000 + np.where(key_ids % 7 == 0, 0.5, 0)
+
+    colors = rng.choice(COLORS, spec.rows)
+    sizes = rng.choice(SIZES, spec.rows)
+    options = [f"{color} / {size}" for color, size in zip(colors, sizes)]
+
+    dataframe = pd.DataFrame(
+        {
+            "상품코드": [f"P{idx:08d}" for idx in range(spec.rows)],
+            FIRST_COLUMN: names,
+            SECOND_COLUMN: prices,
+            "판매가\n[필수]": np.round(prices * 1.3),
+            OUTPUT_COLUMN: options,
+            "옵션상세명칭(1)": options,
+            "물류처ID": rng.choice(["1001", "1002", "2001"], spec.rows),
+            "모델NO": [f"M-{key:05d}" for key in key_ids],
+            "브랜드명": rng.choice(BRANDS, spec.rows),
+            "상품설명\n[선택]": rng.choice(
+                ["", "상세페이지 참조", "줄바꿈이 있는\n설명", "NA", "nan"], spec.rows
+            ),
+        }
+    )
+
+    # ? Rows repeating the previous row of the same key, removed by the normalize stage
+    n_duplicates = int(spec.rows * spec.duplicate_ratio)
+    if n_duplicates:
+        targets = rng.choice(np.arange(1, spec.rows), n_duplicates, replace=False)
+        same_key = key_ids[targets] == key_ids[targets - 1]
+        targets = targets[same_key]
+        dataframe.iloc[targets] = dataframe.iloc[targets - 1].to_numpy()
+
+    # ? Half of the empty rows are blank lines of the sheet, the other half only miss the product name
+    n_empty = int(spec.rows * spec.empty_ratio)
+    if n_empty:
+        targets = rng.choice(spec.rows, n_empty, replace=False)
+        blank, unnamed = targets[: n_empty // 2], targets[n_empty // 2 :]
+        dataframe.iloc[blank] = np.nan
+        dataframe.iloc[unnamed, dataframe.columns.get_loc(FIRST_COLUMN)] = np.nan
+
+    # ? The product DB is not sorted by the key
+    return dataframe.sample(frac=1, random_state=spec.seed).reset_index(drop=True)
+
+
+def write_product_db(spec: ProductDBSpec, filename: str) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    dataframe = generate_product_db(spec)
+
+    if filename.lower().endswith(".csv"):
+        dataframe.to_csv(filename, index=False, encoding="utf-8-sig")
+    else:
+        dataframe.to_excel(filename, index=False)
+
+    return filename
+
+
+def write_template(filename: str) -> str:
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "상품등록"
+    for idx, name in enumerate(TEMPLATE_COLUMNS, start=1):
+        cell = ws.cell(row=1, column=idx, value=name)
+        cell.font = Font(bold=True)
+        cell.fill = PatternFill("solid", fgColor="FFF2CC")
+        cell.alignment = Alignment(wrap_text=True)
+    wb.save(filename)
+
+    return filename
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, required=True)
+    parser.add_argument("--groups_per_key", type=int, default=4)
+    parser.add_argument("--duplicate_ratio", type=float, default=0.05)
+    parser.add_argument("--empty_ratio", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", help="Output .xlsx (or .csv) file", type=str, required=True
+    )
+    parser.add_argument("--template", help="Also write a template file", type=str)
+    args = parser.parse_args()
+
+    spec = ProductDBSpec(
+        rows=args.rows,
+        groups_per_key=args.groups_per_key,
+        duplicate_ratio=args.duplicate_ratio,
+        empty_ratio=args.empty_ratio,
+        seed=args.seed,
+    )
+    print(write_product_db(spec, args.output))
+    if args.template:
+        print(write_template(args.template))
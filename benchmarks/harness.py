@@ -0,0 +1,472 @@
+"""
+Times and memory-profiles every stage of the merge on synthetic product DBs, and compares the
+results with a stored baseline. The peak memory of the whole merge is also reported next to the
+estimates of the preflight check, to re-calibrate its memory factors.
+
+Usage:
+    python -m benchmarks.harness --rows 10000 100000 --repeat 3
+    python -m benchmarks.harness --rows 100000 --update_baseline
+"""
+from __future__ import annotations
+
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+import pandas as pd
+
+from benchmarks.generate import (
+    COLUMN_TO_DROPNA,
+    COLUMNS_TO_DROP_DULICATES,
+    FIRST_COLUMN,
+    JOIN_BY,
+    OUTPUT_COLUMN,
+    SECOND_COLUMN,
+    ProductDBSpec,
+    write_product_db,
+    write_template,
+)
+from option_merge_tool.engine import (
+    aggregate_options,
+    drop_empty_rows,
+    match_options,
+    normalize_options,
+    sort_by_keys,
+)
+from option_merge_tool.excel import copy_dataframe_to_excel_template, get_column_mapping
+from option_merge_tool.out_of_core import estimate_memory
+from option_merge_tool.preflight import run_preflight
+from option_merge_tool.reader import (
+    READER_BACKENDS,
+    projected_columns,
+    read_header,
+    read_table,
+)
+from option_merge_tool.template import load_template
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable
+    from typing import Any, Final
+
+    from option_merge_tool.reader import ReaderBackend
+
+BENCHMARKS_PATH: Final[str] = os.path.dirname(os.path.realpath(__file__))
+DATA_PATH: Final[str] = os.path.join(BENCHMARKS_PATH, "data")
+RESULTS_PATH: Final[str] = os.path.join(BENCHMARKS_PATH, "results")
+BASELINE_FILE: Final[str] = os.path.join(BENCHMARKS_PATH, "baseline.json")
+
+# ? Since the template fill writes the output directly, "template" is also the write stage
+STAGES: Final[tuple[str, ...]] = (
+    "read",
+    "filter",
+    "sort",
+    "aggregate",
+    "match",
+    "normalize",
+    "template",
+)
+# ? Differences below these are measurement noise, not regressions
+MIN_SECONDS: Final[float] = 0.02
+MIN_MEGABYTES: Final[float] = 1.0
+
+
+@dataclass(slots=True, frozen=True)
+class StageResult:
+    seconds: float
+    peak_memory_mb: float
+    rows_in: int
+    rows_out: int
+
+
+@dataclass(slots=True, frozen=True)
+class MemoryEstimate:
+    """
+    The memory the preflight check expects the merge to need (`preflight_mb`, dictionary-encoded
+    with --lean_memory) and the one estimated from the size of the file (`file_size_mb`), next to
+    the peak traced over the whole merge. `measured / estimated` is the correction of the factors
+    (IN_MEMORY_FACTOR or LEAN_MEMORY_FACTOR, XLSX_MEMORY_FACTOR or CSV_MEMORY_FACTOR).
+    """
+
+    preflight_mb: float
+    file_size_mb: float
+    measured_peak_mb: float
+
+
+@dataclass(slots=True, frozen=True)
+class Regression:
+    case: str
+    stage: str
+    metric: str
+    baseline: float
+    current: float
+
+    @property
+    def ratio(self) -> float:
+        return self.current / self.baseline if self.baseline else float("inf")
+
+
+def _columns(template_file: str) -> list[str]:
+    return projected_columns(
+        FIRST_COLUMN,
+        SECOND_COLUMN,
+        OUTPUT_COLUMN,
+        COLUMN_TO_DROPNA,
+        COLUMNS_TO_DROP_DULICATES,
+        read_header(template_file),
+    )
+
+
+def _run_stages(
+    input_file: str,
+    template_file: str,
+    output_file: str,
+    backend: ReaderBackend,
+    lean_memory: bool,
+    measure: Callable[[str, Callable[[], Any], int], Any],
+) -> None:
+    columns = _columns(template_file)
+    keys = (FIRST_COLUMN, SECOND_COLUMN)
+    categories = (
+        [column for column in columns if column != OUTPUT_COLUMN]
+        if lean_memory
+        else None
+    )
+
+    dataframe = measure(
+        "read",
+        lambda: read_table(
+            input_file, columns=columns, backend=backend, categories=categories
+        ),
+        0,
+    )
+    dataframe = measure(
+        "filter", lambda: drop_empty_rows(dataframe, COLUMN_TO_DROPNA), len(dataframe)
+    )
+    dataframe = measure("sort", lambda: sort_by_keys(dataframe, keys), len(dataframe))
+    aggregated = measure(
+        "aggregate",
+        lambda: aggregate_options(dataframe, keys, OUTPUT_COLUMN, JOIN_BY),
+        len(dataframe),
+    )
+    dataframe = measure(
+        "match",
+        lambda: match_options(dataframe, aggregated, keys, OUTPUT_COLUMN),
+        len(dataframe),
+    )
+    dataframe = measure(
+        "normalize",
+        lambda: normalize_options(
+            dataframe, COLUMN_TO_DROPNA, COLUMNS_TO_DROP_DULICATES
+        ),
+        len(dataframe),
+    )
+    measure(
+        "template",
+        lambda: copy_dataframe_to_excel_template(
+            dataframe=dataframe,
+            filename=output_file,
+            template_filename=template_file,
+            column_mapping=get_column_mapping(template_file, dataframe),
+            column_to_dropna=COLUMN_TO_DROPNA,
+            current_os=platform.system(),
+        ),
+        len(dataframe),
+    )
+
+
+def _rows(value: Any, rows_in: int) -> int:
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else rows_in
+
+
+def time_stages(
+    input_file: str,
+    template_file: str,
+    output_file: str,
+    backend: ReaderBackend,
+    lean_memory: bool,
+) -> dict[str, tuple[float, int, int]]:
+    timings: dict[str, tuple[float, int, int]] = {}
+
+    def measure(stage: str, function: Callable[[], Any], rows_in: int) -> Any:
+        start = time.perf_counter()
+        value = function()
+        timings[stage] = (time.perf_counter() - start, rows_in, _rows(value, rows_in))
+        return value
+
+    _run_stages(input_file, template_file, output_file, backend, lean_memory, measure)
+    return timings
+
+
+def profile_memory(
+    input_file: str,
+    template_file: str,
+    output_file: str,
+    backend: ReaderBackend,
+    lean_memory: bool,
+) -> tuple[dict[str, float], float]:
+    """
+    Peak memory allocated by each stage and by the whole merge in megabytes, in a separate run
+    because tracemalloc slows the stages down.
+    """
+    peaks: dict[str, float] = {}
+    run_peak = 0
+
+    def measure(stage: str, function: Callable[[], Any], rows_in: int) -> Any:
+        nonlocal run_peak
+        tracemalloc.reset_peak()
+        start, _ = tracemalloc.get_traced_memory()
+        value = function()
+        _, peak = tracemalloc.get_traced_memory()
+        peaks[stage] = (peak - start) / (1024 * 1024)
+        # ? Only the allocations made since tracemalloc.start() are traced, so this is the peak of the merge
+        run_peak = max(run_peak, peak)
+        return value
+
+    tracemalloc.start()
+    try:
+        _run_stages(
+            input_file, template_file, output_file, backend, lean_memory, measure
+        )
+    finally:
+        tracemalloc.stop()
+
+    return peaks, run_peak / (1024 * 1024)
+
+
+def estimate_memory_mb(
+    input_file: str, template_file: str, backend: ReaderBackend, lean_memory: bool
+) -> tuple[float, float]:
+    """The memory of the merge estimated by the preflight check and from the size of the file, in megabytes."""
+    preflight = run_preflight(
+        input_file,
+        template_file,
+        load_template(template_file),
+        columns=_columns(template_file),
+        first_column=FIRST_COLUMN,
+        second_column=SECOND_COLUMN,
+        output_column=OUTPUT_COLUMN,
+        column_to_dropna=COLUMN_TO_DROPNA,
+        columns_to_drop_dulicates=COLUMNS_TO_DROP_DULICATES,
+        reader_backend=backend,
+        lean_memory=lean_memory,
+    )
+    estimated = (
+        preflight.estimated_lean_memory
+        if lean_memory and preflight.estimated_lean_memory is not None
+        else preflight.estimated_memory
+    )
+
+    return estimated / (1024 * 1024), estimate_memory(input_file, backend) / (
+        1024 * 1024
+    )
+
+
+def run_case(
+    spec: ProductDBSpec, *, repeat: int, backend: ReaderBackend, lean_memory: bool
+) -> tuple[dict[str, StageResult], MemoryEstimate]:
+    input_file = os.path.join(DATA_PATH, f"{spec.stem}.xlsx")
+    if not os.path.exists(input_file):
+        print(f"Generating {input_file} ...", file=sys.stderr)
+        write_product_db(spec, input_file)
+
+    template_file = os.path.join(DATA_PATH, "TEMPLATE.xlsx")
+    if not os.path.exists(template_file):
+        write_template(template_file)
+
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, "MERGED_OPTIONS.xlsx")
+
+        runs = [
+            time_stages(input_file, template_file, output_file, backend, lean_memory)
+            for _ in range(repeat)
+        ]
+        peaks, run_peak = profile_memory(
+            input_file, template_file, output_file, backend, lean_memory
+        )
+    preflight_mb, file_size_mb = estimate_memory_mb(
+        input_file, template_file, backend, lean_memory
+    )
+
+    results: dict[str, StageResult] = {}
+    for stage in STAGES:
+        _, rows_in, rows_out = runs[0][stage]
+        results[stage] = StageResult(
+            seconds=min(run[stage][0] for run in runs),
+            peak_memory_mb=peaks[stage],
+            rows_in=rows_in,
+            rows_out=rows_out,
+        )
+    results["total"] = StageResult(
+        seconds=sum(result.seconds for result in results.values()),
+        peak_memory_mb=max(result.peak_memory_mb for result in results.values()),
+        rows_in=results["read"].rows_out,
+        rows_out=results["template"].rows_out,
+    )
+
+    return results, MemoryEstimate(
+        preflight_mb=preflight_mb,
+        file_size_mb=file_size_mb,
+        measured_peak_mb=run_peak,
+    )
+
+
+def compare(
+    results: dict[str, dict[str, Any]],
+    baseline: dict[str, dict[str, Any]],
+    threshold: float,
+) -> list[Regression]:
+    """Lists the stages whose time or peak memory grew by more than `threshold` (e.g. 0.2 for 20%) over the baseline."""
+    regressions: list[Regression] = []
+    for case, stages in results.items():
+        for stage, result in stages.items():
+            previous = baseline.get(case, {}).get(stage)
+            if previous is None:
+                continue
+
+            for metric, noise in (
+                ("seconds", MIN_SECONDS),
+                ("peak_memory_mb", MIN_MEGABYTES),
+            ):
+                current, before = result[metric], previous[metric]
+                if current > before * (1 + threshold) and current - before > noise:
+                    regressions.append(Regression(case, stage, metric, before, current))
+
+    return regressions
+
+
+def print_results(results: dict[str, dict[str, Any]]) -> None:
+    for case, stages in results.items():
+        print(f"\n{case}")
+        print(
+            f"  {'stage':<10} {'seconds':>9} {'peak MB':>9} {'rows in':>9} {'rows out':>9} {'rows/s':>11}"
+        )
+        for stage, result in stages.items():
+            # ? The read stage has no input rows, its throughput is the rows it loads
+            rows = max(result["rows_in"], result["rows_out"])
+            rows_per_second = rows / result["seconds"] if result["seconds"] else 0
+            print(
+                f"  {stage:<10} {result['seconds']:>9.3f} {result['peak_memory_mb']:>9.1f}"
+                f" {result['rows_in']:>9} {result['rows_out']:>9} {rows_per_second:>11,.0f}"
+            )
+
+
+def print_memory_estimates(estimates: dict[str, dict[str, float]]) -> None:
+    print(
+        f"\n{'memory (MB)':<40} {'preflight':>10} {'file size':>10} {'measured':>10} {'ratio':>12}"
+    )
+    for case, estimate in estimates.items():
+        measured = estimate["measured_peak_mb"]
+        # ? measured / estimated of the preflight and of the file size estimates, > 1 when they are too low
+        ratios = "/".join(
+            f"{measured / estimate[key]:.2f}" if estimate[key] else "-"
+            for key in ("preflight_mb", "file_size_mb")
+        )
+        print(
+            f"{case:<40} {estimate['preflight_mb']:>10.1f} {estimate['file_size_mb']:>10.1f}"
+            f" {measured:>10.1f} {ratios:>12}"
+        )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--groups_per_key", type=int, default=4)
+    parser.add_argument("--duplicate_ratio", type=float, default=0.05)
+    parser.add_argument("--empty_ratio", type=float, default=0.02)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--reader_backend", type=str, choices=READER_BACKENDS, default="auto"
+    )
+    parser.add_argument(
+        "--lean_memory",
+        help="Read the columns dictionary-encoded, like run.py --lean_memory",
+        action="store_true",
+    )
+    parser.add_argument("--output", help="Results JSON file", type=str)
+    parser.add_argument("--baseline", type=str, default=BASELINE_FILE)
+    parser.add_argument(
+        "--threshold",
+        help="Allowed slowdown over the baseline (0.2 = 20%%)",
+        type=float,
+        default=0.2,
+    )
+    parser.add_argument(
+        "--update_baseline",
+        help="Save the results as the new baseline",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    results: dict[str, dict[str, Any]] = {}
+    memory_estimates: dict[str, dict[str, float]] = {}
+    for rows in args.rows:
+        spec = ProductDBSpec(
+            rows=rows,
+            groups_per_key=args.groups_per_key,
+            duplicate_ratio=args.duplicate_ratio,
+            empty_ratio=args.empty_ratio,
+        )
+        stages, memory_estimate = run_case(
+            spec,
+            repeat=args.repeat,
+            backend=args.reader_backend,
+            lean_memory=args.lean_memory,
+        )
+        results[spec.stem] = {stage: asdict(result) for stage, result in stages.items()}
+        memory_estimates[spec.stem] = asdict(memory_estimate)
+    print_results(results)
+    print_memory_estimates(memory_estimates)
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "reader_backend": args.reader_backend,
+        "lean_memory": args.lean_memory,
+        "repeat": args.repeat,
+        "results": results,
+        "memory_estimates": memory_estimates,
+    }
+    output = args.output or os.path.join(
+        RESULTS_PATH, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(0)
+
+    if not os.path.exists(args.baseline):
+        print(
+            f"No baseline at {args.baseline}, run with --update_baseline to create it"
+        )
+        sys.exit(0)
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression.case} {regression.stage} {regression.metric}: "
+            f"{regression.baseline:.3f} -> {regression.current:.3f} ({regression.ratio:.2f}x)"
+        )
+    if regressions:
+        sys.exit(1)
+    print(f"No regression over {args.threshold:.0%} compared to the baseline")
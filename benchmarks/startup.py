@@ -0,0 +1,176 @@
+"""
+Times the startup of run.py for --help and an argument error, and checks that these paths do not
+import any of the heavy packages (pandas, numpy, openpyxl, ...).
+
+Usage:
+    python -m benchmarks.startup --repeat 10
+    python -m benchmarks.startup --update_baseline
+"""
+from __future__ import annotations
+
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from typing import Final
+
+BENCHMARKS_PATH: Final[str] = os.path.dirname(os.path.realpath(__file__))
+RUN_SCRIPT: Final[str] = os.path.join(os.path.dirname(BENCHMARKS_PATH), "run.py")
+BASELINE_FILE: Final[str] = os.path.join(BENCHMARKS_PATH, "startup_baseline.json")
+
+# ? Packages that only the merge, the template fill or the GUI may import
+HEAVY_MODULES: Final[frozenset[str]] = frozenset(
+    (
+        "pandas",
+        "numpy",
+        "openpyxl",
+        "excelsheet",
+        "pyarrow",
+        "python_calamine",
+        "dearpygui",
+    )
+)
+CASES: Final[dict[str, tuple[str, ...]]] = {
+    "help": ("--help",),
+    # ? No input file, parser.error() exits after the arguments are parsed
+    "argument_error": ("--template_file", "TEMPLATE.xlsx"),
+}
+# ? Differences below this are measurement noise, not regressions
+MIN_SECONDS: Final[float] = 0.02
+
+IMPORT_TIME_RE: Final[re.Pattern[str]] = re.compile(
+    r"^import time:\s+\d+\s+\|\s+(?P<cumulative>\d+)\s+\|(?P<indent>\s+)(?P<module>\S+)$"
+)
+
+
+@dataclass(slots=True, frozen=True)
+class StartupResult:
+    seconds: float
+    import_seconds: float
+    modules: int
+    heavy_modules: list[str]
+
+
+def run_case(arguments: tuple[str, ...], repeat: int) -> StartupResult:
+    timings: list[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, RUN_SCRIPT, *arguments],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=False,
+        )
+        timings.append(time.perf_counter() - start)
+
+    # ? A separate run, -X importtime slows the imports down
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", RUN_SCRIPT, *arguments],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding="utf-8",
+        errors="replace",
+        check=False,
+    )
+    modules: list[str] = []
+    import_microseconds = 0
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match is None:
+            continue
+        modules.append(match.group("module"))
+        # ? Only the top-level imports, their cumulative time includes the nested ones
+        if len(match.group("indent")) == 1:
+            import_microseconds += int(match.group("cumulative"))
+
+    return StartupResult(
+        seconds=min(timings),
+        import_seconds=import_microseconds / 1_000_000,
+        modules=len(modules),
+        heavy_modules=sorted(
+            {module for module in modules if module.split(".")[0] in HEAVY_MODULES}
+        ),
+    )
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--baseline", type=str, default=BASELINE_FILE)
+    parser.add_argument(
+        "--threshold",
+        help="Allowed slowdown over the baseline (0.2 = 20%%)",
+        type=float,
+        default=0.2,
+    )
+    parser.add_argument(
+        "--update_baseline",
+        help="Save the results as the new baseline",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    results = {
+        case: run_case(arguments, args.repeat) for case, arguments in CASES.items()
+    }
+
+    failed = False
+    print(f"  {'case':<16} {'seconds':>9} {'imports':>9} {'modules':>9}")
+    for case, result in results.items():
+        print(
+            f"  {case:<16} {result.seconds:>9.3f} {result.import_seconds:>9.3f} {result.modules:>9}"
+        )
+        if result.heavy_modules:
+            failed = True
+            print(f"HEAVY IMPORT {case}: {', '.join(result.heavy_modules)}")
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": {case: asdict(result) for case, result in results.items()},
+    }
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        sys.exit(1 if failed else 0)
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+        for case, result in results.items():
+            before = baseline.get(case, {}).get("seconds")
+            if before is None:
+                continue
+            if (
+                result.seconds > before * (1 + args.threshold)
+                and result.seconds - before > MIN_SECONDS
+            ):
+                failed = True
+                print(
+                    f"REGRESSION {case} seconds: {before:.3f} -> {result.seconds:.3f} ({result.seconds / before:.2f}x)"
+                )
+    else:
+        print(
+            f"No baseline at {args.baseline}, run with --update_baseline to create it"
+        )
+
+    if failed:
+        sys.exit(1)
+    print("No heavy import and no startup regression")
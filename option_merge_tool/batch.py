@@ -0,0 +1,268 @@
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+import traceback
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass
+from glob import glob
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from option_merge_tool.cache import create_cache
+from option_merge_tool.log import logger, setup_logger
+from option_merge_tool.merge import merge
+from option_merge_tool.metrics import profiled
+from option_merge_tool.output import OUTPUT_EXTENSIONS
+from option_merge_tool.paths import output_directory
+from option_merge_tool.preflight import PreflightError
+
+
+if TYPE_CHECKING:
+    from collections.abc import Collection
+    from typing import Final
+
+    from option_merge_tool.settings import OutputFormat, Settings
+
+INPUT_EXTENSIONS: Final[tuple[str, ...]] = (".xlsx", ".csv", ".tsv")
+
+
+@dataclass(slots=True, frozen=True)
+class BatchResult:
+    input_file: str
+    output_filename: str
+    elapsed: float
+    input_rows: int = 0
+    output_rows: int = 0
+    error: str | None = None
+
+    @property
+    def is_failed(self) -> bool:
+        return self.error is not None
+
+
+def find_input_files(batch: str) -> list[str]:
+    """
+    Lists the input files of a batch, which is either a directory (every .xlsx/.csv/.tsv file in it)
+    or a glob pattern. Excel lock files (~$*.xlsx) are skipped.
+    """
+    if os.path.isdir(batch):
+        files = [
+            os.path.join(batch, name)
+            for name in os.listdir(batch)
+            if name.lower().endswith(INPUT_EXTENSIONS)
+        ]
+    else:
+        files = glob(batch)
+
+    return sorted(
+        file
+        for file in files
+        if os.path.isfile(file) and not Path(file).name.startswith("~$")
+    )
+
+
+def batch_output_filename(
+    input_file: str, output_format: OutputFormat = "xlsx", name: str | None = None
+) -> str:
+    """MERGED_OPTIONS_<name>.xlsx in the output directory, `name` is the stem of the input file by default."""
+    return os.path.join(
+        output_directory(),
+        f"MERGED_OPTIONS_{name or Path(input_file).stem}{OUTPUT_EXTENSIONS[output_format]}",
+    )
+
+
+def unique_output_filename(output_filename: str, taken: Collection[str]) -> str:
+    """MERGED_OPTIONS_a.xlsx -> MERGED_OPTIONS_a_2.xlsx (then _3, ...) while the name is in `taken`."""
+    # ? Compared without the case, as Windows and macOS file systems do
+    taken = {os.path.normcase(filename).lower() for filename in taken}
+    stem, extension = os.path.splitext(output_filename)
+    candidate, number = output_filename, 1
+    while os.path.normcase(candidate).lower() in taken:
+        number += 1
+        candidate = f"{stem}_{number}{extension}"
+
+    return candidate
+
+
+def batch_output_filenames(
+    input_files: Collection[str], output_format: OutputFormat = "xlsx"
+) -> dict[str, str]:
+    """
+    The output file of every input file of a batch. Input files with the same name (e.g. a.xlsx
+    and a.csv, or a.xlsx of two directories) would overwrite each other's output, so theirs also
+    have the extension of the input file (MERGED_OPTIONS_a_csv.xlsx) and a number when needed.
+    """
+    stems = Counter(Path(input_file).stem.lower() for input_file in input_files)
+    filenames = {
+        input_file: batch_output_filename(input_file, output_format)
+        for input_file in input_files
+        if stems[Path(input_file).stem.lower()] == 1
+    }
+    for input_file in input_files:
+        if input_file in filenames:
+            continue
+        path = Path(input_file)
+        filenames[input_file] = unique_output_filename(
+            batch_output_filename(
+                input_file, output_format, f"{path.stem}_{path.suffix.lstrip('.')}"
+            ),
+            filenames.values(),
+        )
+
+    return filenames
+
+
+def initialize_worker(settings: Settings) -> None:
+    setup_logger(test_mode=settings.test_mode, log_file=settings.log_file)
+
+
+def merge_file(
+    input_file: str, settings: Settings, output_filename: str | None = None
+) -> BatchResult:
+    if output_filename is None:
+        output_filename = batch_output_filename(
+            input_file, settings.output_format or "xlsx"
+        )
+    start = time.perf_counter()
+
+    # ? The files are merged in the worker processes, so each one has its own profile
+    profile = (
+        profiled(settings.profile_dir, Path(input_file).stem)
+        if settings.profile_dir is not None
+        else nullcontext()
+    )
+
+    try:
+        with profile:
+            result = merge(
+                input_file,
+                settings.template_file,
+                settings.output_column,
+                settings.first_column,
+                settings.second_column,
+                settings.join_by,
+                settings.column_to_dropna,
+                settings.columns_to_drop_dulicates,
+                reader_backend=settings.reader_backend,
+                cache=create_cache(settings.cache_dir, settings.cache_max_mb),
+                output_filename=output_filename,
+                metrics_dir=settings.metrics_dir,
+                lean_memory=settings.lean_memory,
+                state_dir=settings.state_dir,
+                memory_budget_mb=settings.memory_budget_mb,
+                extra_merges=settings.extra_merges,
+                template_cache_dir=settings.template_cache_dir,
+                sheets=settings.sheets,
+                shard_rows=settings.shard_rows,
+                shard_by=settings.shard_by,
+            )
+    except PreflightError as err:
+        logger.error(
+            "Failed to merge <RED>{}</RED>, the settings do not match the files:\n{}",
+            Path(input_file).name,
+            err,
+        )
+        return BatchResult(
+            input_file=input_file,
+            output_filename=output_filename,
+            elapsed=time.perf_counter() - start,
+            error=str(err),
+        )
+    except Exception as err:
+        # ? The error text is passed as an argument so that loguru does not parse it as color markup
+        logger.error(
+            "Failed to merge <RED>{}</RED>: {!r}\n{}",
+            Path(input_file).name,
+            err,
+            traceback.format_exc(),
+        )
+        return BatchResult(
+            input_file=input_file,
+            output_filename=output_filename,
+            elapsed=time.perf_counter() - start,
+            error=repr(err),
+        )
+
+    return BatchResult(
+        input_file=input_file,
+        output_filename=result.output_filename,
+        elapsed=time.perf_counter() - start,
+        input_rows=result.input_rows,
+        output_rows=result.output_rows,
+    )
+
+
+def log_summary(results: list[BatchResult], elapsed: float) -> None:
+    for result in results:
+        name = Path(result.input_file).name
+        if result.is_failed:
+            logger.error(
+                "{}: FAILED after {:.2f}s ({})", name, result.elapsed, result.error
+            )
+        else:
+            logger.info(
+                f"{name}: {result.input_rows} rows -> {result.output_rows} rows in {result.elapsed:.2f}s"
+            )
+
+    failed = sum(result.is_failed for result in results)
+    logger.log(
+        "ACTION",
+        f"Batch finished in {elapsed:.2f}s: <GREEN>{len(results) - failed} succeeded</GREEN>, <RED>{failed} failed</RED>",
+    )
+
+
+def run_batch(settings: Settings, batch: str) -> list[BatchResult]:
+    """
+    Merges every input file of the batch in a pool of worker processes, each file into its own
+    output file. A file that fails is reported in the summary and does not stop the others.
+    """
+    input_files = find_input_files(batch)
+    if not input_files:
+        logger.warning(f"No input file found for the batch: {batch}")
+        return []
+
+    workers = min(settings.workers, len(input_files))
+    logger.info(
+        f"Merging <BLUE><white>{len(input_files)}</white></BLUE> files with {workers} workers"
+    )
+
+    output_filenames = batch_output_filenames(
+        input_files, settings.output_format or "xlsx"
+    )
+    start = time.perf_counter()
+    results: list[BatchResult] = []
+    # ? spawn gives the same worker startup (and logger setup) on Windows and Linux
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=initialize_worker,
+        initargs=(settings,),
+    ) as executor:
+        futures = {
+            executor.submit(
+                merge_file, input_file, settings, output_filenames[input_file]
+            ): input_file
+            for input_file in input_files
+        }
+        for future in as_completed(futures):
+            try:
+                results.append(future.result())
+            except Exception as err:  # ? e.g. the worker process died
+                results.append(
+                    BatchResult(
+                        input_file=futures[future],
+                        output_filename=output_filenames[futures[future]],
+                        elapsed=time.perf_counter() - start,
+                        error=repr(err),
+                    )
+                )
+
+    results.sort(key=lambda result: result.input_file)
+    log_summary(results, time.perf_counter() - start)
+
+    return results
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from option_merge_tool.log import logger
+
+
+if TYPE_CHECKING:
+    from collections.abc import Collection
+    from typing import Final
+
+CACHE_VERSION: Final[int] = 1
+CACHE_EXTENSION: Final[str] = ".feather"
+HASH_CHUNK_SIZE: Final[int] = 1 << 20
+
+
+def is_pyarrow_available() -> bool:
+    try:
+        import pyarrow  # type: ignore # noqa: F401
+    except ImportError:
+        return False
+
+    return True
+
+
+def file_fingerprint(file: str) -> dict[str, str | int]:
+    """Identifies the content of a file by its path, size, modification time and BLAKE2 hash."""
+    path = os.path.realpath(file)
+    stat = os.stat(path)
+
+    content_hash = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            content_hash.update(chunk)
+
+    return {
+        "path": path,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "hash": content_hash.hexdigest(),
+    }
+
+
+@dataclass(slots=True, frozen=True)
+class InputCache:
+    """
+    On-disk cache of parsed input files in the Arrow IPC (Feather) format.
+
+    Entries are keyed by the file fingerprint and the parse options, so a changed file never
+    hits a stale entry. When the cache grows past `max_bytes`, the least recently used entries
+    are removed.
+    """
+
+    directory: str
+    max_bytes: int
+
+    def key(
+        self,
+        file: str,
+        *,
+        kind: str,
+        backend: str,
+        columns: Collection[str] | None = None,
+        categories: Collection[str] | None = None,
+        sheet: str | None = None,
+        fingerprint: dict[str, str | int] | None = None,
+    ) -> str:
+        """`fingerprint` is the file_fingerprint of the file when the caller already computed it."""
+        description = {
+            "version": CACHE_VERSION,
+            "file": file_fingerprint(file) if fingerprint is None else fingerprint,
+            "kind": kind,
+            "backend": backend,
+            "columns": None if columns is None else sorted(columns),
+        }
+        if categories is not None:
+            description["categories"] = sorted(categories)
+        # ? Only the other sheets are in the key, so the entries of the first sheet are kept
+        if sheet is not None:
+            description["sheet"] = sheet
+
+        return hashlib.blake2b(
+            json.dumps(description, ensure_ascii=False).encode("utf-8"),
+            digest_size=16,
+        ).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}{CACHE_EXTENSION}")
+
+    def load(self, key: str) -> pd.DataFrame | None:
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+
+        try:
+            dataframe = pd.read_feather(path)
+        except Exception as err:
+            logger.debug("Ignoring the unreadable cache entry {}: {!r}", path, err)
+            return None
+
+        os.utime(path)  # ? Marks the entry as recently used for the eviction
+
+        # ? Arrow gives None for the missing strings, pandas' readers give NaN
+        return dataframe.mask(dataframe.isna(), np.nan)
+
+    def store(self, key: str, dataframe: pd.DataFrame) -> None:
+        # ? Arrow only stores string column names (e.g. not the numbers of a header)
+        if not all(isinstance(column, str) for column in dataframe.columns):
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        path = self._path(key)
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            dataframe.reset_index(drop=True).to_feather(temporary_path)
+            os.replace(temporary_path, path)
+        except Exception as err:
+            logger.debug("Could not write the cache entry {}: {!r}", path, err)
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            return
+
+        self.evict()
+
+    def evict(self) -> None:
+        entries: list[tuple[float, int, str]] = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name.endswith(CACHE_EXTENSION):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:  # ? Already removed by another process
+                pass
+            total -= size
+
+
+def create_cache(directory: str | None, max_megabytes: int) -> InputCache | None:
+    """Returns the input cache, or None when it is disabled or pyarrow is not installed."""
+    if directory is None:
+        return None
+
+    if not is_pyarrow_available():
+        logger.debug("The parsed input cache is disabled (pyarrow is not installed)")
+        return None
+
+    return InputCache(directory=directory, max_bytes=max_megabytes * 1024 * 1024)
@@ -0,0 +1,393 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict
+from datetime import datetime
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from option_merge_tool.batch import (
+    BatchResult,
+    batch_output_filename,
+    find_input_files,
+    initialize_worker,
+    merge_file,
+    unique_output_filename,
+)
+from option_merge_tool.log import logger
+from option_merge_tool.paths import today_date
+from option_merge_tool.template import load_template
+
+
+if TYPE_CHECKING:
+    from concurrent.futures import Future
+    from typing import Any, Final
+
+    from option_merge_tool.settings import Settings
+
+HOST: Final[str] = "127.0.0.1"
+RECENT_RESULTS: Final[int] = 50
+# ? Merged (or failed) input files are moved into these subdirectories of the watched directory
+PROCESSED_DIRECTORY: Final[str] = "processed"
+FAILED_DIRECTORY: Final[str] = "failed"
+
+
+def _initialize_daemon_worker(settings: Settings) -> None:
+    initialize_worker(settings)
+    # ? Ctrl+C stops the daemon, which lets the running merges finish instead of interrupting them
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # ? The template is compiled once per worker, every merge then maps and fills it from memory
+    try:
+        load_template(settings.template_file, cache_dir=settings.template_cache_dir)
+    except OSError as err:
+        logger.warning("Could not read the template header: {!r}", err)
+
+
+class MergeDaemon:
+    """
+    Watches a directory and merges every input file dropped into it, until it is stopped.
+
+    The merges run in a pool of long-lived worker processes, so the imports and the parsed
+    template header are paid once per worker instead of once per file. A file is only queued
+    once its size and modification time did not change between two scans (i.e. once its copy
+    is complete), the queue is bounded by `queue_size` and a full queue leaves the file in the
+    directory for a later scan. Files can also be submitted through the HTTP endpoint.
+    """
+
+    def __init__(self, settings: Settings, watch_dir: str) -> None:
+        self.settings = settings
+        self.watch_dir = watch_dir
+        self.started_at = datetime.now()
+
+        # ? The output file is picked when the merge starts, in the output directory of that day
+        self._queue: queue.Queue[str] = queue.Queue(maxsize=settings.queue_size)
+        self._slots = threading.BoundedSemaphore(settings.workers)
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._executor = self._create_executor()
+
+        # ? Files queued or running, so that a scan does not queue them a second time
+        self._active: set[str] = set()
+        self._running: set[str] = set()
+        # ? Size and modification time of the files of the last scan, and of the merged files that could not be moved
+        self._last_scan: dict[str, tuple[int, int]] = {}
+        self._done: dict[str, tuple[int, int]] = {}
+        # ? Input file of every output file written today, a.xlsx and a.csv get different output files
+        self._outputs: dict[str, str] = {}
+
+        self._processed = 0
+        self._failed = 0
+        self._recent: deque[BatchResult] = deque(maxlen=RECENT_RESULTS)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # ? spawn gives the same worker startup (and logger setup) on Windows and Linux
+        return ProcessPoolExecutor(
+            max_workers=self.settings.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_initialize_daemon_worker,
+            initargs=(self.settings,),
+        )
+
+    def submit(self, input_file: str) -> bool:
+        """Queues an input file, False when the queue is full (or the file is already queued)."""
+        input_file = os.path.abspath(input_file)
+        with self._lock:
+            if input_file in self._active:
+                return False
+            try:
+                self._queue.put_nowait(input_file)
+            except queue.Full:
+                return False
+            self._active.add(input_file)
+
+        logger.info(f"Queued <BLUE><white>{Path(input_file).name}</white></BLUE>")
+        return True
+
+    def _output_filename(self, input_file: str) -> str:
+        """The output file of a merge that starts now, in the output directory of today."""
+        output_filename = batch_output_filename(
+            input_file, self.settings.output_format or "xlsx"
+        )
+        directory = os.path.dirname(output_filename)
+        with self._lock:
+            # ? The outputs of an earlier day are in another directory, they cannot collide anymore
+            self._outputs = {
+                output: source
+                for output, source in self._outputs.items()
+                if os.path.dirname(output) == directory
+            }
+            # ? The same input file (e.g. dropped again) replaces its output, another one of the same name gets a numbered one
+            output_filename = unique_output_filename(
+                output_filename,
+                [
+                    output
+                    for output, source in self._outputs.items()
+                    if source != input_file
+                ],
+            )
+            self._outputs[output_filename] = input_file
+
+        return output_filename
+
+    def accepts(self, input_file: str) -> bool:
+        """Whether the file is in the watched directory (or one of its subdirectories), the only files /submit takes."""
+        root = os.path.realpath(self.watch_dir)
+        try:
+            return os.path.commonpath([os.path.realpath(input_file), root]) == root
+        except ValueError:  # ? e.g. on another drive
+            return False
+
+    def scan(self) -> None:
+        signatures: dict[str, tuple[int, int]] = {}
+        for file in find_input_files(self.watch_dir):
+            input_file = os.path.abspath(file)
+            try:
+                stat = os.stat(input_file)
+            except OSError:  # ? Removed since it was listed
+                continue
+
+            signature = (stat.st_size, stat.st_mtime_ns)
+            signatures[input_file] = signature
+            if (
+                self._last_scan.get(input_file) == signature
+                and self._done.get(input_file) != signature
+            ):
+                self.submit(input_file)
+
+        self._last_scan = signatures
+
+    def _dispatch(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                input_file = self._queue.get(timeout=self.settings.poll_interval)
+            except queue.Empty:
+                continue
+
+            self._slots.acquire()
+            with self._lock:
+                self._running.add(input_file)
+            output_filename = self._output_filename(input_file)
+            try:
+                future = self._executor.submit(
+                    merge_file, input_file, self.settings, output_filename
+                )
+            except BrokenProcessPool:
+                # ? A worker process died (e.g. out of memory), the next files get a new pool
+                logger.warning("The worker pool is broken, starting a new one")
+                self._executor.shutdown(wait=False)
+                self._executor = self._create_executor()
+                future = self._executor.submit(
+                    merge_file, input_file, self.settings, output_filename
+                )
+            future.add_done_callback(partial(self._merged, input_file, output_filename))
+
+    def _merged(
+        self, input_file: str, output_filename: str, future: Future[BatchResult]
+    ) -> None:
+        try:
+            result = future.result()
+        except Exception as err:  # ? e.g. the worker process died
+            result = BatchResult(
+                input_file=input_file,
+                output_filename=output_filename,
+                elapsed=0.0,
+                error=repr(err),
+            )
+        self._finish(input_file, result)
+
+    def _finish(self, input_file: str, result: BatchResult) -> None:
+        if result.is_failed:
+            logger.error("{}: FAILED ({})", Path(input_file).name, result.error)
+        else:
+            logger.success(
+                f"{Path(input_file).name}: {result.input_rows} rows -> {result.output_rows} rows in {result.elapsed:.2f}s"
+            )
+
+        # ? A file of failed/ submitted again is also moved, into processed/ once it is merged
+        if os.path.dirname(input_file) in (
+            os.path.abspath(self.watch_dir),
+            os.path.abspath(os.path.join(self.watch_dir, FAILED_DIRECTORY)),
+        ):
+            self._move(input_file, result)
+
+        with self._lock:
+            self._active.discard(input_file)
+            self._running.discard(input_file)
+            self._recent.append(result)
+            if result.is_failed:
+                self._failed += 1
+            else:
+                self._processed += 1
+        self._slots.release()
+
+    def _move(self, input_file: str, result: BatchResult) -> None:
+        """Moves a merged file of the watched directory out of the way, so that it is not merged again."""
+        directory = (
+            os.path.join(self.watch_dir, FAILED_DIRECTORY)
+            if result.is_failed
+            else os.path.join(self.watch_dir, PROCESSED_DIRECTORY, today_date())
+        )
+        if os.path.dirname(input_file) == os.path.abspath(directory):
+            return  # ? A file of failed/ that failed again stays there
+        try:
+            stat = os.stat(input_file)
+        except OSError:  # ? Already removed
+            return
+
+        # ? A file of the same name merged earlier (e.g. dropped again) is kept, this one gets a number
+        target = os.path.join(directory, Path(input_file).name)
+        stem, extension = os.path.splitext(target)
+        number = 1
+        while os.path.exists(target):
+            number += 1
+            target = f"{stem}_{number}{extension}"
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            os.replace(input_file, target)
+        except OSError as err:
+            # ? e.g. the file is still open in Excel, it is skipped until it changes
+            logger.warning("Could not move {}: {!r}", Path(input_file).name, err)
+            self._done[input_file] = (stat.st_size, stat.st_mtime_ns)
+
+    def status(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                "watch_dir": os.path.abspath(self.watch_dir),
+                "started_at": self.started_at.isoformat(timespec="seconds"),
+                "today_date": today_date(),
+                "workers": self.settings.workers,
+                "queue_size": self.settings.queue_size,
+                "queued": self._queue.qsize(),
+                "running": sorted(self._running),
+                "processed": self._processed,
+                "failed": self._failed,
+                "recent": [asdict(result) for result in self._recent],
+            }
+
+    def serve(self) -> None:
+        """Scans the watched directory every `poll_interval` seconds until stop() is called (or Ctrl+C)."""
+        os.makedirs(self.watch_dir, exist_ok=True)
+        dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+        dispatcher.start()
+
+        server = (
+            DaemonHTTPServer((HOST, self.settings.port), self)
+            if self.settings.port
+            else None
+        )
+        if server is not None:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            logger.info(
+                f"Status on http://{HOST}:{server.server_port}/status, files are submitted with POST /submit"
+            )
+
+        logger.log(
+            "ACTION",
+            f"Watching <BLUE><white>{os.path.abspath(self.watch_dir)}</white></BLUE> with {self.settings.workers} workers (Ctrl+C to stop)",
+        )
+        try:
+            while not self._stopping.is_set():
+                self.scan()
+                self._stopping.wait(self.settings.poll_interval)
+        except KeyboardInterrupt:
+            logger.info("Stopping, the running merges are finished first ...")
+        finally:
+            self._stopping.set()
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            dispatcher.join()
+            self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def stop(self) -> None:
+        self._stopping.set()
+
+
+class DaemonHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], merge_daemon: MergeDaemon) -> None:
+        super().__init__(address, DaemonRequestHandler)
+        self.merge_daemon = merge_daemon
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /status gives the state of the daemon as JSON.
+    POST /submit with {"input_file": "..."} queues a file (202), 503 when the queue is full.
+    Only the files under the watched directory are taken (403 for the others), the endpoint
+    does not let a local client read any file the daemon can read.
+    """
+
+    server: DaemonHTTPServer
+
+    def _send_json(self, status: int, body: dict[str, Any]) -> None:
+        content = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") != "/status":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+
+        self._send_json(200, self.server.merge_daemon.status())
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != "/submit":
+            self._send_json(404, {"error": f"Unknown path: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            input_file = json.loads(self.rfile.read(length) or b"{}")["input_file"]
+            if not isinstance(input_file, str):
+                raise TypeError(input_file)
+        except (ValueError, KeyError, TypeError):
+            self._send_json(
+                400, {"error": 'Expected a JSON body {"input_file": "..."}'}
+            )
+            return
+
+        if not self.server.merge_daemon.accepts(input_file):
+            self._send_json(
+                403,
+                {
+                    "error": f"Only the files under {os.path.abspath(self.server.merge_daemon.watch_dir)} can be submitted"
+                },
+            )
+            return
+
+        if not os.path.isfile(input_file):
+            self._send_json(404, {"error": f"No such file: {input_file}"})
+            return
+
+        if not self.server.merge_daemon.submit(input_file):
+            self._send_json(503, {"error": "The queue is full or the file is queued"})
+            return
+
+        # ? The output file is only picked once the merge starts, /status lists it with the result
+        self._send_json(202, {"input_file": os.path.abspath(input_file)})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug("{} - {}", self.address_string(), format % args)
+
+
+def run_daemon(settings: Settings, watch_dir: str) -> None:
+    MergeDaemon(settings, watch_dir).serve()
@@ -0,0 +1,337 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from option_merge_tool.metrics import RunMetrics
+
+
+if TYPE_CHECKING:
+    from collections.abc import Callable, Sequence
+    from typing import Any
+
+    Aggregate = Callable[[pd.DataFrame, Sequence[str], str, str], pd.Series]
+
+
+def drop_empty_rows(dataframe: pd.DataFrame, column_to_dropna: str) -> pd.DataFrame:
+    """
+    Removes the rows whose `column_to_dropna` cell is either NaN or an empty string.
+
+    Args:
+        dataframe (pd.DataFrame): The DataFrame read from the input file.
+        column_to_dropna (str): Name of the column that must have a value for the row to be kept.
+    Returns:
+        pd.DataFrame: The filtered DataFrame with a fresh RangeIndex.
+    """
+    column = dataframe[column_to_dropna]
+    not_empty = (column != "") & (column.notna())
+
+    return dataframe[not_empty].reset_index(drop=True)
+
+
+def sort_by_keys(dataframe: pd.DataFrame, columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Sorts the DataFrame by the key columns, keeping the original file order inside each group.
+
+    This is the only sort of the whole merge, every later stage relies on its ordering.
+    """
+    return dataframe.sort_values(by=list(columns), kind="stable", ignore_index=True)
+
+
+def stringified(column: pd.Series, na_rep: str = "nan") -> pd.Series:
+    """
+    Same values as `column.astype(str)`, with `na_rep` for the NaN values. A categorical column
+    stays categorical (with sorted categories), only its categories are converted.
+    """
+    if not isinstance(column.dtype, pd.CategoricalDtype):
+        if na_rep != "nan":
+            column = column.where(column.notna(), na_rep)
+        return column.astype(str)
+
+    # ? The code -1 of NaN picks the `na_rep` appended at the end
+    labels = np.append(column.cat.categories.astype(str).to_numpy(dtype=object), na_rep)
+    stringified = pd.Categorical(labels)
+
+    return pd.Series(
+        pd.Categorical.from_codes(
+            stringified.codes[column.cat.codes.to_numpy()], dtype=stringified.dtype
+        ),
+        index=column.index,
+        name=column.name,
+    )
+
+
+def aggregate_options(
+    dataframe: pd.DataFrame,
+    columns: Sequence[str],
+    output_column: str,
+    join_by: str,
+) -> pd.Series:
+    """
+    Joins the `output_column` values of every `columns` group into a single string.
+
+    Only the key and value columns are converted to `str`. A NaN value takes part in the join as
+    an empty string (e.g. "red,,blue"), which is what the "nan" of the previous whole-frame
+    `astype(str)` became after the cleanup. Categorical keys are grouped on their codes, without
+    building a string per row.
+
+    Args:
+        dataframe (pd.DataFrame): DataFrame already sorted by `sort_by_keys`.
+        columns (Sequence[str]): The (first_column, second_column) key.
+        output_column (str): Name of the column whose values are joined.
+        join_by (str): Separator placed between the joined values.
+    Returns:
+        pd.Series: The joined values indexed by a sorted MultiIndex of the stringified keys.
+    """
+    keys = [stringified(dataframe[column]) for column in columns]
+
+    aggregated = (
+        stringified(dataframe[output_column], na_rep="")
+        .groupby(keys, sort=True, observed=True)
+        .agg(join_by.join)
+    )
+
+    # ? With observed=True, pandas does not fully sort the groups of several categorical keys
+    if any(isinstance(key.dtype, pd.CategoricalDtype) for key in keys):
+        aggregated = aggregated.sort_index()
+
+    return aggregated
+
+
+def first_rows_of_groups(
+    dataframe: pd.DataFrame,
+    aggregated: pd.Series,
+    columns: Sequence[str],
+    output_column: str,
+) -> pd.DataFrame:
+    """
+    Keeps the first row of every group of `aggregated` and puts the joined value of its group in
+    `output_column`. The lookup is a single hash join on the key instead of one boolean mask per row.
+    """
+    index = pd.MultiIndex.from_frame(dataframe[list(columns)])
+
+    # ? Rows with a NaN key never match the stringified keys of the aggregation
+    first_rows = dataframe[index.isin(aggregated.index)].drop_duplicates(
+        subset=list(columns), keep="first"
+    )
+
+    indexer = aggregated.index.get_indexer(
+        pd.MultiIndex.from_frame(first_rows[list(columns)])
+    )
+    is_matched = indexer >= 0
+    if is_matched.any():
+        first_rows.loc[is_matched, output_column] = aggregated.to_numpy()[
+            indexer[is_matched]
+        ]
+
+    return first_rows
+
+
+def match_options(
+    dataframe: pd.DataFrame,
+    aggregated: pd.Series,
+    columns: Sequence[str],
+    output_column: str,
+) -> pd.DataFrame:
+    """
+    Keeps the first row of every group and puts the joined value of its group in `output_column`.
+
+    Args:
+        dataframe (pd.DataFrame): DataFrame already sorted by `sort_by_keys`.
+        aggregated (pd.Series): The result of `aggregate_options` for the same DataFrame.
+        columns (Sequence[str]): The (first_column, second_column) key.
+        output_column (str): Name of the column that receives the joined values.
+    Returns:
+        pd.DataFrame: One row per group, in key order.
+    """
+    first_rows = first_rows_of_groups(dataframe, aggregated, columns, output_column)
+
+    # ? Positional comparison of both (sorted) indexes, kept as is so that the output stays identical to the previous matching loop
+    n_rows = len(first_rows)
+    index = pd.MultiIndex.from_frame(dataframe[list(columns)][:n_rows])
+    predicate = index.isin(aggregated.index[:n_rows])
+
+    return first_rows[predicate].reset_index(drop=True)
+
+
+def fill_merged_options(
+    merged: pd.DataFrame,
+    aggregated: pd.Series,
+    columns: Sequence[str],
+    output_column: str,
+) -> pd.DataFrame:
+    """
+    Puts the joined values of another merge of the same input into `output_column` of the merged
+    rows, looked up by the `columns` key of that merge. Rows without a group keep their value.
+    """
+    indexer = aggregated.index.get_indexer(
+        pd.MultiIndex.from_frame(merged[list(columns)])
+    )
+    is_matched = indexer >= 0
+    if is_matched.any():
+        merged = merged.copy()
+        merged.loc[is_matched, output_column] = aggregated.to_numpy()[
+            indexer[is_matched]
+        ]
+
+    return merged
+
+
+def merge_options(
+    dataframe: pd.DataFrame,
+    *,
+    first_column: str,
+    second_column: str,
+    output_column: str,
+    join_by: str,
+    column_to_dropna: str,
+    metrics: RunMetrics | None = None,
+    aggregate: Aggregate | None = None,
+) -> pd.DataFrame:
+    """
+    Runs the whole merge on an input DataFrame: filter, sort, aggregate and match.
+
+    Args:
+        dataframe (pd.DataFrame): The DataFrame read from the input file.
+        first_column (str): First column of the group key.
+        second_column (str): Second column of the group key.
+        output_column (str): Column whose values are joined per group.
+        join_by (str): Separator placed between the joined values.
+        column_to_dropna (str): Rows with an empty value in this column are ignored.
+        metrics (RunMetrics | None): When given, the filter, groupby and match stages are recorded in it.
+        aggregate (Aggregate | None): Replaces `aggregate_options` (same arguments and result),
+            e.g. with an IncrementalAggregator that reuses the groups of the previous run.
+    Returns:
+        pd.DataFrame: One row per (first_column, second_column) group, sorted by the key,
+        with the joined values in `output_column`.
+    """
+    columns = (first_column, second_column)
+    if metrics is None:
+        metrics = RunMetrics()
+    if aggregate is None:
+        aggregate = aggregate_options
+
+    with metrics.span("filter", len(dataframe)) as span:
+        dataframe = drop_empty_rows(dataframe, column_to_dropna)
+        span.rows_out = len(dataframe)
+
+    with metrics.span("groupby", len(dataframe)) as span:
+        dataframe = sort_by_keys(dataframe, columns)
+        aggregated = aggregate(dataframe, columns, output_column, join_by)
+        span.rows_out = len(aggregated)
+
+    with metrics.span("match", len(dataframe)) as span:
+        dataframe = match_options(dataframe, aggregated, columns, output_column)
+        span.rows_out = len(dataframe)
+
+    return dataframe
+
+
+def _normalized_values(
+    column: pd.Series, positions: np.ndarray | None
+) -> np.ndarray | None:
+    """
+    The values of the column at `positions` (every row when None), with the NaN and "nan" cells
+    (exact matches only, e.g. "banana" is kept as is) replaced by empty strings. Categorical
+    columns come back as plain strings.
+
+    Returns None when `positions` is None and the column has nothing to replace, so that an
+    already normalized column is never copied.
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        # ? The cleanup only runs on the categories, then every row takes the value of its code
+        categories = column.cat.categories.to_numpy(dtype=object)
+        labels = np.append(np.where(categories == "nan", "", categories), "")
+        codes = column.cat.codes.to_numpy()
+        return labels[codes if positions is None else codes[positions]]
+
+    values = column.to_numpy()
+    if positions is not None:
+        values = values[positions]
+
+    is_null = pd.isna(values)
+    if values.dtype == object:
+        is_null |= values == "nan"
+    if not is_null.any():
+        return None if positions is None else values
+
+    # ? The values taken at `positions` are already a copy
+    values = values.astype(object, copy=positions is None)
+    values[is_null] = ""
+    return values
+
+
+def normalize_options(
+    dataframe: pd.DataFrame,
+    column_to_dropna: str,
+    columns_to_drop_dulicates: Sequence[str] = (),
+) -> pd.DataFrame:
+    """
+    Single cleanup stage of the merged DataFrame, also used before the template fill:
+
+    - removes the rows whose `column_to_dropna` is NaN or an empty string,
+    - replaces the NaN and "nan" cells with empty strings (exact matches, without any regex),
+    - removes the rows whose `columns_to_drop_dulicates` repeat an earlier row.
+
+    The rows to keep are found first, from the `column_to_dropna` and the duplicate columns
+    only, then every column is taken once at the kept positions. Only the columns with NaN
+    or "nan" cells are rewritten, and an already normalized DataFrame is returned as is.
+
+    Args:
+        dataframe (pd.DataFrame): The merged DataFrame (or any DataFrame to fill into the template).
+        column_to_dropna (str): Rows with an empty value in this column are removed.
+        columns_to_drop_dulicates (Sequence[str]): Columns of the duplicate check, no check when empty.
+    Returns:
+        pd.DataFrame: The kept rows, with their original index labels.
+    """
+    column = dataframe[column_to_dropna]
+    # ? Also removes the line 2 row which previously included meta information for columns (it is now removed in latest Excel DB file)
+    is_kept = (column.notna() & (column != "")).to_numpy()
+    positions = None if is_kept.all() else np.flatnonzero(is_kept)
+
+    normalized: dict[Any, np.ndarray | None] = {}
+    if columns_to_drop_dulicates:
+        # ? The duplicate check runs on the normalized values, so a NaN and an empty cell are the same value
+        subset = list(dict.fromkeys(columns_to_drop_dulicates))
+        normalized = {
+            name: _normalized_values(dataframe[name], positions) for name in subset
+        }
+        keys = {
+            position: dataframe[name].to_numpy()
+            if normalized[name] is None
+            else normalized[name]
+            for position, name in enumerate(subset)
+        }
+        is_duplicated = pd.DataFrame(keys, copy=False).duplicated().to_numpy()
+        if is_duplicated.any():
+            positions = (
+                np.flatnonzero(~is_duplicated)
+                if positions is None
+                else positions[~is_duplicated]
+            )
+            normalized = {
+                name: values[~is_duplicated]
+                for name, values in zip(subset, keys.values())
+            }
+
+    columns = [
+        normalized[name]
+        if name in normalized
+        else _normalized_values(dataframe[name], positions)
+        for name in dataframe.columns
+    ]
+    if positions is None and all(values is None for values in columns):
+        return dataframe
+
+    result = pd.DataFrame(
+        {
+            position: dataframe[name].to_numpy() if values is None else values
+            for position, (name, values) in enumerate(zip(dataframe.columns, columns))
+        },
+        index=dataframe.index if positions is None else dataframe.index[positions],
+    )
+    result.columns = dataframe.columns
+
+    return result
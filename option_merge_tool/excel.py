@@ -3,12 +3,20 @@ from __future__ import annotations
 import os
 
 from dataclasses import dataclass
+from typing import TYPE_CHECKING
 
-import numpy as np
 import pandas as pd
 
-from excelsheet import col_to_excel, write_to_excel_template_cell_openpyxl
-from openpyxl import load_workbook
+from option_merge_tool.engine import normalize_options
+from option_merge_tool.log import logger
+from option_merge_tool.paths import TEMPORARY_SUFFIX
+from option_merge_tool.reader import peek_header, read_table
+from option_merge_tool.template import load_template
+
+
+if TYPE_CHECKING:
+    from option_merge_tool.cache import InputCache
+    from option_merge_tool.settings import ReaderBackend
 
 
 @dataclass(slots=True, frozen=True)
@@ -33,32 +41,19 @@ def update_column_mapping(
         dict[int, ExcelColumn]: A dictionary mapping the index of each old column (int) to an ExcelColumn object,
         for columns whose names exist in both old_columns and new_columns.
     """
+    from excelsheet import col_to_excel
+
     col_dict_old: dict[str, str] = {
-        old_columns[x - 1]: col_to_excel(x) for x in range(1, len(old_columns) + 1)
+        name: col_to_excel(x) for x, name in enumerate(old_columns, start=1)
     }
+    new_names = frozenset(new_columns)
 
-    excel_columns_old = [
-        ExcelColumn(name, alphabet) for name, alphabet in col_dict_old.items()
-    ]
-
-    col_dict_new: dict[str, str] = {
-        new_columns[x - 1]: col_to_excel(x) for x in range(1, len(new_columns) + 1)
+    return {
+        idx: ExcelColumn(name, alphabet)
+        for idx, (name, alphabet) in enumerate(col_dict_old.items())
+        if name in new_names
     }
 
-    excel_columns_new = [
-        ExcelColumn(name, alphabet) for name, alphabet in col_dict_new.items()
-    ]
-
-    new_column_mapping: dict[int, ExcelColumn] = {}
-    for idx, old_column in enumerate(excel_columns_old):
-        for _, new_column in enumerate(excel_columns_new):
-            if new_column.name == old_column.name:
-                new_column_mapping[idx] = ExcelColumn(
-                    old_column.name, old_column.alphabet
-                )
-
-    return new_column_mapping
-
 
 def get_column_mapping(
     old_data: pd.DataFrame | str, new_data: pd.DataFrame | str
@@ -66,16 +61,43 @@ def get_column_mapping(
     if isinstance(old_data, pd.DataFrame):
         old_columns = tuple(old_data.columns)
     else:
-        old_columns = tuple(pd.read_excel(old_data).columns)
+        # ? The old data is the template, its header comes from the compiled template
+        old_columns = load_template(old_data).header
 
     if isinstance(new_data, pd.DataFrame):
         new_columns = tuple(new_data.columns)
     else:
-        new_columns = tuple(pd.read_excel(new_data).columns)
+        new_columns = peek_header(new_data)
 
     return update_column_mapping(old_columns, new_columns)
 
 
+def apply_column_mapping(
+    dataframe: pd.DataFrame,
+    column_mapping: dict[int, ExcelColumn],
+    column_to_dropna: str,
+) -> pd.DataFrame:
+    """
+    Gives the DataFrame the rows and columns copy_dataframe_to_excel_template would write into
+    the template: the mapped columns in template order, without the rows whose `column_to_dropna`
+    is empty and with empty strings for the NaN values.
+    """
+    dataframe = normalize_options(
+        dataframe[
+            list(
+                dict.fromkeys(
+                    [column_to_dropna, *(attr.name for attr in column_mapping.values())]
+                )
+            )
+        ],
+        column_to_dropna,
+    )
+
+    return dataframe[[attr.name for attr in column_mapping.values()]].reset_index(
+        drop=True
+    )
+
+
 def copy_to_openpyxl_template(
     *,
     dataframe: pd.DataFrame,
@@ -95,6 +117,10 @@ def copy_to_openpyxl_template(
         - The function writes each specified DataFrame column to the corresponding Excel column as defined in the column_mapping.
         - The output file will overwrite any existing file with the same name.
     """
+    # ? openpyxl and excelsheet are only imported by the runs which fill a template with them
+    from excelsheet import write_to_excel_template_cell_openpyxl
+    from openpyxl import load_workbook
+
     wb = load_workbook(template_filename)
     ws = wb.active
 
@@ -108,7 +134,95 @@ def copy_to_openpyxl_template(
         name = attr.name
         write_df_column_to_excel_template_cell_openpyxl(name=name, alphabet=alphabet)
 
-    wb.save(filename.replace(".csv", ".xlsx"))
+    output_filename = filename.replace(".csv", ".xlsx")
+    temporary_filename = f"{output_filename}{TEMPORARY_SUFFIX}"
+    try:
+        wb.save(temporary_filename)
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+
+    os.replace(temporary_filename, output_filename)
+
+
+def copy_to_template(
+    *,
+    dataframe: pd.DataFrame,
+    filename: str,
+    template_filename: str,
+    column_mapping: dict[int, ExcelColumn],
+):
+    """
+    Copies data from a pandas DataFrame into an Excel template, streaming the rows into the sheet XML
+    when the template allows it and falling back to copy_to_openpyxl_template otherwise.
+    The sheet XML is taken from the compiled template, so it is only parsed once per template.
+    Args:
+        dataframe (pd.DataFrame): The DataFrame containing the data to be copied into the Excel template.
+        filename (str): The output filename where the resulting Excel file will be saved. The file will be saved with a '.xlsx' extension.
+        template_filename (str): The path to the Excel template file to be used as a base for the output.
+        column_mapping (dict[int, ExcelColumn]): A dictionary mapping column indices to ExcelColumn objects.
+    """
+    from option_merge_tool.template_writer import (
+        UnsupportedTemplateError,
+        stream_to_template,
+    )
+
+    template = load_template(template_filename)
+    try:
+        if template.sheet is None:
+            raise UnsupportedTemplateError(template.unsupported)
+
+        stream_to_template(
+            dataframe=dataframe,
+            filename=filename,
+            template_filename=template_filename,
+            columns=[(attr.name, attr.alphabet) for attr in column_mapping.values()],
+            sheet=template.sheet,
+        )
+    except UnsupportedTemplateError as err:
+        logger.debug(f"Falling back to openpyxl for the template: {err}")
+        copy_to_openpyxl_template(
+            dataframe=dataframe,
+            filename=filename,
+            template_filename=template_filename,
+            column_mapping=column_mapping,
+        )
+
+
+def copy_dataframe_to_excel_template(
+    *,
+    dataframe: pd.DataFrame,
+    filename: str,
+    template_filename: str,
+    column_mapping: dict[int, ExcelColumn],
+    column_to_dropna: str,
+    current_os: str = "Windows",
+):
+    """
+    Copies an in-memory DataFrame into an Excel template, without writing or reading any intermediate file.
+    Parameters:
+        dataframe (pd.DataFrame): The DataFrame to copy, e.g. the cleaned result of the merge.
+        filename (str): Path of the output file (a .csv name is saved as .xlsx).
+        template_filename (str): Absolute path to the Excel template file.
+        column_mapping (dict[int, ExcelColumn]): Mapping from DataFrame column indices to Excel columns.
+        column_to_dropna (str): Name of the column to use for dropping rows with all NaN values.
+        current_os (str, optional): Operating system name, defaults to "Windows".
+    Raises:
+        OSError: If the template_filename is not an absolute path on Windows.
+    """
+    if not os.path.isabs(template_filename) and current_os == "Windows":
+        raise OSError(f"Absolute path is needed for win32com (got {template_filename})")
+
+    # ? Same normalization as merge(), which makes it a check without any copy of the values for a merged DataFrame
+    dataframe = normalize_options(dataframe, column_to_dropna)
+
+    copy_to_template(
+        dataframe=dataframe,
+        filename=filename,
+        template_filename=template_filename,
+        column_mapping=column_mapping,
+    )
 
 
 def copy_dataframe_cells_to_excel_template(
@@ -118,6 +232,8 @@ def copy_dataframe_cells_to_excel_template(
     column_mapping: dict[int, ExcelColumn],
     column_to_dropna: str,
     current_os: str = "Windows",
+    reader_backend: ReaderBackend = "auto",
+    cache: InputCache | None = None,
 ):
     """
     Copies data from a DataFrame (loaded from a CSV or Excel file) into an Excel template.
@@ -127,27 +243,29 @@ def copy_dataframe_cells_to_excel_template(
         column_mapping (dict[int, ExcelColumn]): Mapping from DataFrame column indices to Excel columns.
         column_to_dropna (str): Name of the column to use for dropping rows with all NaN values.
         current_os (str, optional): Operating system name, defaults to "Windows".
+        reader_backend (ReaderBackend, optional): Backend used to read the input file, defaults to "auto".
+        cache (InputCache | None, optional): On-disk cache of the parsed input file, defaults to None.
     Raises:
         OSError: If the template_filename is not an absolute path on Windows.
     Notes:
-        - The function reads the input file into a DataFrame, drops rows where the specified column is all NaN,
-          replaces remaining NaN values with empty strings, and then copies the data to the Excel template.
+        - The function reads the input file into a DataFrame and hands it to copy_dataframe_to_excel_template,
+          which drops rows where the specified column is empty, replaces NaN (and "nan") values with empty strings
+          through normalize_options, and then copies the data to the Excel template.
         - Requires absolute path for the template file on Windows due to win32com limitations.
     """
-    if not os.path.isabs(template_filename) and current_os == "Windows":
-        raise OSError(f"Absolute path is needed for win32com (got {template_filename})")
-
-    if filename.endswith(".xlsx"):
-        dataframe = pd.read_excel(filename, engine="openpyxl", dtype="str")
-    else:
-        dataframe = pd.read_csv(filename, encoding="utf-8-sig", dtype="str")
-
-    dataframe = dataframe.dropna(subset=[column_to_dropna], how="all")
-    dataframe = dataframe.replace(np.nan, "", regex=True)
+    # ? Only the columns that are written into the template are needed
+    dataframe = read_table(
+        filename,
+        columns=[column_to_dropna, *(attr.name for attr in column_mapping.values())],
+        backend=reader_backend,
+        cache=cache,
+    )
 
-    copy_to_openpyxl_template(
+    copy_dataframe_to_excel_template(
         dataframe=dataframe,
         filename=filename,
         template_filename=template_filename,
         column_mapping=column_mapping,
+        column_to_dropna=column_to_dropna,
+        current_os=current_os,
     )
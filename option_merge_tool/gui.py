@@ -1,7 +1,6 @@
 from __future__ import annotations
 
 import os
-import sys
 
 from dataclasses import dataclass, field
 from enum import IntEnum, auto
@@ -11,22 +10,34 @@ from typing import TYPE_CHECKING, Protocol, cast
 
 import dearpygui.dearpygui as dpg
 
-from option_merge_tool.log import LOGGER_FORMAT_STR, logger
-from option_merge_tool.merge import TODAY_DATE, merge, read_excel
+from option_merge_tool.cache import create_cache
+from option_merge_tool.log import logger, setup_logger
+from option_merge_tool.output import with_output_format
+from option_merge_tool.paths import TODAY_DATE, default_output_filename
+from option_merge_tool.preview import (
+    PREVIEW_GROUPS,
+    LivePreview,
+    PreviewRequest,
+    PreviewResult,
+)
+from option_merge_tool.progress import Progress
+from option_merge_tool.reader import peek_header
+from option_merge_tool.settings import ALL_SHEETS
+from option_merge_tool.worker import MergeWorker, WorkerFailed, WorkerFinished
 
 
 if TYPE_CHECKING:
     from typing import Any
 
-    import pandas as pd
-
-    from option_merge_tool.settings import Settings
+    from option_merge_tool.cache import InputCache
+    from option_merge_tool.settings import OutputFormat, ReaderBackend, Settings
 
 
 @dataclass(slots=True, kw_only=True)
 class Configuration:
     template_file: str
     input_file: str
+    sheets: list[str] | None
     first_column: str
     second_column: str
     join_by: str
@@ -34,6 +45,20 @@ class Configuration:
     today_date: str
     column_to_dropna: str
     columns_to_drop_dulicates: list[str]
+    reader_backend: ReaderBackend
+    cache: InputCache | None
+    template_cache_dir: str | None
+    test_mode: bool
+    log_file: str
+    metrics_dir: str | None
+    profile_dir: str | None
+    lean_memory: bool
+    state_dir: str | None
+    output_file: str | None
+    output_format: OutputFormat | None
+    memory_budget_mb: int | None
+    shard_rows: int | None
+    shard_by: str | None
 
 
 class ElementTag(IntEnum):
@@ -45,18 +70,83 @@ class ElementTag(IntEnum):
     DATA_FILE_DIALOG = auto()
     SELECTED_TEMPLATE_FILE = auto()
     TEMPLATE_FILE_DIALOG = auto()
+    PROCEED_BUTTON = auto()
+    CANCEL_BUTTON = auto()
+    PROGRESS_BAR = auto()
+    PROGRESS_STATUS = auto()
+    PREVIEW_STATUS = auto()
+    PREVIEW_TABLE = auto()
 
 
 # ? Attributes of SplitOptions that we want to pass around DearPyGUI elements
 class StatefulData(Protocol):
     configuration: Configuration
-    dataframe: pd.DataFrame
+    columns: list[str]
+    worker: MergeWorker | None
+    progress: Progress | None
+    preview: LivePreview | None
+
+    def start_worker(self) -> MergeWorker:
+        ...
 
 
 @dataclass(slots=True)
 class SplitOptions:
     configuration: Configuration
-    dataframe: pd.DataFrame = field(init=False)
+    columns: list[str] = field(init=False)
+    worker: MergeWorker | None = field(default=None, init=False)
+    progress: Progress | None = field(default=None, init=False)
+    preview: LivePreview | None = field(default=None, init=False)
+
+    def load_input_file(self):
+        """
+        Reads only the header row for the column combos, and the first rows of the file for the
+        preview in a background thread. The merge worker is started right away and parses the
+        whole file (its `sheets`) while the settings are picked, see MergeWorker.
+        """
+        self.columns = [
+            str(column)
+            for column in peek_header(
+                self.configuration.input_file,
+                backend=self.configuration.reader_backend,
+            )
+        ]
+
+        # ? The first rows are kept in memory for the preview, which is recomputed from them on every change of the columns or the separator
+        if self.preview is None:
+            self.preview = LivePreview(
+                column_to_dropna=self.configuration.column_to_dropna,
+                columns_to_drop_dulicates=self.configuration.columns_to_drop_dulicates,
+                reader_backend=self.configuration.reader_backend,
+            )
+        sheets = self.configuration.sheets
+        self.preview.load(
+            self.configuration.input_file,
+            sheets[0] if sheets and sheets[0] != ALL_SHEETS else None,
+        )
+
+        self.start_worker()
+
+    def start_worker(self) -> MergeWorker:
+        """Starts the merge worker of the input file, the idle worker of a file picked before is stopped."""
+        if self.worker is not None:
+            if self.worker.is_running:
+                return (
+                    self.worker
+                )  # ? Started for the picked file once the running merge is finished
+            self.worker.cancel()
+
+        self.worker = MergeWorker(
+            input_file=self.configuration.input_file,
+            reader_backend=self.configuration.reader_backend,
+            cache=self.configuration.cache,
+            sheets=self.configuration.sheets,
+            test_mode=self.configuration.test_mode,
+            log_file=self.configuration.log_file,
+            profile_dir=self.configuration.profile_dir,
+        )
+        self.worker.start()
+        return self.worker
 
     def input_file_selected(self, sender: str, app_data: dict[str, dict[str, str]]):
         print("Selecting")
@@ -65,7 +155,16 @@ class SplitOptions:
             list(app_data["selections"].values())[0],
         )
         self.configuration.input_file = list(app_data["selections"].values())[0]
-        self.dataframe = read_excel(self.configuration.input_file)
+        self.load_input_file()
+
+        items = [c.replace("\n", "  ") for c in self.columns]
+        for tag in (
+            ElementTag.FIRST_COLUMN,
+            ElementTag.SECOND_COLUMN,
+            ElementTag.OUTPUT_COLUMN,
+        ):
+            dpg.configure_item(tag, items=items)
+        preview_callback(sender, None, self)
         logger.success(f"File selected: {self.configuration.input_file}")
 
     def template_file_selected(self, sender: str, app_data: dict[str, dict[str, str]]):
@@ -81,7 +180,7 @@ class SplitOptions:
         if not os.path.exists(self.configuration.input_file):
             self.configuration.input_file = glob("SABANGNET_*.xlsx")[0]
 
-        self.dataframe = read_excel(self.configuration.input_file)
+        self.load_input_file()
 
         # Input file selection
         with dpg.file_dialog(
@@ -94,6 +193,7 @@ class SplitOptions:
         ):
             dpg.add_file_extension(".xlsx", color=(255, 255, 0, 255))
             dpg.add_file_extension(".csv", color=(255, 0, 255, 255))
+            dpg.add_file_extension(".tsv", color=(255, 0, 255, 255))
 
         dpg.add_button(
             label="Choose the input data file",
@@ -129,13 +229,15 @@ class SplitOptions:
 
         with dpg.group(width=800, horizontal_spacing=50):
             default = self.configuration.first_column.replace("\n", "  ")
-            columns: list[str] = list(self.dataframe.columns)
+            columns = self.columns
 
             dpg.add_text(f"First Column [DEFAULT: {default}]")
             dpg.add_combo(
                 items=[c.replace("\n", "  ") for c in columns],
                 default_value=self.configuration.first_column.replace("\n", "  "),
                 tag=ElementTag.FIRST_COLUMN,
+                callback=preview_callback,
+                user_data=self,
             )
 
             default = self.configuration.second_column.replace("\n", "  ")
@@ -144,6 +246,8 @@ class SplitOptions:
                 items=[c.replace("\n", "  ") for c in columns],
                 default_value=self.configuration.second_column.replace("\n", "  "),
                 tag=ElementTag.SECOND_COLUMN,
+                callback=preview_callback,
+                user_data=self,
             )
 
             default = self.configuration.output_column.replace("\n", "  ")
@@ -152,6 +256,8 @@ class SplitOptions:
                 items=[c.replace("\n", "  ") for c in columns],
                 default_value=self.configuration.output_column.replace("\n", "  "),
                 tag=ElementTag.OUTPUT_COLUMN,
+                callback=preview_callback,
+                user_data=self,
             )
 
         with dpg.group(width=800):
@@ -159,46 +265,108 @@ class SplitOptions:
             dpg.add_input_text(
                 default_value=self.configuration.join_by,
                 tag=ElementTag.JOIN_BY,
+                callback=preview_callback,
+                user_data=self,
             )
 
-        dpg.add_button(
-            label="Proceed",
-            callback=proceed_callback,
-            user_data=self,
-        )
+        with dpg.group(horizontal=True):
+            dpg.add_button(
+                label="Proceed",
+                callback=proceed_callback,
+                user_data=self,
+                tag=ElementTag.PROCEED_BUTTON,
+            )
+            dpg.add_button(
+                label="Cancel",
+                callback=cancel_callback,
+                user_data=self,
+                tag=ElementTag.CANCEL_BUTTON,
+                enabled=False,
+            )
+
+        dpg.add_progress_bar(default_value=0.0, width=800, tag=ElementTag.PROGRESS_BAR)
+        dpg.add_text(default_value="", tag=ElementTag.PROGRESS_STATUS)
+
+        with dpg.collapsing_header(label="Preview", default_open=True):
+            dpg.add_text(
+                default_value="Reading the first rows of the input file ...",
+                tag=ElementTag.PREVIEW_STATUS,
+            )
+            dpg.add_table(
+                header_row=True,
+                resizable=True,
+                borders_innerV=True,
+                borders_outerH=True,
+                tag=ElementTag.PREVIEW_TABLE,
+                width=800,
+            )
 
         dpg.bind_font(font)
+        preview_callback(None, None, self)
 
+    def show_preview(self, result: PreviewResult):
+        dpg.delete_item(ElementTag.PREVIEW_TABLE, children_only=True)
+        if result.rows is None:
+            dpg.set_value(ElementTag.PREVIEW_STATUS, f"No preview: {result.error}")
+            return
 
-async def run(settings: Settings) -> None:
-    logger.remove()
-    if settings.test_mode:
-        logger.add(
-            sys.stderr,
-            format=LOGGER_FORMAT_STR,
-            level="DEBUG",
-            colorize=True,
-            enqueue=True,
-        )
-    else:
-        logger.add(
-            sys.stderr,
-            format=LOGGER_FORMAT_STR,
-            level="INFO",
-            colorize=True,
-            enqueue=True,
+        groups = min(len(result.rows), PREVIEW_GROUPS)
+        dpg.set_value(
+            ElementTag.PREVIEW_STATUS,
+            f"Approximate: first {groups} groups (in output order) of the first {result.sample_rows:,} rows, the later rows may add options ({result.elapsed * 1000:.0f} ms)",
         )
-    logger.add(
-        settings.log_file,
-        format=LOGGER_FORMAT_STR,
-        enqueue=True,
-        encoding="utf-8-sig",
-        level="DEBUG",
-    )
+        for column in result.rows.columns:
+            dpg.add_table_column(
+                label=str(column).replace("\n", "  "), parent=ElementTag.PREVIEW_TABLE
+            )
+        for row in result.rows.itertuples(index=False):
+            with dpg.table_row(parent=ElementTag.PREVIEW_TABLE):
+                for value in row:
+                    dpg.add_text(str(value))
+
+    def update_progress(self):
+        """Called on every frame, shows the progress sent by the merge worker and the latest preview."""
+        if self.preview is not None and (result := self.preview.poll()) is not None:
+            self.show_preview(result)
+
+        if self.worker is None or not self.worker.is_submitted:
+            return
+
+        for event in self.worker.poll():
+            if isinstance(event, Progress):
+                self.progress = event
+                dpg.set_value(ElementTag.PROGRESS_BAR, event.step / event.total)
+            elif isinstance(event, WorkerFinished):
+                dpg.set_value(ElementTag.PROGRESS_BAR, 1.0)
+                dpg.set_value(
+                    ElementTag.PROGRESS_STATUS,
+                    f"Done: {event.result.input_rows:,} rows -> {event.result.output_rows:,} rows in {self.worker.elapsed:.1f}s",
+                )
+                logger.success(f"File saved to {event.result.output_filename}")
+            elif isinstance(event, WorkerFailed):
+                dpg.set_value(ElementTag.PROGRESS_STATUS, f"Failed: {event.error}")
+                logger.error("The merge failed: {}", event.error)
+
+        if self.worker.is_running:
+            if self.progress is not None:
+                dpg.set_value(
+                    ElementTag.PROGRESS_STATUS,
+                    f"{self.progress.label} ... ({self.progress.rows:,} rows, {self.worker.elapsed:.1f}s)",
+                )
+        else:
+            # ? A new worker parses the input file ahead of the next merge
+            self.worker = None
+            self.start_worker()
+            set_running(False)
+
+
+async def run(settings: Settings) -> None:
+    setup_logger(test_mode=settings.test_mode, log_file=settings.log_file)
 
     configuration = Configuration(
         template_file=settings.template_file,
         input_file=settings.input_file,
+        sheets=settings.sheets,
         first_column=settings.first_column,
         second_column=settings.second_column,
         join_by=settings.join_by,
@@ -206,6 +374,20 @@ async def run(settings: Settings) -> None:
         today_date=TODAY_DATE,
         column_to_dropna=settings.column_to_dropna,
         columns_to_drop_dulicates=settings.columns_to_drop_dulicates,
+        reader_backend=settings.reader_backend,
+        cache=create_cache(settings.cache_dir, settings.cache_max_mb),
+        template_cache_dir=settings.template_cache_dir,
+        test_mode=settings.test_mode,
+        log_file=settings.log_file,
+        metrics_dir=settings.metrics_dir,
+        profile_dir=settings.profile_dir,
+        lean_memory=settings.lean_memory,
+        state_dir=settings.state_dir,
+        output_file=settings.output_file,
+        output_format=settings.output_format,
+        memory_budget_mb=settings.memory_budget_mb,
+        shard_rows=settings.shard_rows,
+        shard_by=settings.shard_by,
     )
     split_options = SplitOptions(configuration)
     logger.info(f"Template file: <RED>{Path(configuration.template_file).name}</RED>")
@@ -230,33 +412,107 @@ async def run(settings: Settings) -> None:
     dpg.show_viewport()
 
     dpg.set_primary_window("Primary Window", True)
-    dpg.start_dearpygui()
+    # ? Manual render loop so that the progress of the merge worker is polled on every frame
+    while dpg.is_dearpygui_running():
+        split_options.update_progress()
+        dpg.render_dearpygui_frame()
+
+    if split_options.worker is not None:
+        split_options.worker.cancel()
+    if split_options.preview is not None:
+        split_options.preview.close()
     dpg.destroy_context()
 
 
-def proceed_callback(sender: Any, app_data: Any, stateful: StatefulData):
-    join_by = dpg.get_value(ElementTag.JOIN_BY)
-    output_column = cast(str, dpg.get_value(ElementTag.OUTPUT_COLUMN)).replace(
-        "  ", "\n"
-    )
-    first_column = cast(str, dpg.get_value(ElementTag.FIRST_COLUMN)).replace(
-        r"  ", "\n"
-    )
-    second_column = cast(str, dpg.get_value(ElementTag.SECOND_COLUMN)).replace(
-        r"  ", "\n"
+def set_running(is_running: bool):
+    dpg.configure_item(ElementTag.PROCEED_BUTTON, enabled=not is_running)
+    dpg.configure_item(ElementTag.CANCEL_BUTTON, enabled=is_running)
+
+
+def selected_options() -> PreviewRequest:
+    """The columns picked in the combos (whose labels show the line breaks as two spaces) and the separator."""
+    return PreviewRequest(
+        first_column=cast(str, dpg.get_value(ElementTag.FIRST_COLUMN)).replace(
+            "  ", "\n"
+        ),
+        second_column=cast(str, dpg.get_value(ElementTag.SECOND_COLUMN)).replace(
+            "  ", "\n"
+        ),
+        output_column=cast(str, dpg.get_value(ElementTag.OUTPUT_COLUMN)).replace(
+            "  ", "\n"
+        ),
+        join_by=dpg.get_value(ElementTag.JOIN_BY),
     )
+
+
+def preview_callback(sender: Any, app_data: Any, stateful: StatefulData):
+    # ? Only the latest settings are merged, once they stop changing (see LivePreview.poll)
+    if stateful.preview is not None:
+        stateful.preview.request(selected_options())
+
+
+def proceed_callback(sender: Any, app_data: Any, stateful: StatefulData):
+    selected = selected_options()
+    join_by = selected.join_by
+    output_column = selected.output_column
+    first_column = selected.first_column
+    second_column = selected.second_column
     print(f"{first_column = }")
     print(f"{second_column = }")
     print(f"{output_column = }")
 
-    stateful.dataframe = read_excel(stateful.configuration.input_file)
-    merge(
-        stateful.configuration.input_file,
-        stateful.configuration.template_file,
-        output_column,
-        first_column,
-        second_column,
-        join_by,
-        stateful.configuration.column_to_dropna,
-        stateful.configuration.columns_to_drop_dulicates,
+    if stateful.worker is not None and stateful.worker.is_submitted:
+        return
+    worker = stateful.worker or stateful.start_worker()
+
+    output_filename = stateful.configuration.output_file or default_output_filename()
+    if stateful.configuration.output_format is not None:
+        # ? Renamed here, so that Cancel removes the partially written file of the right name
+        output_filename = with_output_format(
+            output_filename, stateful.configuration.output_format
+        )
+
+    # ? The merge runs in a separate process, the render loop polls its progress (see SplitOptions.update_progress)
+    stateful.progress = None
+    worker.submit(
+        args=(
+            stateful.configuration.input_file,
+            stateful.configuration.template_file,
+            output_column,
+            first_column,
+            second_column,
+            join_by,
+            stateful.configuration.column_to_dropna,
+            stateful.configuration.columns_to_drop_dulicates,
+        ),
+        kwargs={
+            "reader_backend": stateful.configuration.reader_backend,
+            "cache": stateful.configuration.cache,
+            "template_cache_dir": stateful.configuration.template_cache_dir,
+            "metrics_dir": stateful.configuration.metrics_dir,
+            "lean_memory": stateful.configuration.lean_memory,
+            "state_dir": stateful.configuration.state_dir,
+            "memory_budget_mb": stateful.configuration.memory_budget_mb,
+            "sheets": stateful.configuration.sheets,
+            "shard_rows": stateful.configuration.shard_rows,
+            "shard_by": stateful.configuration.shard_by,
+        },
+        output_filename=output_filename,
     )
+
+    dpg.set_value(ElementTag.PROGRESS_BAR, 0.0)
+    # ? The worker starts the merge once it has parsed the input file
+    dpg.set_value(ElementTag.PROGRESS_STATUS, "Starting ...")
+    set_running(True)
+
+
+def cancel_callback(sender: Any, app_data: Any, stateful: StatefulData):
+    if stateful.worker is None or not stateful.worker.is_submitted:
+        return
+
+    stateful.worker.cancel()
+    stateful.worker = None
+    dpg.set_value(ElementTag.PROGRESS_STATUS, "Cancelled")
+    logger.warning("The merge was cancelled")
+    stateful.start_worker()
+    set_running(False)
@@ -0,0 +1,285 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from option_merge_tool.engine import aggregate_options, stringified
+from option_merge_tool.log import logger
+
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from typing import Any, Final
+
+MANIFEST_VERSION: Final[int] = 3
+MANIFEST_EXTENSION: Final[str] = ".json"
+CHANGE_COLUMN: Final[str] = "CHANGE"
+DELTA_SUFFIX: Final[str] = "_DELTA"
+
+# ? Values of CHANGE_COLUMN in the delta file
+ADDED: Final[str] = "added"
+CHANGED: Final[str] = "changed"
+REMOVED: Final[str] = "removed"
+
+
+@dataclass(slots=True, frozen=True)
+class Manifest:
+    """
+    State kept between two incremental runs.
+
+    `groups` is indexed by the (first_column, second_column) key of every group and has the
+    `hash` and `size` of its member values plus their `joined` string. `output` is the final
+    DataFrame written to the template, from which the next delta is computed.
+    """
+
+    groups: pd.DataFrame
+    output: pd.DataFrame
+
+
+def manifest_path(state_dir: str, **settings: Any) -> str:
+    """
+    Path of the manifest for the given merge settings (input file name, template, columns, ...).
+
+    A run with different settings never reuses the manifest of another one, while a new
+    export of the same input file (e.g. today's one) does.
+    """
+    description = json.dumps(
+        {"version": MANIFEST_VERSION, **settings}, ensure_ascii=False, sort_keys=True
+    )
+    name = hashlib.blake2b(description.encode("utf-8"), digest_size=16).hexdigest()
+
+    return os.path.join(state_dir, f"{name}{MANIFEST_EXTENSION}")
+
+
+def load_manifest(path: str) -> Manifest | None:
+    if not os.path.exists(path):
+        return None
+
+    # ? The manifest is plain JSON, a file planted in the state directory can never run code
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != MANIFEST_VERSION:
+            return None
+
+        groups, output = state["groups"], state["output"]
+        index = pd.MultiIndex.from_arrays(
+            [np.array(keys, dtype=object) for keys in groups["keys"]],
+            names=groups["names"],
+        )
+        return Manifest(
+            groups=pd.DataFrame(
+                {
+                    "hash": np.array(groups["hash"], dtype=np.uint64),
+                    "size": np.array(groups["size"], dtype=np.int64),
+                    "joined": np.array(groups["joined"], dtype=object),
+                },
+                index=index,
+            ),
+            output=pd.DataFrame(
+                {
+                    position: np.array(values, dtype=object)
+                    for position, values in enumerate(output["data"])
+                },
+                index=pd.RangeIndex(output["rows"]),
+            ).set_axis(output["columns"], axis=1),
+        )
+    except Exception as err:
+        logger.warning("Ignoring the unreadable manifest {}: {!r}", path, err)
+        return None
+
+
+def save_manifest(path: str, manifest: Manifest) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    groups, output = manifest.groups, manifest.output
+    state = {
+        "version": MANIFEST_VERSION,
+        "groups": {
+            "names": list(groups.index.names),
+            "keys": [
+                groups.index.get_level_values(level).to_numpy(dtype=object).tolist()
+                for level in range(groups.index.nlevels)
+            ],
+            "hash": groups["hash"].to_numpy().tolist(),
+            "size": groups["size"].to_numpy().tolist(),
+            "joined": groups["joined"].to_numpy(dtype=object).tolist(),
+        },
+        "output": {
+            "columns": list(output.columns),
+            "rows": len(output),
+            # ? The values are strings or NaN (which Python's json keeps), categorical columns are stored as their values
+            "data": [
+                output.iloc[:, position].to_numpy(dtype=object).tolist()
+                for position in range(output.shape[1])
+            ],
+        },
+    }
+
+    # ? Written next to its final path and renamed once complete, so an interrupted run keeps the previous manifest
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            # ? A column name that is not text or a number (e.g. a date of the template header) is kept as its text
+            json.dump(state, f, ensure_ascii=False, default=str)
+        os.replace(temporary_path, path)
+    except BaseException:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+
+def _object_index(index: pd.MultiIndex) -> pd.MultiIndex:
+    # ? Categorical levels (lean memory mode) are compared as plain strings with the other runs
+    return pd.MultiIndex.from_arrays(
+        [
+            index.get_level_values(level).to_numpy(dtype=object)
+            for level in range(index.nlevels)
+        ],
+        names=index.names,
+    )
+
+
+@dataclass(slots=True)
+class IncrementalAggregator:
+    """
+    Drop-in replacement of `aggregate_options` that only joins the groups which are new or
+    whose member values changed since the previous run.
+
+    Every group is identified by its key and a hash of its member values in order, the joined
+    string of an unchanged group is taken from `previous_groups`. After a call, `groups` holds
+    the state of this run for the next manifest.
+    """
+
+    previous_groups: pd.DataFrame | None = None
+    groups: pd.DataFrame | None = field(default=None, init=False)
+    n_changed: int = field(default=0, init=False)
+
+    def __call__(
+        self,
+        dataframe: pd.DataFrame,
+        columns: Sequence[str],
+        output_column: str,
+        join_by: str,
+    ) -> pd.Series:
+        keys = [stringified(dataframe[column]) for column in columns]
+        values = stringified(dataframe[output_column])
+
+        # ? Same grouping as aggregate_options, so the index is identical to a full aggregation
+        grouped = values.groupby(keys, sort=True, observed=True)
+        group_ids = grouped.ngroup().to_numpy()
+        index = grouped.size().index
+
+        # ? The position of a value in its group is part of its hash, so a reordered group is recomputed
+        positions = pd.Series(group_ids).groupby(group_ids).cumcount().to_numpy()
+        row_hashes = pd.util.hash_pandas_object(
+            pd.DataFrame({"value": values.to_numpy(), "position": positions}),
+            index=False,
+        ).to_numpy()
+
+        n_groups = len(index)
+        hashes = np.zeros(n_groups, dtype=np.uint64)
+        np.add.at(hashes, group_ids, row_hashes)
+        sizes = np.bincount(group_ids, minlength=n_groups)
+
+        joined = np.empty(n_groups, dtype=object)
+        is_changed = np.ones(n_groups, dtype=bool)
+        object_index = _object_index(index)
+
+        if self.previous_groups is not None and len(self.previous_groups):
+            indexer = self.previous_groups.index.get_indexer(object_index)
+            is_known = indexer >= 0
+            previous = self.previous_groups.iloc[indexer[is_known]]
+
+            is_unchanged = (previous["hash"].to_numpy() == hashes[is_known]) & (
+                previous["size"].to_numpy() == sizes[is_known]
+            )
+            known = np.flatnonzero(is_known)
+            is_changed[known[is_unchanged]] = False
+            joined[known[is_unchanged]] = previous["joined"].to_numpy()[is_unchanged]
+
+        self.n_changed = int(is_changed.sum())
+        if self.n_changed:
+            changed = aggregate_options(
+                dataframe[is_changed[group_ids]], columns, output_column, join_by
+            )
+            joined[index.get_indexer(changed.index)] = changed.to_numpy()
+
+        self.groups = pd.DataFrame(
+            {"hash": hashes, "size": sizes, "joined": joined}, index=object_index
+        )
+        logger.info(
+            f"Incremental merge: {self.n_changed} of {n_groups} groups recomputed"
+        )
+
+        aggregated = pd.Series(joined, index=index, name=values.name)
+        # ? With observed=True, pandas does not fully sort the groups of several categorical keys
+        if any(isinstance(key.dtype, pd.CategoricalDtype) for key in keys):
+            aggregated = aggregated.sort_index()
+
+        return aggregated
+
+
+def compute_delta(
+    previous: pd.DataFrame, current: pd.DataFrame, columns: Sequence[str]
+) -> pd.DataFrame:
+    """
+    Lists the rows of `current` that were added or changed and the rows of `previous` that were
+    removed, matched on the `columns` key. The kind of change is in the first column (CHANGE).
+    """
+    columns = list(columns)
+
+    def key_index(dataframe: pd.DataFrame) -> pd.MultiIndex:
+        # ? Only the key columns are compared as strings, so that a categorical (lean memory) run matches an object one
+        keys = [
+            stringified(dataframe[column]).to_numpy(dtype=object) for column in columns
+        ]
+        occurrence = pd.Series(keys[0]).groupby(keys, sort=False).cumcount()
+        return pd.MultiIndex.from_arrays([*keys, occurrence.to_numpy()])
+
+    previous_index = key_index(previous)
+    current_index = key_index(current)
+
+    # ? The key and its occurrence are unique, every current row has at most one previous row
+    matches = previous_index.get_indexer(current_index)
+    is_added = matches < 0
+    is_removed = ~previous_index.isin(current_index)
+
+    is_matched = ~is_added
+    is_different = np.zeros(int(is_matched.sum()), dtype=bool)
+    for column in current.columns:
+        if column not in previous.columns:
+            continue
+        current_values = current[column].to_numpy(dtype=object)[is_matched]
+        previous_values = previous[column].to_numpy(dtype=object)[matches[is_matched]]
+        # ? NaN only equals NaN (and not the text "nan"), the other values are compared as they are
+        current_na = pd.isna(current_values)
+        previous_na = pd.isna(previous_values)
+        is_different |= (current_na != previous_na) | (
+            ~current_na & (current_values != previous_values)
+        )
+    is_changed = np.zeros(len(current), dtype=bool)
+    is_changed[is_matched] = is_different
+
+    delta = pd.concat(
+        [
+            current[is_added].assign(**{CHANGE_COLUMN: ADDED}),
+            current[is_changed].assign(**{CHANGE_COLUMN: CHANGED}),
+            previous[is_removed].assign(**{CHANGE_COLUMN: REMOVED}),
+        ],
+        ignore_index=True,
+    )
+
+    return delta[[CHANGE_COLUMN, *(c for c in delta.columns if c != CHANGE_COLUMN)]]
+
+
+def delta_filename(output_filename: str) -> str:
+    stem, extension = os.path.splitext(output_filename)
+    return f"{stem}{DELTA_SUFFIX}{extension or '.xlsx'}"
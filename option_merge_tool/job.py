@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import json
+import multiprocessing
+import os
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from typing import Any, Final
+
+    import pandas as pd
+
+JOB_EXTENSIONS: Final[tuple[str, ...]] = (".json", ".toml")
+# ? Below this number of rows, starting the worker processes takes longer than the aggregations
+PARALLEL_MIN_ROWS: Final[int] = 100_000
+
+
+class JobFileError(ValueError):
+    """The job file is missing a required setting or has a value of the wrong type."""
+
+
+@dataclass(slots=True, frozen=True, kw_only=True)
+class MergeSpec:
+    first_column: str
+    second_column: str
+    join_by: str
+    output_column: str
+
+    @property
+    def columns(self) -> tuple[str, str]:
+        return (self.first_column, self.second_column)
+
+
+@dataclass(slots=True, frozen=True, kw_only=True)
+class Job:
+    """
+    A job file: the merges to run on one input file, with the shared settings.
+
+    The settings missing from the file (None) are taken from the command line.
+    """
+
+    merges: tuple[MergeSpec, ...]
+    input_file: str | None = None
+    template_file: str | None = None
+    column_to_dropna: str | None = None
+    columns_to_drop_dulicates: list[str] | None = None
+    sheets: list[str] | None = None
+    output_file: str | None = None
+
+
+def _load_toml(file: str) -> dict[str, Any]:
+    try:
+        import tomllib  # type: ignore
+    except ImportError:  # ? Python 3.10
+        try:
+            import tomli as tomllib  # type: ignore
+        except ImportError as err:
+            raise ImportError(
+                "TOML job files require Python 3.11 or tomli (pip install tomli), use a JSON job file instead"
+            ) from err
+
+    with open(file, "rb") as f:
+        return tomllib.load(f)
+
+
+def _string(values: dict[str, Any], key: str, where: str) -> str | None:
+    value = values.get(key)
+    if value is not None and not isinstance(value, str):
+        raise JobFileError(f"{where}: {key} must be a string (got {value!r})")
+
+    return value
+
+
+def load_job(file: str) -> Job:
+    """
+    Reads a JSON or TOML job file, e.g.
+
+        input_file = "INPUT.xlsx"
+        template_file = "TEMPLATE.xlsx"
+        column_to_dropna = "원본 상품명"
+        columns_to_drop_dulicates = ["원본 상품명", "물류처ID", "모델NO"]
+        sheets = ["상품1", "상품2"]
+
+        [[merges]]
+        first_column = "원본 상품명"
+        second_column = "원가\\n[필수]"
+        join_by = ","
+        output_column = "옵션상세명칭(1)\\n[사방넷]"
+
+        [[merges]]
+        ...
+
+    A JSON job file has the same keys, with "merges" as a list of objects.
+
+    Raises:
+        JobFileError: If the job file has no merge or a setting of the wrong type.
+    """
+    if file.lower().endswith(".toml"):
+        values = _load_toml(file)
+    else:
+        with open(file, encoding="utf-8-sig") as f:
+            values = json.load(f)
+
+    name = os.path.basename(file)
+    if not isinstance(values, dict):
+        raise JobFileError(f"{name}: the job file must be a table of settings")
+
+    merges = values.get("merges")
+    if not isinstance(merges, list) or not merges:
+        raise JobFileError(f"{name}: merges must be a non-empty list of merges")
+
+    specs: list[MergeSpec] = []
+    for position, merge in enumerate(merges, start=1):
+        where = f"{name}: merge {position}"
+        if not isinstance(merge, dict):
+            raise JobFileError(f"{where} must be a table of settings")
+
+        fields: dict[str, str] = {}
+        for key in ("first_column", "second_column", "join_by", "output_column"):
+            value = _string(merge, key, where)
+            if value is None:
+                raise JobFileError(f"{where} has no {key}")
+            fields[key] = value
+        specs.append(MergeSpec(**fields))
+
+    columns_to_drop_dulicates = values.get("columns_to_drop_dulicates")
+    if columns_to_drop_dulicates is not None and not (
+        isinstance(columns_to_drop_dulicates, list)
+        and all(isinstance(column, str) for column in columns_to_drop_dulicates)
+    ):
+        raise JobFileError(
+            f"{name}: columns_to_drop_dulicates must be a list of column names"
+        )
+
+    sheets = values.get("sheets")
+    if sheets is not None and not (
+        isinstance(sheets, list) and all(isinstance(sheet, str) for sheet in sheets)
+    ):
+        raise JobFileError(f"{name}: sheets must be a list of sheet names")
+
+    return Job(
+        merges=tuple(specs),
+        input_file=_string(values, "input_file", name),
+        template_file=_string(values, "template_file", name),
+        column_to_dropna=_string(values, "column_to_dropna", name),
+        columns_to_drop_dulicates=columns_to_drop_dulicates,
+        sheets=sheets,
+        output_file=_string(values, "output_file", name),
+    )
+
+
+def aggregate_merge(dataframe: pd.DataFrame, spec: MergeSpec) -> pd.Series:
+    """The joined values of one merge, from a DataFrame already filtered by drop_empty_rows."""
+    from option_merge_tool.engine import aggregate_options, sort_by_keys
+
+    dataframe = sort_by_keys(dataframe, spec.columns)
+    return aggregate_options(dataframe, spec.columns, spec.output_column, spec.join_by)
+
+
+@dataclass(slots=True)
+class ExtraMerges:
+    """
+    The merges after the first one of a job, aggregated on the same parsed input.
+
+    `start` submits the aggregations to a pool of worker processes (or computes them right away
+    for small inputs), so that they run while the first merge runs in the current process.
+    `fill` then puts their joined values into the rows of the first merge.
+    """
+
+    specs: Sequence[MergeSpec]
+    workers: int = 1
+    _executor: ProcessPoolExecutor | None = None
+    _results: list[Any] | None = None
+
+    def start(self, dataframe: pd.DataFrame, column_to_dropna: str) -> None:
+        from option_merge_tool.engine import drop_empty_rows
+
+        dataframe = drop_empty_rows(dataframe, column_to_dropna)
+        # ? Only the columns of each merge are sent to the worker processes
+        subsets = [
+            dataframe[list(dict.fromkeys((*spec.columns, spec.output_column)))]
+            for spec in self.specs
+        ]
+
+        workers = min(self.workers, len(self.specs))
+        if workers <= 1 or len(dataframe) < PARALLEL_MIN_ROWS:
+            self._results = [
+                aggregate_merge(subset, spec)
+                for subset, spec in zip(subsets, self.specs)
+            ]
+            return
+
+        self._executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        )
+        self._results = [
+            self._executor.submit(aggregate_merge, subset, spec)
+            for subset, spec in zip(subsets, self.specs)
+        ]
+
+    def fill(self, merged: pd.DataFrame) -> pd.DataFrame:
+        assert self._results is not None, "start() must be called first"
+        from option_merge_tool.engine import fill_merged_options
+
+        try:
+            for spec, result in zip(self.specs, self._results):
+                aggregated = result.result() if isinstance(result, Future) else result
+                merged = fill_merged_options(
+                    merged, aggregated, spec.columns, spec.output_column
+                )
+        finally:
+            self.close()
+
+        return merged
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -37,3 +37,30 @@ success = logger.success
 
 logger.level("ACTION", no=38, color="<yellow><dim>")
 logger.level("UNHANDLED ERROR", no=39, color="<d><red>")
+
+
+def setup_logger(*, test_mode: bool, log_file: str) -> None:
+    logger.remove()
+    if test_mode:
+        logger.add(
+            sys.stderr,
+            format=LOGGER_FORMAT_STR,
+            level="DEBUG",
+            colorize=True,
+            enqueue=True,
+        )
+    else:
+        logger.add(
+            sys.stderr,
+            format=LOGGER_FORMAT_STR,
+            level="INFO",
+            colorize=True,
+            enqueue=True,
+        )
+    logger.add(
+        log_file,
+        format=LOGGER_FORMAT_STR,
+        enqueue=True,
+        encoding="utf-8-sig",
+        level="DEBUG",
+    )
@@ -1,31 +1,91 @@
 from __future__ import annotations
 
 import os
-import sys
 
-from datetime import datetime
+from dataclasses import asdict, dataclass
 from pathlib import Path
 from typing import TYPE_CHECKING
 
-import numpy as np
-import pandas as pd
-
+from option_merge_tool.engine import merge_options, normalize_options
 from option_merge_tool.excel import (
-    copy_dataframe_cells_to_excel_template,
+    apply_column_mapping,
+    copy_dataframe_to_excel_template,
     get_column_mapping,
 )
+from option_merge_tool.incremental import (
+    IncrementalAggregator,
+    Manifest,
+    compute_delta,
+    delta_filename,
+    load_manifest,
+    manifest_path,
+    save_manifest,
+)
+from option_merge_tool.job import ExtraMerges
 from option_merge_tool.log import logger
+from option_merge_tool.metrics import MEGABYTE, RunMetrics
+from option_merge_tool.out_of_core import merge_file_partitioned
+from option_merge_tool.output import (
+    output_format_of,
+    with_output_format,
+    write_dataframe,
+    write_table,
+)
+from option_merge_tool.paths import default_output_filename
+from option_merge_tool.preflight import run_preflight
+from option_merge_tool.progress import report_progress
+from option_merge_tool.reader import (
+    project_table,
+    projected_columns,
+    read_sheets,
+    read_table,
+)
+from option_merge_tool.shard import EXCEL_MAX_ROWS, write_shards
+from option_merge_tool.template import load_template
 
 
 if TYPE_CHECKING:
-    from typing import Any, Final
+    from collections.abc import Collection, Sequence
+
+    import pandas as pd
 
-TODAY_DATE = f"{datetime.now().strftime('%Y%m%d')}"
-SCRIPT_PATH: Final[str] = os.path.dirname(os.path.realpath(sys.argv[0]))
+    from option_merge_tool.cache import InputCache
+    from option_merge_tool.job import MergeSpec
+    from option_merge_tool.progress import ProgressCallback
+    from option_merge_tool.settings import OutputFormat, ReaderBackend
 
 
-def read_excel(file: str):
-    return pd.read_excel(file, engine="openpyxl", dtype=str)
+@dataclass(slots=True, frozen=True)
+class MergeResult:
+    output_filename: str
+    input_rows: int
+    output_rows: int
+
+
+def read_excel(
+    file: str,
+    columns: Collection[str] | None = None,
+    backend: ReaderBackend = "auto",
+    cache: InputCache | None = None,
+    categories: Collection[str] | None = None,
+    sheets: Sequence[str] | None = None,
+    workers: int = 1,
+):
+    if sheets is None:
+        return read_table(
+            file, columns=columns, backend=backend, cache=cache, categories=categories
+        )
+
+    # ? The sheets are concatenated into a single table, parsed in parallel by up to `workers` processes
+    return read_sheets(
+        file,
+        sheets,
+        columns=columns,
+        backend=backend,
+        cache=cache,
+        categories=categories,
+        workers=workers,
+    )
 
 
 def merge(
@@ -37,113 +97,307 @@ def merge(
     join_by: str,
     column_to_dropna: str,
     columns_to_drop_dulicates: list[str],
-):
-    dataframe = read_excel(input_file)
-
-    logger.log("ACTION", "Creating MERGED_OPTIONS.xlsx ...")
+    *,
+    reader_backend: ReaderBackend = "auto",
+    output_filename: str | None = None,
+    cache: InputCache | None = None,
+    progress: ProgressCallback | None = None,
+    metrics_dir: str | None = None,
+    lean_memory: bool = False,
+    state_dir: str | None = None,
+    output_format: OutputFormat | None = None,
+    intermediate_file: str | None = None,
+    memory_budget_mb: int | None = None,
+    extra_merges: Sequence[MergeSpec] = (),
+    workers: int = 1,
+    template_cache_dir: str | None = None,
+    sheets: Sequence[str] | None = None,
+    shard_rows: int | None = None,
+    shard_by: str | None = None,
+    parsed: pd.DataFrame | None = None,
+    spill_dir: str | None = None,
+) -> MergeResult:
+    metrics = RunMetrics()
+    report_progress(progress, "read")
 
-    output_dir = os.path.join(SCRIPT_PATH, "output", TODAY_DATE)
-    os.makedirs(output_dir, exist_ok=True)
+    # ? The template is compiled once (or loaded from template_cache_dir), the column mapping and the template fill reuse it
+    template = load_template(template_file, cache_dir=template_cache_dir)
 
-    output_filename = os.path.join(output_dir, "MERGED_OPTIONS.xlsx")
-    columns = [first_column, second_column]
-    aggregation_functions = {output_column: join_by.join}
-
-    not_empty = (dataframe[column_to_dropna] != "") & (
-        dataframe[column_to_dropna].notna()
-    )
-    dataframe = dataframe[
-        not_empty
-    ]  # ? Remove the line 2 row which previously included meta information for columns (it is now removed in latest Excel DB file)
-    dataframe = (
-        dataframe.reset_index(drop=True).sort_values(by=columns).reset_index(drop=True)
+    # ? Only the columns used by the merge or mapped by the template are loaded from the input file
+    columns = projected_columns(
+        first_column,
+        second_column,
+        output_column,
+        column_to_dropna,
+        columns_to_drop_dulicates,
+        *((*spec.columns, spec.output_column) for spec in extra_merges),
+        template.header,
+        [shard_by] if shard_by is not None else [],
     )
+    # ? The settings are checked against the headers, and the strategy is picked from a sample of the rows, before the input is parsed
+    with metrics.span("preflight") as span:
+        preflight = run_preflight(
+            input_file,
+            template_file,
+            template,
+            columns=columns,
+            first_column=first_column,
+            second_column=second_column,
+            output_column=output_column,
+            column_to_dropna=column_to_dropna,
+            columns_to_drop_dulicates=columns_to_drop_dulicates,
+            extra_merges=extra_merges,
+            shard_by=shard_by,
+            reader_backend=reader_backend,
+            lean_memory=lean_memory,
+            memory_budget_mb=memory_budget_mb,
+            # ? The incremental mode, the other merges of a job and the other sheets need the whole input in memory (as does an input already parsed)
+            can_spill=state_dir is None
+            and not extra_merges
+            and sheets is None
+            and parsed is None,
+            sheets=sheets,
+        )
+        span.rows_out = preflight.sample_rows
+    logger.debug(f"Preflight of {Path(input_file).name}: {preflight.describe()}")
 
-    aggregated = (
-        dataframe.astype(str)
-        .groupby(columns, as_index=False)
-        .agg(aggregation_functions)
-        .reset_index(drop=True)
-        .sort_values(by=columns)
-        .reset_index(drop=True)
+    output_columns = {output_column, *(spec.output_column for spec in extra_merges)}
+    # ? In the lean memory mode every column except the output ones (which receive the joined strings) is dictionary-encoded
+    categories = (
+        [column for column in columns if column not in output_columns]
+        if preflight.strategy == "lean_memory"
+        else None
     )
+    if categories is not None and not lean_memory:
+        logger.info(
+            f"Dictionary-encoding the input columns (estimated memory {preflight.estimated_memory / MEGABYTE:.0f} MB > budget {memory_budget_mb} MB)"
+        )
+    # ? Files whose merge would not fit in the budget, even dictionary-encoded, are merged out of core one hash partition at a time
+    out_of_core = preflight.strategy == "out_of_core"
+    if out_of_core:
+        logger.info(
+            f"Merging out of core (estimated memory {preflight.estimated_memory / MEGABYTE:.0f} MB > budget {memory_budget_mb} MB)"
+        )
+    else:
+        with metrics.span("read") as span:
+            # ? An input parsed ahead by the caller (every column, e.g. by the GUI while the settings are picked) is only projected
+            dataframe = (
+                read_excel(
+                    input_file,
+                    columns,
+                    reader_backend,
+                    cache,
+                    categories,
+                    preflight.sheets,
+                    workers,
+                )
+                if parsed is None
+                else project_table(parsed, columns, categories)
+            )
+            span.rows_in = span.rows_out = input_rows = len(dataframe)
 
-    # ? Look for index overlap
-    dataframe_with_index = dataframe.set_index(columns)
-    aggregated_with_index = aggregated.set_index(columns)
-
-    common_in_both = dataframe[
-        dataframe_with_index.index.isin(aggregated_with_index.index)
-    ]
-    common_in_both = (
-        common_in_both.reset_index(drop=True)
-        .sort_values(by=columns)
-        .drop_duplicates(subset=columns, keep="first")
-        .reset_index(drop=True)
-    )
+    if output_filename is None:
+        output_filename = default_output_filename()
+    # ? Without an explicit format, the extension of the output file picks it (.xlsx fills the template)
+    if output_format is None:
+        output_format = output_format_of(output_filename)
+    else:
+        output_filename = with_output_format(output_filename, output_format)
+    os.makedirs(os.path.dirname(os.path.abspath(output_filename)), exist_ok=True)
 
-    predicate = dataframe_with_index[: len(common_in_both)].index.isin(
-        aggregated_with_index[: len(common_in_both)].index
-    )
-    new_only_items = common_in_both[predicate]
+    # ? In the incremental mode (state_dir), only the groups that changed since the previous run of the same settings are joined again
+    aggregator: IncrementalAggregator | None = None
+    previous: Manifest | None = None
+    if state_dir is not None:
+        manifest_file = manifest_path(
+            state_dir,
+            input_file=Path(input_file).name,
+            template_file=os.path.realpath(template_file),
+            output_column=output_column,
+            first_column=first_column,
+            second_column=second_column,
+            join_by=join_by,
+            column_to_dropna=column_to_dropna,
+            columns_to_drop_dulicates=columns_to_drop_dulicates,
+            # ? The other merges of a job are always joined in full, but their output is part of the manifest
+            **(
+                {"extra_merges": [asdict(spec) for spec in extra_merges]}
+                if extra_merges
+                else {}
+            ),
+            **(
+                {"sheets": list(preflight.sheets)}
+                if preflight.sheets is not None
+                else {}
+            ),
+        )
+        previous = load_manifest(manifest_file)
+        aggregator = IncrementalAggregator(
+            previous_groups=None if previous is None else previous.groups
+        )
 
-    new_only_items = (
-        new_only_items.reset_index(drop=True)
-        .sort_values(by=columns)
-        .reset_index(drop=True)
-    )
+    logger.log("ACTION", f"Creating {Path(output_filename).name} ...")
+    if out_of_core:
+        report_progress(progress, "merge")
+        dataframe_with_merged_options, input_rows = merge_file_partitioned(
+            input_file,
+            columns=columns,
+            backend=reader_backend,
+            first_column=first_column,
+            second_column=second_column,
+            output_column=output_column,
+            join_by=join_by,
+            column_to_dropna=column_to_dropna,
+            spill_dir=spill_dir,
+            metrics=metrics,
+        )
+    else:
+        report_progress(progress, "merge", input_rows)
+        # ? The other merges of a job are aggregated on the same parsed input, in worker processes while the first one runs
+        extra = ExtraMerges(extra_merges, workers)
+        try:
+            if extra_merges:
+                with metrics.span("extra_merges", input_rows):
+                    extra.start(dataframe, column_to_dropna)
 
-    aggregated = aggregated.sort_values(by=columns).reset_index(drop=True)
+            dataframe_with_merged_options = merge_options(
+                dataframe,
+                first_column=first_column,
+                second_column=second_column,
+                output_column=output_column,
+                join_by=join_by,
+                column_to_dropna=column_to_dropna,
+                metrics=metrics,
+                aggregate=aggregator,
+            )
 
-    new_only_items_iter: Any = new_only_items.iterrows()  # type: ignore
-    for idx, new_only_item in new_only_items_iter:
-        is_matched = (aggregated[first_column] == new_only_item.loc[first_column]) & (
-            aggregated[second_column] == new_only_item.loc[second_column]
+            if extra_merges:
+                with metrics.span(
+                    "extra_fill", len(dataframe_with_merged_options)
+                ) as span:
+                    dataframe_with_merged_options = extra.fill(
+                        dataframe_with_merged_options
+                    )
+                    span.rows_out = len(dataframe_with_merged_options)
+        finally:
+            extra.close()
+    report_progress(progress, "clean", len(dataframe_with_merged_options))
+    with metrics.span("normalize", len(dataframe_with_merged_options)) as span:
+        dataframe_with_merged_options = normalize_options(
+            dataframe_with_merged_options, column_to_dropna, columns_to_drop_dulicates
         )
-        matched_aggregated: Any = aggregated[is_matched]  # type: ignore
-        if len(matched_aggregated) >= 1:  # type: ignore
-            new_only_items.loc[idx, output_column] = matched_aggregated[
-                output_column
-            ].iloc[0]
+        span.rows_out = len(dataframe_with_merged_options)
+
+    if intermediate_file is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(intermediate_file)), exist_ok=True)
+        write_dataframe(dataframe_with_merged_options, intermediate_file)
+        logger.info(f"Merged options saved to {intermediate_file}")
 
-    dataframe_with_merged_options = new_only_items
-    dataframe_with_merged_options.to_excel(output_filename, index=False)
+    # ? Only the xlsx output fills the template, the other formats are written without its formatting
+    if output_format == "xlsx":
+        logger.log(
+            "ACTION",
+            f"Formatting {Path(output_filename).name} ... <yellow>(it may take a few seconds, so wait for it to be finished.)</>",
+        )
+    else:
+        logger.log("ACTION", f"Writing {Path(output_filename).name} ...")
 
-    # ? We need to remove the already existing file if present, otherwise shutil.copy fails
-    if os.path.exists(output_filename):
-        os.remove(output_filename)
+    report_progress(progress, "template", len(dataframe_with_merged_options))
 
-    dataframe_with_merged_options = dataframe_with_merged_options.dropna(
-        subset=[column_to_dropna], how="all"
-    )
-    dataframe_with_merged_options = dataframe_with_merged_options[
-        (dataframe_with_merged_options[column_to_dropna] != "")
-        & (dataframe_with_merged_options[column_to_dropna].notna())
-    ]  # ? Remove the line 2 row which previously included meta information for columns (it is now removed in latest Excel DB file)
-    dataframe_with_merged_options = dataframe_with_merged_options.replace(
-        np.nan, "", regex=True
-    ).replace("nan", "", regex=True)
-
-    dataframe_with_merged_options.drop_duplicates(
-        subset=columns_to_drop_dulicates
-    ).to_excel(
-        output_filename,
-        index=False,
-        engine="openpyxl",
-    )
+    # ? The cleaned DataFrame goes straight to the template, only the final file is written
+    with metrics.span("template", len(dataframe_with_merged_options)) as span:
+        column_mapping = get_column_mapping(
+            template_file, dataframe_with_merged_options
+        )
+        span.rows_out = len(dataframe_with_merged_options)
 
-    logger.log(
-        "ACTION",
-        f"Formatting {Path(output_filename).name} ... <yellow>(it may take a few seconds, so wait for it to be finished.)</>",
+    # ? An xlsx output with more rows than an Excel sheet is always split into shards
+    sharded = (
+        shard_rows is not None
+        or shard_by is not None
+        or (
+            output_format == "xlsx"
+            and len(dataframe_with_merged_options) > EXCEL_MAX_ROWS
+        )
     )
+    if sharded and shard_rows is None and shard_by is None:
+        logger.warning(
+            f"{len(dataframe_with_merged_options)} rows do not fit in one Excel sheet, they are split into several files"
+        )
 
-    column_mapping = get_column_mapping(template_file, output_filename)
+    with metrics.span("write", len(dataframe_with_merged_options)) as span:
+        if sharded:
+            # ? The shards are written in worker processes, the manifest lists their rows and checksums
+            result_filename, shards = write_shards(
+                dataframe_with_merged_options,
+                output_filename,
+                output_format=output_format,
+                template_filename=os.path.abspath(template_file),
+                column_mapping=column_mapping,
+                column_to_dropna=column_to_dropna,
+                shard_rows=shard_rows,
+                shard_by=shard_by,
+                workers=workers,
+            )
+        elif output_format == "xlsx":
+            copy_dataframe_to_excel_template(
+                dataframe=dataframe_with_merged_options,
+                filename=output_filename,
+                template_filename=os.path.abspath(template_file),
+                column_mapping=column_mapping,
+                column_to_dropna=column_to_dropna,
+            )
+        else:
+            # ? Machine-facing formats get the template's columns without its formatting
+            write_table(
+                apply_column_mapping(
+                    dataframe_with_merged_options, column_mapping, column_to_dropna
+                ),
+                output_filename,
+                output_format,
+            )
+        span.rows_out = len(dataframe_with_merged_options)
 
-    copy_dataframe_cells_to_excel_template(
-        filename=output_filename,
-        template_filename=os.path.abspath(template_file),
-        column_mapping=column_mapping,
-        column_to_dropna=column_to_dropna,
-    )
+    if sharded:
+        logger.success(
+            f"{len(shards)} files saved, listed in <CYAN><white>{result_filename}</></>"
+        )
+    else:
+        result_filename = output_filename
+        logger.success(f"File saved to <CYAN><white>{output_filename}</></>")
 
-    logger.success(f"File saved to <CYAN><white>{output_filename}</></>")
+    if aggregator is not None and aggregator.groups is not None:
+        if previous is not None:
+            with metrics.span("delta", len(dataframe_with_merged_options)) as span:
+                delta = compute_delta(
+                    previous.output,
+                    dataframe_with_merged_options,
+                    (first_column, second_column),
+                )
+                write_dataframe(delta, delta_filename(output_filename))
+                span.rows_out = len(delta)
+            logger.success(
+                f"{len(delta)} changed rows saved to <CYAN><white>{delta_filename(output_filename)}</></>"
+            )
+
+        save_manifest(
+            manifest_file,
+            Manifest(groups=aggregator.groups, output=dataframe_with_merged_options),
+        )
+
+    metrics.log_summary()
+    if metrics_dir is not None:
+        metrics_file = metrics.write(
+            metrics_dir,
+            Path(output_filename).stem,
+            input_file=os.path.abspath(input_file),
+            output_filename=os.path.abspath(result_filename),
+            reader_backend=reader_backend,
+        )
+        logger.debug(f"Metrics saved to {metrics_file}")
+
+    return MergeResult(
+        output_filename=result_filename,
+        input_rows=input_rows,
+        output_rows=len(dataframe_with_merged_options),
+    )
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from option_merge_tool.log import logger
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterator
+    from typing import Any, Final
+
+MEGABYTE: Final[int] = 1024 * 1024
+PROFILE_LINES: Final[int] = 40
+
+
+def _peak_working_set() -> int | None:
+    import ctypes
+
+    from ctypes import wintypes
+
+    class ProcessMemoryCounters(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    try:
+        kernel32 = ctypes.WinDLL("kernel32")  # type: ignore
+        psapi = ctypes.WinDLL("psapi")  # type: ignore
+        kernel32.GetCurrentProcess.restype = wintypes.HANDLE
+        psapi.GetProcessMemoryInfo.argtypes = [
+            wintypes.HANDLE,
+            ctypes.POINTER(ProcessMemoryCounters),
+            wintypes.DWORD,
+        ]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if not psapi.GetProcessMemoryInfo(
+            kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+        ):
+            return None
+    except (AttributeError, OSError):
+        return None
+
+    return counters.PeakWorkingSetSize
+
+
+def peak_rss() -> int | None:
+    """Peak resident set size of the process in bytes, None when the platform does not report it."""
+    if sys.platform == "win32":
+        return _peak_working_set()
+
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ? Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@dataclass(slots=True)
+class StageSpan:
+    """
+    Measurements of one stage of the merge.
+
+    `peak_rss_delta_mb` is how much the peak RSS of the process grew during the stage,
+    so a stage that stays below the peak of an earlier stage gives 0.
+    """
+
+    stage: str
+    rows_in: int = 0
+    rows_out: int = 0
+    seconds: float = 0.0
+    peak_rss_delta_mb: float | None = None
+
+    @property
+    def rows_per_second(self) -> float:
+        rows = max(self.rows_in, self.rows_out)
+        return rows / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "rows_per_second": round(self.rows_per_second, 1)}
+
+
+@dataclass(slots=True)
+class RunMetrics:
+    started_at: datetime = field(default_factory=datetime.now)
+    spans: list[StageSpan] = field(default_factory=list)
+
+    @contextmanager
+    def span(self, stage: str, rows_in: int = 0) -> Iterator[StageSpan]:
+        """Measures the stage run inside the `with` block, which sets `rows_out` on the yielded span."""
+        span = StageSpan(stage=stage, rows_in=rows_in)
+        rss_before = peak_rss()
+        start = time.perf_counter()
+
+        yield span
+
+        span.seconds = time.perf_counter() - start
+        rss_after = peak_rss()
+        if rss_before is not None and rss_after is not None:
+            span.peak_rss_delta_mb = (rss_after - rss_before) / MEGABYTE
+        self.spans.append(span)
+
+        logger.debug(
+            "Stage {}: {:.3f}s, {} -> {} rows ({:,.0f} rows/s), peak RSS +{} MB",
+            span.stage,
+            span.seconds,
+            span.rows_in,
+            span.rows_out,
+            span.rows_per_second,
+            "?" if span.peak_rss_delta_mb is None else f"{span.peak_rss_delta_mb:.1f}",
+        )
+
+    @property
+    def total_seconds(self) -> float:
+        return sum(span.seconds for span in self.spans)
+
+    def log_summary(self) -> None:
+        stages = ", ".join(f"{span.stage} {span.seconds:.2f}s" for span in self.spans)
+        rss = peak_rss()
+        peak = "" if rss is None else f", peak memory {rss / MEGABYTE:.0f} MB"
+        logger.info(f"Stages: {stages} (total {self.total_seconds:.2f}s{peak})")
+
+    def write(self, directory: str, name: str, **context: Any) -> str:
+        """Saves the spans (and the `context` values, e.g. the input file) as a JSON file in `directory`."""
+        os.makedirs(directory, exist_ok=True)
+        filename = os.path.join(
+            directory, f"{self.started_at.strftime('%Y%m%d_%H%M%S_%f')}_{name}.json"
+        )
+
+        rss = peak_rss()
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    **context,
+                    "started_at": self.started_at.isoformat(timespec="seconds"),
+                    "total_seconds": self.total_seconds,
+                    "peak_rss_mb": None if rss is None else rss / MEGABYTE,
+                    "stages": [span.to_dict() for span in self.spans],
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+
+        return filename
+
+
+@contextmanager
+def profiled(directory: str, name: str) -> Iterator[None]:
+    """Runs the `with` block under cProfile and saves the stats (.prof) and a text report (.txt) in `directory`."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(
+            directory, f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{name}"
+        )
+        profile.dump_stats(f"{stem}.prof")
+        with open(f"{stem}.txt", "w", encoding="utf-8") as f:
+            pstats.Stats(profile, stream=f).sort_stats("cumulative").print_stats(
+                PROFILE_LINES
+            )
+
+        logger.info(f"Profile saved to {stem}.prof")
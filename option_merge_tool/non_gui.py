@@ -6,8 +6,12 @@ import sys
 from glob import glob
 from typing import TYPE_CHECKING
 
-from option_merge_tool.log import LOGGER_FORMAT_STR, logger
+from option_merge_tool.batch import run_batch
+from option_merge_tool.cache import create_cache
+from option_merge_tool.daemon import run_daemon
+from option_merge_tool.log import logger, setup_logger
 from option_merge_tool.merge import merge
+from option_merge_tool.preflight import PreflightError
 
 
 if TYPE_CHECKING:
@@ -15,43 +19,48 @@ if TYPE_CHECKING:
 
 
 async def run(settings: Settings) -> None:
-    logger.remove()
-    if settings.test_mode:
-        logger.add(
-            sys.stderr,
-            format=LOGGER_FORMAT_STR,
-            level="DEBUG",
-            colorize=True,
-            enqueue=True,
-        )
-    else:
-        logger.add(
-            sys.stderr,
-            format=LOGGER_FORMAT_STR,
-            level="INFO",
-            colorize=True,
-            enqueue=True,
-        )
-    logger.add(
-        settings.log_file,
-        format=LOGGER_FORMAT_STR,
-        enqueue=True,
-        encoding="utf-8-sig",
-        level="DEBUG",
-    )
+    setup_logger(test_mode=settings.test_mode, log_file=settings.log_file)
+
+    if settings.batch is not None:
+        run_batch(settings, settings.batch)
+        return
+
+    if settings.watch is not None:
+        run_daemon(settings, settings.watch)
+        return
 
     input_file = settings.input_file
 
     if not os.path.exists(settings.input_file):
         input_file = glob("INPUT_*.xlsx")[0]
 
-    merge(
-        input_file,
-        settings.template_file,
-        settings.output_column,
-        settings.first_column,
-        settings.second_column,
-        settings.join_by,
-        settings.column_to_dropna,
-        settings.columns_to_drop_dulicates,
-    )
+    try:
+        merge(
+            input_file,
+            settings.template_file,
+            settings.output_column,
+            settings.first_column,
+            settings.second_column,
+            settings.join_by,
+            settings.column_to_dropna,
+            settings.columns_to_drop_dulicates,
+            reader_backend=settings.reader_backend,
+            cache=create_cache(settings.cache_dir, settings.cache_max_mb),
+            metrics_dir=settings.metrics_dir,
+            lean_memory=settings.lean_memory,
+            state_dir=settings.state_dir,
+            output_filename=settings.output_file,
+            output_format=settings.output_format,
+            intermediate_file=settings.intermediate_file,
+            memory_budget_mb=settings.memory_budget_mb,
+            extra_merges=settings.extra_merges,
+            workers=settings.workers,
+            template_cache_dir=settings.template_cache_dir,
+            sheets=settings.sheets,
+            shard_rows=settings.shard_rows,
+            shard_by=settings.shard_by,
+        )
+    except PreflightError as err:
+        # ? Reported like an argument error, the input file was not parsed
+        logger.error("The settings do not match the files:\n{}", err)
+        sys.exit(2)
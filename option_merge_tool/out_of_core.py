@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import os
+import pickle
+import tempfile
+import zipfile
+
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from option_merge_tool.engine import (
+    aggregate_options,
+    drop_empty_rows,
+    first_rows_of_groups,
+    merge_options,
+    sort_by_keys,
+    stringified,
+)
+from option_merge_tool.log import logger
+from option_merge_tool.metrics import RunMetrics
+from option_merge_tool.reader import iter_table_chunks, resolve_backend
+
+
+if TYPE_CHECKING:
+    from collections.abc import Collection, Iterable, Iterator, Sequence
+    from typing import IO, Final
+
+    from option_merge_tool.settings import ReaderBackend
+
+DEFAULT_PARTITIONS: Final[int] = 16
+SPILL_PREFIX: Final[str] = "option_merge_"
+
+# ? Peak memory of the in-memory path per byte of input, measured on the benchmark product DBs
+# ? (python -m benchmarks.harness prints the estimated and measured peak memory to re-calibrate them)
+XLSX_MEMORY_FACTOR: Final[float] = 2.5  # ? per byte of uncompressed sheet XML
+CSV_MEMORY_FACTOR: Final[float] = 6.0  # ? per byte of CSV file
+
+
+def estimate_memory(file: str, backend: ReaderBackend = "auto") -> int:
+    """
+    Rough estimate in bytes of the memory the in-memory merge of the file needs, computed from
+    the size of the file (the uncompressed size of its sheets for an Excel file) without reading it.
+    """
+    if resolve_backend(file, backend) == "csv":
+        return int(os.path.getsize(file) * CSV_MEMORY_FACTOR)
+
+    with zipfile.ZipFile(file) as archive:
+        uncompressed = sum(
+            info.file_size
+            for info in archive.infolist()
+            if info.filename.startswith("xl/worksheets/")
+            or info.filename == "xl/sharedStrings.xml"
+        )
+
+    return int(uncompressed * XLSX_MEMORY_FACTOR)
+
+
+@dataclass(slots=True, frozen=True)
+class _PartitionResult:
+    first_rows: pd.DataFrame
+    # ? Stringified keys of the groups, like the index of aggregate_options
+    keys: pd.MultiIndex
+    # ? Original key values and number of rows of every group, NaN keys included
+    sizes: pd.DataFrame
+
+
+def _partition_ids(
+    dataframe: pd.DataFrame, columns: Sequence[str], partitions: int
+) -> np.ndarray:
+    # ? Hashing the stringified keys keeps every row of a group, and every original key matching it, in the same partition
+    keys = pd.DataFrame(
+        {
+            position: stringified(dataframe[column])
+            for position, column in enumerate(columns)
+        }
+    )
+    return (
+        pd.util.hash_pandas_object(keys, index=False).to_numpy() % partitions
+    ).astype(np.intp)
+
+
+def _spill(
+    chunks: Iterable[pd.DataFrame],
+    streams: Sequence[IO[bytes]],
+    columns: Sequence[str],
+    column_to_dropna: str,
+) -> tuple[int, pd.DataFrame]:
+    """
+    Writes the rows of every chunk into the stream of their partition. Returns the number of
+    read rows and an empty DataFrame with the columns of the chunks.
+    """
+    n_rows = 0
+    empty = pd.DataFrame()
+    for chunk in chunks:
+        if not n_rows:
+            empty = chunk.iloc[:0]
+        n_rows += len(chunk)
+        chunk = drop_empty_rows(chunk, column_to_dropna)
+        if chunk.empty:
+            continue
+
+        partition_ids = _partition_ids(chunk, columns, len(streams))
+        for partition_id in np.unique(partition_ids):
+            pickle.dump(
+                chunk[partition_ids == partition_id],
+                streams[partition_id],
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+
+    return n_rows, empty
+
+
+def _load_partition(stream: IO[bytes]) -> pd.DataFrame | None:
+    stream.seek(0)
+    frames: list[pd.DataFrame] = []
+    while True:
+        try:
+            frames.append(pickle.load(stream))
+        except EOFError:
+            break
+
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+
+def _merge_partition(
+    dataframe: pd.DataFrame,
+    columns: Sequence[str],
+    output_column: str,
+    join_by: str,
+) -> _PartitionResult:
+    dataframe = sort_by_keys(dataframe, columns)
+    aggregated = aggregate_options(dataframe, columns, output_column, join_by)
+
+    return _PartitionResult(
+        first_rows=first_rows_of_groups(dataframe, aggregated, columns, output_column),
+        keys=aggregated.index,
+        sizes=dataframe.groupby(list(columns), sort=False, dropna=False)
+        .size()
+        .reset_index(name="size"),
+    )
+
+
+def _combine(
+    results: Sequence[_PartitionResult], columns: Sequence[str]
+) -> pd.DataFrame:
+    """
+    Concatenates the first rows of the partitions in key order and applies the positional
+    predicate of match_options, computed from the group sizes instead of the sorted input rows.
+    """
+    first_rows = sort_by_keys(
+        pd.concat([result.first_rows for result in results], ignore_index=True),
+        columns,
+    )
+    n_rows = len(first_rows)
+
+    keys = pd.MultiIndex.from_arrays(
+        [
+            np.concatenate(
+                [result.keys.get_level_values(level).to_numpy() for result in results]
+            )
+            for level in range(len(columns))
+        ]
+    ).sort_values()
+
+    # ? The sorted input rows are the groups in key order, each repeated by its size
+    sizes = sort_by_keys(
+        pd.concat([result.sizes for result in results], ignore_index=True), columns
+    )
+    ends = np.cumsum(sizes["size"].to_numpy())
+    starts = ends - sizes["size"].to_numpy()
+    is_visible = starts < n_rows
+
+    is_member = pd.MultiIndex.from_frame(sizes.loc[is_visible, list(columns)]).isin(
+        keys[:n_rows]
+    )
+    predicate = np.repeat(
+        is_member, np.minimum(ends[is_visible], n_rows) - starts[is_visible]
+    )
+
+    return first_rows[predicate].reset_index(drop=True)
+
+
+def merge_chunks_partitioned(
+    chunks: Iterable[pd.DataFrame],
+    *,
+    first_column: str,
+    second_column: str,
+    output_column: str,
+    join_by: str,
+    column_to_dropna: str,
+    partitions: int = DEFAULT_PARTITIONS,
+    spill_dir: str | None = None,
+    metrics: RunMetrics | None = None,
+) -> tuple[pd.DataFrame, int]:
+    """
+    Same result as merge_options on the concatenated chunks, with only one partition of the
+    rows in memory at a time.
+
+    The rows are hash-partitioned by their (first_column, second_column) key into spill files,
+    every partition is sorted, aggregated and matched on its own, and the per-group results are
+    put back in key order.
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): Consecutive parts of the input, e.g. from iter_table_chunks.
+        first_column (str): First column of the group key.
+        second_column (str): Second column of the group key.
+        output_column (str): Column whose values are joined per group.
+        join_by (str): Separator placed between the joined values.
+        column_to_dropna (str): Rows with an empty value in this column are ignored.
+        partitions (int): Number of spill files, the memory holds about 1/partitions of the rows.
+        spill_dir (str | None): Directory of the spill files, the system temporary directory by default.
+        metrics (RunMetrics | None): When given, the read, groupby and match stages are recorded in it.
+    Returns:
+        tuple[pd.DataFrame, int]: The merged options and the number of input rows.
+    """
+    columns = (first_column, second_column)
+    if metrics is None:
+        metrics = RunMetrics()
+
+    with tempfile.TemporaryDirectory(prefix=SPILL_PREFIX, dir=spill_dir) as directory:
+        with ExitStack() as stack:
+            streams = [
+                stack.enter_context(
+                    open(os.path.join(directory, f"{partition}.pickle"), "w+b")
+                )
+                for partition in range(partitions)
+            ]
+
+            with metrics.span("read") as span:
+                n_rows, empty = _spill(chunks, streams, columns, column_to_dropna)
+                span.rows_in = span.rows_out = n_rows
+            logger.debug(f"Spilled {n_rows} rows into {partitions} partitions")
+
+            results: list[_PartitionResult] = []
+            with metrics.span("groupby", n_rows) as span:
+                for stream in streams:
+                    dataframe = _load_partition(stream)
+                    if dataframe is not None:
+                        results.append(
+                            _merge_partition(dataframe, columns, output_column, join_by)
+                        )
+                    del dataframe
+                span.rows_out = sum(len(result.keys) for result in results)
+
+    with metrics.span("match", span.rows_out) as span:
+        if results:
+            merged = _combine(results, columns)
+        else:  # ? Every row was filtered out, the in-memory path gives the empty result
+            merged = merge_options(
+                empty,
+                first_column=first_column,
+                second_column=second_column,
+                output_column=output_column,
+                join_by=join_by,
+                column_to_dropna=column_to_dropna,
+            )
+        span.rows_out = len(merged)
+
+    return merged, n_rows
+
+
+def merge_file_partitioned(
+    file: str,
+    *,
+    columns: Collection[str],
+    backend: ReaderBackend = "auto",
+    first_column: str,
+    second_column: str,
+    output_column: str,
+    join_by: str,
+    column_to_dropna: str,
+    partitions: int = DEFAULT_PARTITIONS,
+    spill_dir: str | None = None,
+    metrics: RunMetrics | None = None,
+) -> tuple[pd.DataFrame, int]:
+    """
+    merge_chunks_partitioned on the `columns` of the file, read in chunks.
+
+    The "auto" backend reads Excel files with openpyxl, which streams the sheet, while calamine
+    loads the whole sheet in memory before giving the first row.
+    """
+    if backend == "auto" and resolve_backend(file, backend) != "csv":
+        backend = "openpyxl"
+
+    chunks: Iterator[pd.DataFrame] = iter_table_chunks(
+        file, columns=columns, backend=backend
+    )
+
+    return merge_chunks_partitioned(
+        chunks,
+        first_column=first_column,
+        second_column=second_column,
+        output_column=output_column,
+        join_by=join_by,
+        column_to_dropna=column_to_dropna,
+        partitions=partitions,
+        spill_dir=spill_dir,
+        metrics=metrics,
+    )
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+import codecs
+import os
+
+from typing import TYPE_CHECKING
+
+from option_merge_tool.cache import is_pyarrow_available
+from option_merge_tool.paths import TEMPORARY_SUFFIX
+from option_merge_tool.settings import OUTPUT_FORMATS, OutputFormat
+
+
+if TYPE_CHECKING:
+    from typing import Final
+
+    import pandas as pd
+
+OUTPUT_EXTENSIONS: Final[dict[str, str]] = {
+    "xlsx": ".xlsx",
+    "csv": ".csv",
+    "tsv": ".tsv",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+# ? Formats that need pyarrow, CSV and TSV fall back to pandas without it
+ARROW_FORMATS: Final[frozenset[str]] = frozenset(("parquet", "arrow"))
+
+
+def output_format_of(filename: str) -> OutputFormat:
+    """Returns the output format given by the extension of the filename, "xlsx" for an unknown extension."""
+    extension = os.path.splitext(filename)[1].lower()
+    for output_format, format_extension in OUTPUT_EXTENSIONS.items():
+        if extension == format_extension:
+            return output_format  # type: ignore
+
+    return "xlsx"
+
+
+def with_output_format(filename: str, output_format: OutputFormat) -> str:
+    """Replaces the extension of the filename by the one of the output format."""
+    return f"{os.path.splitext(filename)[0]}{OUTPUT_EXTENSIONS[output_format]}"
+
+
+def _write_arrow(dataframe: pd.DataFrame, filename: str, output_format: str) -> None:
+    import pyarrow as pa  # type: ignore
+
+    # ? Arrow only stores string column names (e.g. not the numbers of a header)
+    table = pa.Table.from_pandas(
+        dataframe.rename(columns=str), preserve_index=False
+    ).replace_schema_metadata(None)
+
+    if output_format == "parquet":
+        from pyarrow import parquet  # type: ignore
+
+        parquet.write_table(table, filename)
+    elif output_format == "arrow":
+        from pyarrow import feather  # type: ignore
+
+        feather.write_feather(table, filename)
+    else:
+        from pyarrow import csv  # type: ignore
+
+        with open(filename, "wb") as f:
+            # ? Same BOM as the CSV files read by the tool, so that Excel opens the Korean text correctly
+            f.write(codecs.BOM_UTF8)
+            csv.write_csv(
+                table,
+                f,
+                write_options=csv.WriteOptions(
+                    delimiter="\t" if output_format == "tsv" else ","
+                ),
+            )
+
+
+def write_table(
+    dataframe: pd.DataFrame, filename: str, output_format: OutputFormat
+) -> None:
+    """
+    Writes the DataFrame as a plain CSV, TSV, Parquet or Arrow IPC (Feather) file, without any formatting.
+
+    The file is written next to its final path and only renamed once it is complete. CSV and
+    TSV are written with the Arrow CSV writer when pyarrow is installed, and by pandas otherwise.
+
+    Raises:
+        ValueError: If the format is "xlsx" (written through the template) or unknown.
+        ImportError: If the format is "parquet" or "arrow" but pyarrow is not installed.
+    """
+    if output_format not in OUTPUT_FORMATS or output_format == "xlsx":
+        raise ValueError(
+            f"Unknown table format: {output_format} (expected one of {OUTPUT_FORMATS[1:]})"
+        )
+
+    pyarrow_available = is_pyarrow_available()
+    if output_format in ARROW_FORMATS and not pyarrow_available:
+        raise ImportError(
+            f"The {output_format} output format requires pyarrow (pip install pyarrow)"
+        )
+
+    temporary_filename = f"{filename}{TEMPORARY_SUFFIX}"
+    try:
+        if pyarrow_available:
+            _write_arrow(dataframe, temporary_filename, output_format)
+        else:
+            dataframe.to_csv(
+                temporary_filename,
+                sep="\t" if output_format == "tsv" else ",",
+                encoding="utf-8-sig",
+                index=False,
+            )
+    except BaseException:
+        if os.path.exists(temporary_filename):
+            os.remove(temporary_filename)
+        raise
+
+    os.replace(temporary_filename, filename)
+
+
+def write_dataframe(dataframe: pd.DataFrame, filename: str) -> None:
+    """Writes the DataFrame in the format given by the extension of the filename, a plain sheet for .xlsx."""
+    output_format = output_format_of(filename)
+    if output_format == "xlsx":
+        dataframe.to_excel(filename, index=False)
+    else:
+        write_table(dataframe, filename, output_format)
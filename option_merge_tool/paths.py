@@ -0,0 +1,30 @@
+from __future__ import annotations
+
+import os
+import sys
+
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from typing import Final
+
+TODAY_DATE = f"{datetime.now().strftime('%Y%m%d')}"
+SCRIPT_PATH: Final[str] = os.path.dirname(os.path.realpath(sys.argv[0]))
+# ? The output is written next to its final path and only renamed once it is complete
+TEMPORARY_SUFFIX: Final[str] = ".tmp"
+
+
+def today_date() -> str:
+    """The current date, unlike TODAY_DATE which is the date at which the program started."""
+    return datetime.now().strftime("%Y%m%d")
+
+
+def output_directory() -> str:
+    # ? Computed on every call so that a long-running process (e.g. --watch) rolls over to the new date folder
+    return os.path.join(SCRIPT_PATH, "output", today_date())
+
+
+def default_output_filename() -> str:
+    return os.path.join(output_directory(), "MERGED_OPTIONS.xlsx")
@@ -0,0 +1,441 @@
+from __future__ import annotations
+
+import os
+import zipfile
+
+from dataclasses import dataclass
+from difflib import get_close_matches
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Literal
+
+from option_merge_tool.engine import drop_empty_rows
+from option_merge_tool.metrics import MEGABYTE
+from option_merge_tool.out_of_core import estimate_memory
+from option_merge_tool.reader import (
+    list_sheets,
+    read_header,
+    read_sample,
+    read_sheet_headers,
+    resolve_backend,
+)
+from option_merge_tool.settings import ALL_SHEETS
+
+
+if TYPE_CHECKING:
+    from collections.abc import Collection, Sequence
+    from typing import Any, Final
+
+    import pandas as pd
+
+    from option_merge_tool.job import MergeSpec
+    from option_merge_tool.settings import ReaderBackend
+    from option_merge_tool.template import CompiledTemplate
+
+Strategy = Literal["in_memory", "lean_memory", "out_of_core"]
+
+# ? Rows read from the start of the input file to estimate the number of groups and the memory of the merge
+SAMPLE_ROWS: Final[int] = 1000
+# ? Peak memory of the merge per byte of the parsed columns, measured on the benchmark product DBs
+# ? (python -m benchmarks.harness prints the estimated and measured peak memory to re-calibrate them)
+IN_MEMORY_FACTOR: Final[float] = 2.0
+LEAN_MEMORY_FACTOR: Final[float] = 1.7
+# ? Size of the integer code of a dictionary-encoded value (at most, pandas picks the smallest type)
+CODE_BYTES: Final[int] = 4
+# ? The <dimension> element is written before the rows, at the start of the sheet XML
+DIMENSION_BYTES: Final[int] = 4096
+
+
+class PreflightError(ValueError):
+    """The settings do not match the header of the input file or of the template."""
+
+    def __init__(self, problems: Sequence[str]) -> None:
+        super().__init__("\n".join(problems))
+        self.problems = tuple(problems)
+
+
+@dataclass(slots=True, frozen=True)
+class Preflight:
+    """
+    The strategy picked for the merge of an input file, with the estimates it is based on.
+
+    The estimates are extrapolated from the first rows of the file, `estimated_rows` (and the
+    estimates that depend on it) is None when the number of rows cannot be known without
+    reading the whole file. `estimated_groups` assumes that the rows of a group are next to
+    each other, as in the product DB exports, it is an upper bound otherwise.
+    """
+
+    strategy: Strategy
+    # ? The sheets to read and concatenate, None for the first sheet only
+    sheets: tuple[str, ...] | None
+    sample_rows: int
+    estimated_rows: int | None
+    estimated_groups: int | None
+    estimated_memory: int
+    estimated_lean_memory: int | None
+
+    def describe(self) -> str:
+        estimates = [f"estimated memory {self.estimated_memory / MEGABYTE:.0f} MB"]
+        if self.estimated_lean_memory is not None:
+            estimates.append(
+                f"{self.estimated_lean_memory / MEGABYTE:.0f} MB dictionary-encoded"
+            )
+        if self.estimated_rows is not None:
+            estimates[:0] = [
+                f"~{self.estimated_rows} rows",
+                f"~{self.estimated_groups} groups",
+            ]
+
+        return f"{self.strategy} ({', '.join(estimates)})"
+
+
+def _displayed(name: Any) -> str:
+    # ? The line breaks of the Korean multi-line headers are shown the way they are typed on the command line
+    return '"{}"'.format(str(name).replace("\n", "\\n"))
+
+
+def _suggestion(name: str, candidates: Sequence[Any]) -> str:
+    names = [str(candidate) for candidate in candidates]
+    # ? Most misspellings are a space instead of a line break (or the other way around)
+    flattened = {" ".join(candidate.split()): candidate for candidate in names}
+    match = flattened.get(" ".join(name.split()))
+    if match is None:
+        matches = get_close_matches(name, names, n=1)
+        match = matches[0] if matches else None
+
+    return f" (did you mean {_displayed(match)}?)" if match is not None else ""
+
+
+def _missing_column(setting: str, name: str, header: Sequence[Any], file: str) -> str:
+    return f"{setting} {_displayed(name)} is not a column of {Path(file).name}{_suggestion(name, header)}"
+
+
+def resolve_sheets(
+    file: str, sheets: Sequence[str], backend: ReaderBackend = "auto"
+) -> tuple[tuple[str, ...], list[str]]:
+    """
+    Returns the names of the sheets to read (every sheet of the file for ALL_SHEETS, in the order
+    of the tabs) and the problems of `sheets`, e.g. a name that is not a sheet of the file.
+    """
+    if resolve_backend(file, backend) == "csv":
+        return (), [f"{Path(file).name} is a CSV file, it has no sheets"]
+
+    names = list_sheets(file)
+    if ALL_SHEETS in sheets:
+        return tuple(names), []
+
+    problems = [
+        f"sheets {_displayed(sheet)} is not a sheet of {Path(file).name}{_suggestion(sheet, names)}"
+        for sheet in sheets
+        if sheet not in names
+    ]
+    return tuple(dict.fromkeys(sheets)), problems
+
+
+def check_sheet_headers(
+    file: str,
+    sheets: Sequence[str],
+    headers: Sequence[Sequence[Any]],
+    columns: Collection[str],
+) -> list[str]:
+    """Returns the problems of the sheets whose loaded `columns` differ from the ones of the first sheet."""
+    expected = [name for name in headers[0] if name in columns]
+    problems: list[str] = []
+    for sheet, header in zip(sheets[1:], headers[1:]):
+        loaded = [name for name in header if name in columns]
+        missing = [name for name in expected if name not in loaded]
+        extra = [name for name in loaded if name not in expected]
+        if missing:
+            problems.append(
+                f"The sheet {_displayed(sheet)} of {Path(file).name} has no column {', '.join(map(_displayed, missing))}"
+                f" (the sheet {_displayed(sheets[0])} has)"
+            )
+        if extra:
+            problems.append(
+                f"The sheet {_displayed(sheet)} of {Path(file).name} has the column {', '.join(map(_displayed, extra))}"
+                f" that the sheet {_displayed(sheets[0])} does not have"
+            )
+
+    return problems
+
+
+def check_columns(
+    input_file: str,
+    input_header: Sequence[Any],
+    template_file: str,
+    template_header: Sequence[Any],
+    *,
+    first_column: str,
+    second_column: str,
+    output_column: str,
+    column_to_dropna: str,
+    columns_to_drop_dulicates: Sequence[str],
+    extra_merges: Sequence[MergeSpec] = (),
+    shard_by: str | None = None,
+) -> list[str]:
+    """Returns the problems of the settings against the headers of the input file and of the template."""
+    if not input_header:
+        return [f"{Path(input_file).name} has no header row"]
+
+    settings: list[tuple[str, str]] = [
+        ("first_column", first_column),
+        ("second_column", second_column),
+        ("output_column", output_column),
+        ("column_to_dropna", column_to_dropna),
+        *(
+            ("columns_to_drop_dulicates", column)
+            for column in columns_to_drop_dulicates
+        ),
+    ]
+    for position, spec in enumerate(extra_merges, start=2):
+        settings.extend(
+            (f"merge {position} {key}", getattr(spec, key))
+            for key in ("first_column", "second_column", "output_column")
+        )
+    if shard_by is not None:
+        settings.append(("shard_by", shard_by))
+
+    input_columns = frozenset(input_header)
+    problems = [
+        _missing_column(setting, name, input_header, input_file)
+        for setting, name in settings
+        if name not in input_columns
+    ]
+
+    template_columns = frozenset(template_header)
+    outputs = [("output_column", output_column)]
+    outputs.extend(
+        (f"merge {position} output_column", spec.output_column)
+        for position, spec in enumerate(extra_merges, start=2)
+    )
+    problems.extend(
+        f"{_missing_column(setting, name, template_header, template_file)}, the merged options would not be saved"
+        for setting, name in outputs
+        if name not in template_columns
+    )
+
+    if not input_columns & template_columns:
+        problems.append(
+            f"{Path(input_file).name} and {Path(template_file).name} have no column in common"
+        )
+
+    return problems
+
+
+def estimate_rows(
+    file: str,
+    backend: ReaderBackend = "auto",
+    nrows: int = SAMPLE_ROWS,
+    sheet: str | None = None,
+) -> int | None:
+    """
+    Estimates the number of data rows of the file without parsing it: from the <dimension> of
+    the first sheet (or of the sheet named `sheet`) of an Excel file (None when it has none), or
+    from the size of the first lines of a CSV file.
+    """
+    if resolve_backend(file, backend) == "csv":
+        with open(file, "rb") as f:
+            lines = list(islice(f, nrows + 1))
+        if len(lines) <= nrows:
+            return max(len(lines) - 1, 0)
+
+        sample_size = sum(len(line) for line in lines[1:])
+        return round((os.path.getsize(file) - len(lines[0])) / sample_size * nrows)
+
+    from openpyxl.utils.cell import range_boundaries
+
+    from option_merge_tool.template_writer import (
+        DIMENSION_RE,
+        worksheet_location,
+        worksheet_names,
+    )
+
+    try:
+        with zipfile.ZipFile(file) as archive:
+            index = 0 if sheet is None else worksheet_names(archive).index(sheet)
+            path, _ = worksheet_location(archive, index)
+            with archive.open(path) as f:
+                head = f.read(DIMENSION_BYTES).decode("utf-8", errors="ignore")
+    except (
+        zipfile.BadZipFile,
+        KeyError,
+        ValueError,
+    ):  # ? ValueError includes UnsupportedTemplateError
+        return None
+
+    match = DIMENSION_RE.search(head)
+    # ? A single cell reference (e.g. "A1") is written by the tools that do not track the used range
+    if match is None or ":" not in match.group("ref"):
+        return None
+
+    try:
+        _, min_row, _, max_row = range_boundaries(match.group("ref"))
+    except ValueError:
+        return None
+
+    return max((max_row or 1) - (min_row or 1), 0)
+
+
+def _lean_bytes(sample: pd.DataFrame, plain_columns: Collection[str]) -> float:
+    """Bytes of the sample once its columns (except `plain_columns`) are dictionary-encoded."""
+    total = 0.0
+    usage = sample.memory_usage(index=False, deep=True)
+    for name in sample.columns:
+        if name in plain_columns:
+            total += usage[name]
+        else:
+            distinct = sample[name].nunique(dropna=False) / len(sample)
+            total += CODE_BYTES * len(sample) + usage[name] * distinct
+
+    return total
+
+
+def run_preflight(
+    input_file: str,
+    template_file: str,
+    template: CompiledTemplate,
+    *,
+    columns: Collection[str],
+    first_column: str,
+    second_column: str,
+    output_column: str,
+    column_to_dropna: str,
+    columns_to_drop_dulicates: Sequence[str],
+    extra_merges: Sequence[MergeSpec] = (),
+    shard_by: str | None = None,
+    reader_backend: ReaderBackend = "auto",
+    lean_memory: bool = False,
+    memory_budget_mb: int | None = None,
+    can_spill: bool = True,
+    sheets: Sequence[str] | None = None,
+    sample_rows: int = SAMPLE_ROWS,
+) -> Preflight:
+    """
+    Checks the settings against the headers of the input file and of the template, then reads
+    the first `sample_rows` rows of the `columns` to pick how the file is merged:
+
+    - "in_memory" when the estimated memory fits in `memory_budget_mb` (or without a budget),
+    - "lean_memory" (dictionary-encoded columns) when only the encoded columns fit, or when
+      `lean_memory` is requested,
+    - "out_of_core" when neither fits and the merge `can_spill` (see merge_file_partitioned).
+
+    With `sheets` (names, or ALL_SHEETS), the sheets are checked to exist and to have the same
+    columns, the sample is read from the first one and the rows of all of them are estimated.
+
+    It only reads the headers and the sample, so a misspelled column fails in a fraction of a second
+    instead of after the whole input file is parsed.
+
+    Raises:
+        PreflightError: If a column of the settings is missing from the input file or the template,
+            or a sheet is missing or does not have the columns of the first one.
+    """
+    # ? calamine loads the whole sheet before giving its first row, openpyxl streams it
+    backend: ReaderBackend = (
+        "csv" if resolve_backend(input_file, reader_backend) == "csv" else "openpyxl"
+    )
+    resolved: tuple[str, ...] | None = None
+    if sheets is not None:
+        resolved, problems = resolve_sheets(input_file, sheets, backend)
+        if not problems and not resolved:
+            problems = [f"{Path(input_file).name} has no sheet"]
+        if problems:
+            raise PreflightError(problems)
+
+    headers = (
+        [read_header(input_file, backend=backend)]
+        if resolved is None
+        else read_sheet_headers(input_file, resolved, backend=backend)
+    )
+    problems = check_columns(
+        input_file,
+        headers[0],
+        template_file,
+        template.header,
+        first_column=first_column,
+        second_column=second_column,
+        output_column=output_column,
+        column_to_dropna=column_to_dropna,
+        columns_to_drop_dulicates=columns_to_drop_dulicates,
+        extra_merges=extra_merges,
+        shard_by=shard_by,
+    )
+    if resolved is not None:
+        problems.extend(check_sheet_headers(input_file, resolved, headers, columns))
+    if problems:
+        raise PreflightError(problems)
+
+    requested: Strategy = "lean_memory" if lean_memory else "in_memory"
+    estimated_rows: int | None = 0
+    for sheet in resolved or (None,):
+        rows = estimate_rows(input_file, backend, sample_rows, sheet)
+        if rows is None:
+            estimated_rows = None
+            break
+        estimated_rows += rows
+    # ? The sample is only read when its estimates can be extrapolated to the number of rows
+    sample = (
+        read_sample(
+            input_file,
+            columns=columns,
+            nrows=sample_rows,
+            backend=backend,
+            sheet=None if resolved is None else resolved[0],
+        )
+        if estimated_rows
+        else None
+    )
+    if estimated_rows is None or sample is None or sample.empty:
+        # ? Without the number of rows, the memory is estimated from the size of the file
+        estimated_memory = (
+            estimate_memory(input_file, reader_backend) if estimated_rows is None else 0
+        )
+        strategy: Strategy = (
+            "out_of_core"
+            if memory_budget_mb is not None
+            and can_spill
+            and estimated_memory > memory_budget_mb * MEGABYTE
+            else requested
+        )
+        return Preflight(
+            strategy=strategy,
+            sheets=resolved,
+            sample_rows=0 if sample is None else len(sample),
+            estimated_rows=estimated_rows,
+            estimated_groups=0 if estimated_rows is not None else None,
+            estimated_memory=estimated_memory,
+            estimated_lean_memory=0 if estimated_rows is not None else None,
+        )
+
+    scale = estimated_rows / len(sample)
+    groups = len(
+        drop_empty_rows(sample, column_to_dropna).drop_duplicates(
+            [first_column, second_column]
+        )
+    )
+    output_columns = {output_column, *(spec.output_column for spec in extra_merges)}
+    estimated_memory = int(
+        sample.memory_usage(index=False, deep=True).sum() * scale * IN_MEMORY_FACTOR
+    )
+    estimated_lean_memory = int(
+        _lean_bytes(sample, output_columns) * scale * LEAN_MEMORY_FACTOR
+    )
+
+    strategy = requested
+    if memory_budget_mb is not None:
+        budget = memory_budget_mb * MEGABYTE
+        if requested == "in_memory" and estimated_memory <= budget:
+            strategy = "in_memory"
+        elif estimated_lean_memory <= budget or not can_spill:
+            strategy = "lean_memory"
+        else:
+            strategy = "out_of_core"
+
+    return Preflight(
+        strategy=strategy,
+        sheets=resolved,
+        sample_rows=len(sample),
+        estimated_rows=estimated_rows,
+        estimated_groups=round(groups * scale),
+        estimated_memory=estimated_memory,
+        estimated_lean_memory=estimated_lean_memory,
+    )
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import pandas as pd
+
+from option_merge_tool.engine import merge_options, normalize_options
+from option_merge_tool.reader import read_sample
+
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from concurrent.futures import Future
+    from typing import Final
+
+    from option_merge_tool.settings import ReaderBackend
+
+# ? Rows read once per input file, the preview is recomputed from them on every change of the settings
+PREVIEW_ROWS: Final[int] = 2000
+PREVIEW_GROUPS: Final[int] = 20
+# ? Seconds without a change of the settings before the preview is recomputed, e.g. while the separator is typed
+DEBOUNCE: Final[float] = 0.15
+
+
+@dataclass(slots=True, frozen=True)
+class PreviewRequest:
+    first_column: str
+    second_column: str
+    output_column: str
+    join_by: str
+
+
+@dataclass(slots=True, frozen=True)
+class PreviewResult:
+    """
+    The merged rows of the first groups of the sample, or why they could not be merged. They
+    are approximate, see preview_merge.
+    """
+
+    request: PreviewRequest
+    rows: pd.DataFrame | None
+    sample_rows: int
+    elapsed: float
+    error: str | None = None
+
+
+def preview_merge(
+    table: pd.DataFrame,
+    *,
+    first_column: str,
+    second_column: str,
+    output_column: str,
+    join_by: str,
+    column_to_dropna: str,
+    columns_to_drop_dulicates: Sequence[str] = (),
+    groups: int = PREVIEW_GROUPS,
+) -> pd.DataFrame:
+    """
+    Merges the sample with merge_options and keeps its first `groups` rows, in the key order of
+    the output. Only the key and output columns are returned.
+
+    The result is approximate: the later rows of the file may add options to these groups or
+    have smaller keys, and the first row kept for a group depends on the whole input.
+    """
+    columns = [first_column, second_column]
+    merged = normalize_options(
+        merge_options(
+            table,
+            first_column=first_column,
+            second_column=second_column,
+            output_column=output_column,
+            join_by=join_by,
+            column_to_dropna=column_to_dropna,
+        ),
+        column_to_dropna,
+        columns_to_drop_dulicates,
+    )
+
+    return merged[list(dict.fromkeys([*columns, output_column]))].head(groups)
+
+
+class LivePreview:
+    """
+    Keeps the first PREVIEW_ROWS rows of the input file in memory and merges the first groups of
+    them whenever the settings change, in a background thread. The whole file is only parsed by
+    the merge worker, which keeps it in its own process.
+
+    request() only records the latest settings. poll(), called on every frame, starts the merge
+    once the settings did not change for DEBOUNCE seconds, and returns its result unless newer
+    settings were requested meanwhile (the result is then dropped and the merge runs again).
+    """
+
+    def __init__(
+        self,
+        *,
+        column_to_dropna: str,
+        columns_to_drop_dulicates: Sequence[str],
+        reader_backend: ReaderBackend,
+    ) -> None:
+        self.column_to_dropna = column_to_dropna
+        self.columns_to_drop_dulicates = columns_to_drop_dulicates
+        self.reader_backend = reader_backend
+
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._sample: Future[pd.DataFrame] | None = None
+        self._pending: PreviewRequest | None = None
+        self._last: PreviewRequest | None = None
+        self._requested_at = 0.0
+        self._running: Future[PreviewResult] | None = None
+
+    def load(self, input_file: str, sheet: str | None = None) -> None:
+        """Reads the sample of another input file, the preview of the previous one is dropped."""
+        if self._sample is not None:
+            self._sample.cancel()
+        self._sample = self._executor.submit(
+            read_sample,
+            input_file,
+            nrows=PREVIEW_ROWS,
+            backend=self.reader_backend,
+            sheet=sheet,
+        )
+        self._running = None
+
+    def request(self, request: PreviewRequest) -> None:
+        self._pending = request
+        self._requested_at = time.perf_counter()
+
+    def poll(self) -> PreviewResult | None:
+        if self._running is not None:
+            if not self._running.done():
+                return None
+            running, self._running = self._running, None
+            if self._pending is None:
+                if (err := running.exception()) is not None:
+                    return PreviewResult(
+                        request=self._last,
+                        rows=None,
+                        sample_rows=0,
+                        elapsed=0.0,
+                        error=f"Could not merge the preview: {err!r}",
+                    )
+                return running.result()
+
+        if (
+            self._pending is None
+            or self._sample is None
+            or not self._sample.done()
+            or time.perf_counter() - self._requested_at < DEBOUNCE
+        ):
+            return None
+
+        request, self._pending = self._pending, None
+        self._last = request
+        if (err := self._sample.exception()) is not None:
+            return PreviewResult(
+                request=request,
+                rows=None,
+                sample_rows=0,
+                elapsed=0.0,
+                error=f"Could not read the input file: {err!r}",
+            )
+
+        self._running = self._executor.submit(
+            self._merge, self._sample.result(), request
+        )
+        return None
+
+    def _merge(self, table: pd.DataFrame, request: PreviewRequest) -> PreviewResult:
+        started_at = time.perf_counter()
+        try:
+            rows = preview_merge(
+                table,
+                first_column=request.first_column,
+                second_column=request.second_column,
+                output_column=request.output_column,
+                join_by=request.join_by,
+                column_to_dropna=self.column_to_dropna,
+                columns_to_drop_dulicates=self.columns_to_drop_dulicates,
+            )
+        except Exception as err:  # ? Never raised into the render loop of the GUI
+            return PreviewResult(
+                request=request,
+                rows=None,
+                sample_rows=len(table),
+                elapsed=time.perf_counter() - started_at,
+                # ? e.g. a column of the settings is not in this input file
+                error=(
+                    f"Unknown column: {err}"
+                    if isinstance(err, KeyError)
+                    else f"Could not merge the preview: {err!r}"
+                ),
+            )
+
+        return PreviewResult(
+            request=request,
+            rows=rows,
+            sample_rows=len(table),
+            elapsed=time.perf_counter() - started_at,
+        )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from typing import Final
+
+MERGE_STAGES: Final[tuple[str, ...]] = ("read", "merge", "clean", "template")
+STAGE_LABELS: Final[dict[str, str]] = {
+    "read": "Reading the input file",
+    "merge": "Merging the options",
+    "clean": "Removing empty and duplicated rows",
+    "template": "Formatting the template",
+}
+
+
+@dataclass(slots=True, frozen=True)
+class Progress:
+    """Sent when a stage of the merge starts, `rows` is the number of rows processed so far."""
+
+    stage: str
+    step: int
+    total: int
+    rows: int
+
+    @property
+    def label(self) -> str:
+        return STAGE_LABELS.get(self.stage, self.stage)
+
+
+ProgressCallback = Callable[[Progress], None]
+
+
+def report_progress(
+    progress: ProgressCallback | None, stage: str, rows: int = 0
+) -> None:
+    if progress is not None:
+        progress(
+            Progress(
+                stage=stage,
+                step=MERGE_STAGES.index(stage),
+                total=len(MERGE_STAGES),
+                rows=rows,
+            )
+        )
@@ -0,0 +1,824 @@
+from __future__ import annotations
+
+import datetime
+import multiprocessing
+import os
+import zipfile
+
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import chain, islice
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from pandas.api.types import union_categoricals
+from pandas.io.parsers import TextParser
+
+from option_merge_tool.cache import file_fingerprint, is_pyarrow_available
+from option_merge_tool.log import logger
+from option_merge_tool.settings import ALL_SHEETS, READER_BACKENDS, ReaderBackend
+
+
+if TYPE_CHECKING:
+    from collections.abc import Collection, Iterable, Iterator, Sequence
+    from typing import Any, Final
+
+    from option_merge_tool.cache import InputCache
+
+CSV_EXTENSIONS: Final[tuple[str, ...]] = (".csv", ".tsv", ".tab")
+TSV_EXTENSIONS: Final[tuple[str, ...]] = (".tsv", ".tab")
+
+# ? Rows per DataFrame of iter_table_chunks, and the matching Arrow block size for CSV files
+CHUNK_ROWS: Final[int] = 50_000
+CHUNK_BLOCK_SIZE: Final[int] = 8 << 20
+
+# ? Below this file size, starting the worker processes takes longer than parsing the sheets one after the other
+PARALLEL_MIN_BYTES: Final[int] = 1 << 20
+
+# ? A single NaN object, so that every error cell is the same dictionary key when the columns are encoded
+NAN: Final[float] = float("nan")
+
+# ? Error cells (#REF!, #N/A, ...) are read as NaN by pandas, the streaming readers only see their text
+ERROR_CODES: Final[frozenset[str]] = frozenset(
+    ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A")
+)
+
+
+def is_calamine_available() -> bool:
+    try:
+        import python_calamine  # type: ignore # noqa: F401
+    except ImportError:
+        return False
+
+    return True
+
+
+def resolve_backend(file: str, backend: ReaderBackend = "auto") -> ReaderBackend:
+    """
+    Resolves the "auto" backend to a concrete one based on the file extension and the installed packages.
+
+    Raises:
+        ValueError: If the backend is unknown.
+        ImportError: If the calamine backend is requested but python-calamine is not installed.
+    """
+    if backend not in READER_BACKENDS:
+        raise ValueError(
+            f"Unknown reader backend: {backend} (expected one of {READER_BACKENDS})"
+        )
+
+    if backend == "calamine" and not is_calamine_available():
+        raise ImportError(
+            "The calamine reader backend requires python-calamine (pip install python-calamine)"
+        )
+
+    if backend != "auto":
+        return backend
+
+    if file.lower().endswith(CSV_EXTENSIONS):
+        return "csv"
+
+    return "calamine" if is_calamine_available() else "openpyxl"
+
+
+def _resolve_sheet_backend(
+    file: str, backend: ReaderBackend, sheet: str | None
+) -> ReaderBackend:
+    backend = resolve_backend(file, backend)
+    if sheet is not None and backend == "csv":
+        raise ValueError(f"{os.path.basename(file)} is a CSV file, it has no sheets")
+
+    return backend
+
+
+def _convert_value(value: Any) -> Any:
+    """Mirrors pandas' openpyxl cell conversion so that every backend gives the same strings."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        if value.is_integer():
+            return int(value)
+    elif isinstance(value, str):
+        if value in ERROR_CODES:
+            return NAN
+    elif isinstance(value, datetime.date) and not isinstance(value, datetime.datetime):
+        return datetime.datetime(value.year, value.month, value.day)
+
+    return value
+
+
+def _iter_openpyxl_rows(
+    file: str, nrows: int | None = None, sheet: str | None = None
+) -> Iterator[Iterable[Any]]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        worksheet: Any = workbook.worksheets[0] if sheet is None else workbook[sheet]
+        worksheet.reset_dimensions()
+        yield from worksheet.iter_rows(max_row=nrows, values_only=True)
+    finally:
+        workbook.close()
+
+
+def _iter_calamine_rows(
+    file: str, nrows: int | None = None, sheet: str | None = None
+) -> Iterator[Iterable[Any]]:
+    from python_calamine import CalamineWorkbook  # type: ignore
+
+    workbook: Any = CalamineWorkbook.from_path(file)
+    try:
+        worksheet = (
+            workbook.get_sheet_by_index(0)
+            if sheet is None
+            else workbook.get_sheet_by_name(sheet)
+        )
+        if worksheet.start in (None, (0, 0)):
+            # ? Rows are converted to Python objects one at a time, to_python converts the whole sheet at once
+            yield from islice(worksheet.iter_rows(), nrows)
+        else:
+            # ? The empty area before the first used cell is kept, like pandas does
+            yield from worksheet.to_python(skip_empty_area=False, nrows=nrows)
+    finally:
+        workbook.close()
+
+
+def _iter_rows(
+    file: str,
+    backend: ReaderBackend,
+    nrows: int | None = None,
+    sheet: str | None = None,
+) -> Iterator[list[Any]]:
+    """The converted rows of the sheet named `sheet`, or of the first sheet when it is None."""
+    rows = (
+        _iter_calamine_rows(file, nrows, sheet)
+        if backend == "calamine"
+        else _iter_openpyxl_rows(file, nrows, sheet)
+    )
+
+    for row in rows:
+        yield _converted_row(row)
+
+
+def _converted_row(row: Iterable[Any]) -> list[Any]:
+    converted_row = [_convert_value(value) for value in row]
+    while converted_row and converted_row[-1] == "":
+        converted_row.pop()
+
+    return converted_row
+
+
+def _parse_header(header: list[Any]) -> list[Any]:
+    """Applies pandas' header rules (duplicates as "name.1", blanks as "Unnamed: n") to a header row."""
+    if not header:
+        return []
+
+    return list(TextParser([header], header=0).read().columns)
+
+
+def _parse_rows(rows: list[list[Any]], names: list[Any] | None = None) -> pd.DataFrame:
+    # ? Same parser and options as pd.read_excel(dtype=str) so that NA values, numbers and dates are converted identically
+    if names is None:
+        return TextParser(rows, header=0, dtype=str, skip_blank_lines=False).read()
+
+    if not rows:
+        return pd.DataFrame(columns=names, dtype=object)
+
+    return TextParser(
+        rows, header=None, names=names, dtype=str, skip_blank_lines=False
+    ).read()
+
+
+def _read_spreadsheet(
+    file: str,
+    columns: Collection[str] | None,
+    backend: ReaderBackend,
+    nrows: int | None = None,
+    sheet: str | None = None,
+) -> pd.DataFrame:
+    # ? The header row is one of the read rows
+    rows = _iter_rows(file, backend, None if nrows is None else nrows + 1, sheet)
+    header = next(rows, [])
+
+    if columns is None:
+        data = [header, *rows]
+        last_row_with_data = max(
+            (idx for idx, row in enumerate(data) if row), default=-1
+        )
+        data = data[: last_row_with_data + 1]
+        if not data:
+            return pd.DataFrame()
+
+        width = max(len(row) for row in data)
+        return _parse_rows([row + [""] * (width - len(row)) for row in data])
+
+    names = _parse_header(header)
+    positions = [idx for idx, name in enumerate(names) if name in columns]
+    selected = [names[idx] for idx in positions]
+
+    data: list[list[Any]] = []
+    last_row_with_data = -1
+    for row in rows:
+        length = len(row)
+        data.append([row[idx] if idx < length else "" for idx in positions])
+        if length:
+            last_row_with_data = len(data) - 1
+
+    return _parse_rows(data[: last_row_with_data + 1], selected)
+
+
+@dataclass(slots=True)
+class _DictionaryEncoder:
+    """Stores a column as one integer code per row and each distinct raw value once."""
+
+    codes: array[int] = field(default_factory=lambda: array("i"))
+    uniques: list[Any] = field(default_factory=list)
+    _strings: dict[str, int] = field(default_factory=dict)
+    _others: dict[tuple[type, Any], int] = field(default_factory=dict)
+
+    def append(self, value: Any) -> None:
+        # ? Other types are keyed with their type, e.g. so that True and 1 stay different values
+        if value.__class__ is str:
+            code = self._strings.get(value)
+            if code is None:
+                code = self._strings[value] = len(self.uniques)
+                self.uniques.append(value)
+        else:
+            key = (value.__class__, value)
+            code = self._others.get(key)
+            if code is None:
+                code = self._others[key] = len(self.uniques)
+                self.uniques.append(value)
+
+        self.codes.append(code)
+
+    def to_categorical(self, name: Any, n_rows: int) -> pd.Categorical:
+        # ? Only the distinct values go through the parser, the conversion of a value does not depend on the other rows
+        parsed = _parse_rows([[value] for value in self.uniques], [name])[name]
+        categorical = pd.Categorical(parsed)  # ? Sorted categories, NaN is code -1
+
+        codes = np.frombuffer(self.codes, dtype=np.int32)[:n_rows]
+        return pd.Categorical.from_codes(
+            categorical.codes[codes], dtype=categorical.dtype
+        )
+
+
+def _read_spreadsheet_encoded(
+    file: str,
+    columns: Collection[str],
+    categories: Collection[str],
+    backend: ReaderBackend,
+    sheet: str | None = None,
+) -> pd.DataFrame:
+    """
+    Same result as _read_spreadsheet (with the `categories` columns as categoricals), but the
+    `categories` columns are dictionary-encoded while the rows are streamed, so the whole sheet is
+    never held as Python objects.
+    """
+    rows = _iter_rows(file, backend, sheet=sheet)
+    names = _parse_header(next(rows, []))
+    positions = [idx for idx, name in enumerate(names) if name in columns]
+    selected = [names[idx] for idx in positions]
+
+    encoders: dict[Any, _DictionaryEncoder] = {
+        name: _DictionaryEncoder() for name in selected if name in categories
+    }
+    plain: dict[Any, list[Any]] = {
+        name: [] for name in selected if name not in categories
+    }
+    appends = [
+        encoders[name].append if name in encoders else plain[name].append
+        for name in selected
+    ]
+
+    n_rows = 0
+    last_row_with_data = -1
+    for row in rows:
+        length = len(row)
+        for append, idx in zip(appends, positions):
+            append(row[idx] if idx < length else "")
+        if length:
+            last_row_with_data = n_rows
+        n_rows += 1
+
+    n_rows = last_row_with_data + 1
+    if not n_rows:
+        return pd.DataFrame(columns=selected, dtype=object)
+
+    parsed_plain = _parse_rows(
+        [list(row) for row in zip(*(values[:n_rows] for values in plain.values()))],
+        list(plain),
+    )
+
+    return pd.DataFrame(
+        {
+            name: encoders[name].to_categorical(name, n_rows)
+            if name in encoders
+            else parsed_plain[name]
+            for name in selected
+        },
+        columns=selected,
+    )
+
+
+def encode_columns(
+    dataframe: pd.DataFrame, categories: Collection[str]
+) -> pd.DataFrame:
+    """Converts the `categories` columns of the DataFrame to categoricals (with sorted categories)."""
+    for name in dataframe.columns:
+        if name in categories and not isinstance(
+            dataframe[name].dtype, pd.CategoricalDtype
+        ):
+            dataframe[name] = pd.Categorical(dataframe[name])
+
+    return dataframe
+
+
+def csv_delimiter(file: str) -> str:
+    return "\t" if file.lower().endswith(TSV_EXTENSIONS) else ","
+
+
+def _read_csv_header(file: str) -> tuple[Any, ...]:
+    return tuple(
+        pd.read_csv(
+            file, sep=csv_delimiter(file), encoding="utf-8-sig", dtype=str, nrows=0
+        ).columns
+    )
+
+
+def _arrow_csv_options(
+    file: str, names: list[Any], selected: list[Any]
+) -> dict[str, Any]:
+    from pandas._libs.parsers import STR_NA_VALUES
+    from pyarrow import csv, string  # type: ignore
+
+    # ? The names come from pandas (e.g. with the ".1" suffix of the duplicated ones), so the header row is skipped
+    return {
+        "read_options": csv.ReadOptions(
+            use_threads=True, column_names=names, skip_rows_after_names=1
+        ),
+        # ? Product names and headers may have line breaks inside their quotes
+        "parse_options": csv.ParseOptions(
+            delimiter=csv_delimiter(file), newlines_in_values=True
+        ),
+        "convert_options": csv.ConvertOptions(
+            include_columns=selected,
+            column_types={name: string() for name in selected},
+            null_values=sorted(STR_NA_VALUES),
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=True,
+        ),
+    }
+
+
+def _arrow_to_dataframe(table: Any) -> pd.DataFrame:
+    # ? Arrow gives None for the missing strings, pandas' readers give NaN. Only the null slots of the single object block are replaced
+    dataframe = table.to_pandas()
+    values = dataframe.to_numpy(dtype=object)
+    for position, column in enumerate(table.columns):
+        if column.null_count:
+            values[column.is_null().to_numpy(zero_copy_only=False), position] = NAN
+
+    return pd.DataFrame(values, columns=dataframe.columns)
+
+
+def _csv_columns(
+    file: str, columns: Collection[str] | None
+) -> tuple[list[Any], list[Any], bool]:
+    """Returns the names of the header, the selected names and whether Arrow can read the file."""
+    names = list(_read_csv_header(file))
+    selected = names if columns is None else [name for name in names if name in columns]
+
+    # ? Arrow only takes string column names (e.g. not the numbers of a header)
+    use_arrow = (
+        is_pyarrow_available()
+        and bool(names)
+        and all(isinstance(name, str) for name in names)
+    )
+    return names, selected, use_arrow
+
+
+def _read_csv(file: str, columns: Collection[str] | None) -> pd.DataFrame:
+    """
+    Reads a CSV (or TSV) file as strings like pd.read_csv(file, dtype=str) does, with the
+    multithreaded Arrow CSV reader when pyarrow is installed.
+    """
+    names, selected, use_arrow = _csv_columns(file, columns)
+    if use_arrow:
+        from pyarrow import csv  # type: ignore
+
+        return _arrow_to_dataframe(
+            csv.read_csv(file, **_arrow_csv_options(file, names, selected))
+        )
+
+    return pd.read_csv(
+        file,
+        sep=csv_delimiter(file),
+        encoding="utf-8-sig",
+        dtype=str,
+        usecols=None if columns is None else selected,
+    )
+
+
+def _iter_csv_chunks(
+    file: str, columns: Collection[str], chunk_rows: int
+) -> Iterator[pd.DataFrame]:
+    names, selected, use_arrow = _csv_columns(file, columns)
+    if use_arrow:
+        from pyarrow import csv  # type: ignore
+
+        options = _arrow_csv_options(file, names, selected)
+        options["read_options"].block_size = CHUNK_BLOCK_SIZE
+        for batch in csv.open_csv(file, **options):
+            yield _arrow_to_dataframe(batch)
+        return
+
+    yield from pd.read_csv(
+        file,
+        sep=csv_delimiter(file),
+        encoding="utf-8-sig",
+        dtype=str,
+        usecols=selected,
+        chunksize=chunk_rows,
+    )
+
+
+def _iter_spreadsheet_chunks(
+    file: str, columns: Collection[str], backend: ReaderBackend, chunk_rows: int
+) -> Iterator[pd.DataFrame]:
+    rows = _iter_rows(file, backend)
+    try:
+        names = _parse_header(next(rows, []))
+        positions = [idx for idx, name in enumerate(names) if name in columns]
+        selected = [names[idx] for idx in positions]
+
+        data: list[list[Any]] = []
+        last_row_with_data = -1
+        for row in rows:
+            length = len(row)
+            data.append([row[idx] if idx < length else "" for idx in positions])
+            if length:
+                last_row_with_data = len(data) - 1
+
+            if last_row_with_data + 1 >= chunk_rows:
+                yield _parse_rows(data[: last_row_with_data + 1], selected)
+                # ? Empty rows are only kept once a row with data follows them, like _read_spreadsheet drops the trailing ones
+                data = data[last_row_with_data + 1 :]
+                last_row_with_data = -1
+
+        if last_row_with_data >= 0:
+            yield _parse_rows(data[: last_row_with_data + 1], selected)
+    finally:
+        rows.close()
+
+
+def iter_table_chunks(
+    file: str,
+    *,
+    columns: Collection[str],
+    backend: ReaderBackend = "auto",
+    chunk_rows: int = CHUNK_ROWS,
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads the file like read_table does, but as consecutive DataFrames of about `chunk_rows` rows,
+    so that the whole file is never in memory. Concatenated, the chunks are the read_table DataFrame.
+
+    A file without data rows gives a single empty DataFrame with the selected columns.
+    """
+    backend = resolve_backend(file, backend)
+
+    chunks = (
+        _iter_csv_chunks(file, columns, chunk_rows)
+        if backend == "csv"
+        else _iter_spreadsheet_chunks(file, columns, backend, chunk_rows)
+    )
+    try:
+        first_chunk = next(chunks)
+    except StopIteration:
+        yield read_table(file, columns=columns, backend=backend)
+        return
+
+    yield first_chunk
+    yield from chunks
+
+
+def read_header(
+    file: str, *, backend: ReaderBackend = "auto", sheet: str | None = None
+) -> tuple[Any, ...]:
+    """
+    Reads the column names of the first sheet (or of the sheet named `sheet`, or of a CSV/TSV
+    file) without parsing its rows.
+
+    The names follow the same rules as pd.read_excel (e.g. duplicated names get a ".1" suffix),
+    except that the unnamed columns past the end of the header row are not listed.
+    """
+    backend = _resolve_sheet_backend(file, backend, sheet)
+
+    if backend == "csv":
+        return _read_csv_header(file)
+
+    rows = _iter_rows(file, backend, nrows=1, sheet=sheet)
+    try:
+        return tuple(_parse_header(next(rows, [])))
+    finally:
+        rows.close()
+
+
+def read_sheet_headers(
+    file: str, sheets: Sequence[str], *, backend: ReaderBackend = "auto"
+) -> list[tuple[Any, ...]]:
+    """
+    read_header of several sheets of an Excel file. With openpyxl the workbook is loaded once,
+    since each load scans the sheets that have no <dimension> in full.
+    """
+    backend = _resolve_sheet_backend(file, backend, sheets[0] if sheets else None)
+    if backend != "openpyxl":
+        return [read_header(file, backend=backend, sheet=sheet) for sheet in sheets]
+
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        headers: list[tuple[Any, ...]] = []
+        for sheet in sheets:
+            worksheet: Any = workbook[sheet]
+            worksheet.reset_dimensions()
+            row = next(worksheet.iter_rows(max_row=1, values_only=True), ())
+            headers.append(tuple(_parse_header(_converted_row(row))))
+    finally:
+        workbook.close()
+
+    return headers
+
+
+@lru_cache(maxsize=64)
+def _peek_header(
+    file: str, mtime_ns: int, size: int, backend: ReaderBackend
+) -> tuple[Any, ...]:
+    return read_header(file, backend=backend)
+
+
+def peek_header(file: str, *, backend: ReaderBackend = "auto") -> tuple[Any, ...]:
+    """
+    Same as read_header, but the result is cached by path, modification time and size,
+    so the header of an unchanged file (e.g. the template) is only read once per process.
+    """
+    path = os.path.realpath(file)
+    stat = os.stat(path)
+
+    return _peek_header(path, stat.st_mtime_ns, stat.st_size, backend)
+
+
+def read_sample(
+    file: str,
+    *,
+    columns: Collection[str] | None = None,
+    nrows: int,
+    backend: ReaderBackend = "auto",
+    sheet: str | None = None,
+) -> pd.DataFrame:
+    """
+    Reads the first `nrows` rows of the file like read_table does (without the cache), e.g. to
+    check the values of a file before it is parsed in full.
+    """
+    backend = _resolve_sheet_backend(file, backend, sheet)
+
+    if backend == "csv":
+        return pd.read_csv(
+            file,
+            sep=csv_delimiter(file),
+            encoding="utf-8-sig",
+            dtype=str,
+            usecols=None if columns is None else _csv_columns(file, columns)[1],
+            nrows=nrows,
+        )
+
+    return _read_spreadsheet(file, columns, backend, nrows, sheet)
+
+
+def read_table(
+    file: str,
+    *,
+    columns: Collection[str] | None = None,
+    backend: ReaderBackend = "auto",
+    cache: InputCache | None = None,
+    categories: Collection[str] | None = None,
+    sheet: str | None = None,
+    fingerprint: dict[str, str | int] | None = None,
+) -> pd.DataFrame:
+    """
+    Reads the first sheet of an Excel file (or a CSV file) as strings, the same way as
+    pd.read_excel(file, dtype=str) does.
+
+    Args:
+        file (str): Path to the input file (.xlsx, .csv or .tsv).
+        columns (Collection[str] | None): Names of the columns to load, the other columns are never
+            converted into the DataFrame. Names that are not in the header row are ignored. None loads every column.
+        backend (ReaderBackend): "openpyxl" (read-only streaming), "calamine" (requires python-calamine),
+            "csv" (.csv or .tsv, multithreaded when pyarrow is installed) or "auto" to pick the fastest one available for the file.
+        cache (InputCache | None): When given, the parsed DataFrame is loaded from (or saved to) this on-disk cache.
+        categories (Collection[str] | None): Names of the columns to load as categoricals (dictionary-encoded),
+            which takes a fraction of the memory of the Python strings for columns with repeated values.
+        sheet (str | None): Name of the sheet to read instead of the first one (Excel files only).
+        fingerprint (dict[str, str | int] | None): The file_fingerprint of the file for the cache keys, when
+            already computed (e.g. once for every sheet of the file). Computed once otherwise.
+    Returns:
+        pd.DataFrame: The loaded columns in file order, with NaN for the empty cells.
+    """
+    backend = _resolve_sheet_backend(file, backend, sheet)
+
+    if cache is None:
+        return _read_table(file, columns, backend, categories, sheet)
+
+    # ? The file is hashed once for all the keys looked up
+    if fingerprint is None:
+        fingerprint = file_fingerprint(file)
+    key = cache.key(
+        file,
+        kind="table",
+        backend=backend,
+        columns=columns,
+        categories=categories,
+        sheet=sheet,
+        fingerprint=fingerprint,
+    )
+    dataframe = cache.load(key)
+    if dataframe is None and columns is not None:
+        # ? A whole-file entry (e.g. from read_ahead) also answers a projected read
+        dataframe = cache.load(
+            cache.key(
+                file,
+                kind="table",
+                backend=backend,
+                sheet=sheet,
+                fingerprint=fingerprint,
+            )
+        )
+        if dataframe is not None:
+            dataframe = project_table(dataframe, columns)
+    if dataframe is not None:
+        logger.debug(f"Loaded {os.path.basename(file)} from the parsed input cache")
+        return project_table(dataframe, None, categories)
+
+    dataframe = _read_table(file, columns, backend, categories, sheet)
+    cache.store(key, dataframe)
+
+    return dataframe
+
+
+def project_table(
+    dataframe: pd.DataFrame,
+    columns: Collection[str] | None,
+    categories: Collection[str] | None = None,
+) -> pd.DataFrame:
+    """Keeps the `columns` of an already parsed table like read_table would load them (in file order, encoded `categories`)."""
+    if columns is not None:
+        dataframe = dataframe[[name for name in dataframe.columns if name in columns]]
+    if categories is None:
+        return dataframe
+
+    # ? encode_columns replaces the columns in place, the table of the caller is kept as is
+    return encode_columns(dataframe.copy(deep=False), categories)
+
+
+def read_ahead(
+    file: str,
+    *,
+    backend: ReaderBackend,
+    cache: InputCache | None = None,
+    sheets: Sequence[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Parses every column of the file (or of its `sheets`, ALL_SHEETS for every sheet) before the
+    settings of the merge are known, e.g. while they are picked in the GUI. The result is also
+    stored in the cache when there is one, so that a later read_table of the file skips the parsing.
+    """
+    if sheets is None:
+        return read_table(file, backend=backend, cache=cache)
+
+    names = list_sheets(file) if ALL_SHEETS in sheets else list(dict.fromkeys(sheets))
+    return read_sheets(file, names, backend=backend, cache=cache)
+
+
+def _read_table(
+    file: str,
+    columns: Collection[str] | None,
+    backend: ReaderBackend,
+    categories: Collection[str] | None = None,
+    sheet: str | None = None,
+) -> pd.DataFrame:
+    if backend == "csv":
+        dataframe = _read_csv(file, columns)
+    elif categories and columns is not None:
+        return _read_spreadsheet_encoded(file, columns, categories, backend, sheet)
+    else:
+        dataframe = _read_spreadsheet(file, columns, backend, sheet=sheet)
+
+    return dataframe if categories is None else encode_columns(dataframe, categories)
+
+
+def list_sheets(file: str) -> list[str]:
+    """Names of the sheets of an Excel file in the order of their tabs, read without loading the workbook."""
+    from option_merge_tool.template_writer import worksheet_names
+
+    with zipfile.ZipFile(file) as archive:
+        return worksheet_names(archive)
+
+
+def concat_sheets(frames: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates the DataFrames of several sheets (with the same columns, in the order of the
+    first one) into one table. The categorical columns are merged into categoricals with sorted
+    categories, as if the sheets were a single sheet read with the same `categories`.
+    """
+    columns = frames[0].columns
+    # ? An empty sheet is read with object columns, even for the categorical ones
+    frames = [frame for frame in frames if len(frame)] or [frames[0]]
+    if len(frames) == 1:
+        return frames[0][columns]
+
+    dataframe = pd.DataFrame(
+        {
+            position: union_categoricals(
+                [frame[name] for frame in frames], sort_categories=True
+            )
+            if isinstance(frames[0][name].dtype, pd.CategoricalDtype)
+            else pd.concat([frame[name] for frame in frames], ignore_index=True)
+            for position, name in enumerate(columns)
+        }
+    )
+    dataframe.columns = columns
+
+    return dataframe
+
+
+def read_sheets(
+    file: str,
+    sheets: Sequence[str],
+    *,
+    columns: Collection[str] | None = None,
+    backend: ReaderBackend = "auto",
+    cache: InputCache | None = None,
+    categories: Collection[str] | None = None,
+    workers: int = 1,
+) -> pd.DataFrame:
+    """
+    Reads several sheets of an Excel file with read_table and concatenates them, in the order of
+    `sheets`, into a single table.
+
+    The sheets are parsed in up to `workers` worker processes (one per sheet and CPU) when the
+    file is large enough for the parallel parsing to pay for the startup of the processes.
+
+    Raises:
+        ValueError: If the sheets do not have the same loaded columns.
+    """
+    kwargs = {
+        "columns": columns,
+        "backend": backend,
+        "cache": cache,
+        "categories": categories,
+        # ? The cache keys of every sheet share the hash of the file
+        "fingerprint": None if cache is None else file_fingerprint(file),
+    }
+    # ? The parsing is CPU-bound, more processes than CPUs only add their startup
+    workers = min(workers, len(sheets), os.cpu_count() or 1)
+    if workers <= 1 or os.path.getsize(file) < PARALLEL_MIN_BYTES:
+        frames = [read_table(file, sheet=sheet, **kwargs) for sheet in sheets]
+    else:
+        logger.debug(
+            f"Reading {len(sheets)} sheets of {os.path.basename(file)} in {workers} worker processes"
+        )
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(read_table, file, sheet=sheet, **kwargs)
+                for sheet in sheets
+            ]
+            frames = [future.result() for future in futures]
+
+    expected = set(frames[0].columns)
+    for sheet, frame in zip(sheets[1:], frames[1:]):
+        if set(frame.columns) != expected:
+            missing = [name for name in frames[0].columns if name not in frame.columns]
+            extra = [name for name in frame.columns if name not in expected]
+            raise ValueError(
+                f"The sheet {sheet} of {os.path.basename(file)} does not have the columns of the sheet {sheets[0]}"
+                f" (missing: {missing}, extra: {extra})"
+            )
+
+    return concat_sheets(frames)
+
+
+def projected_columns(*names: str | Iterable[str]) -> list[str]:
+    """Flattens column names and lists of column names into a list without duplicates."""
+    return list(
+        dict.fromkeys(
+            chain.from_iterable(
+                [name] if isinstance(name, str) else name for name in names
+            )
+        )
+    )
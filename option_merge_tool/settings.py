@@ -1,6 +1,24 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
+from typing import TYPE_CHECKING, Literal, get_args
+
+
+if TYPE_CHECKING:
+    from typing import Final
+
+    from option_merge_tool.job import MergeSpec
+
+# ? Kept out of reader.py, so that run.py can validate its arguments without importing pandas
+ReaderBackend = Literal["auto", "openpyxl", "calamine", "csv"]
+
+READER_BACKENDS: Final[tuple[str, ...]] = get_args(ReaderBackend)
+# ? Kept out of output.py for the same reason, "xlsx" fills the template and the other formats only keep its columns
+OutputFormat = Literal["xlsx", "csv", "tsv", "parquet", "arrow"]
+
+OUTPUT_FORMATS: Final[tuple[str, ...]] = get_args(OutputFormat)
+# ? Reads and concatenates every sheet of the input file
+ALL_SHEETS: Final[str] = "*"
 
 
 @dataclass(frozen=True, slots=True, kw_only=True)
@@ -8,6 +26,8 @@ class Settings:
     test_mode: bool
     log_file: str
     input_file: str
+    # ? Sheets of the input file to concatenate, None for the first sheet only
+    sheets: list[str] | None
     template_file: str
     first_column: str
     second_column: str
@@ -15,3 +35,27 @@ class Settings:
     output_column: str
     column_to_dropna: str
     columns_to_drop_dulicates: list[str]
+    reader_backend: ReaderBackend
+    batch: str | None
+    watch: str | None
+    port: int
+    poll_interval: float
+    queue_size: int
+    workers: int
+    cache_dir: str | None
+    cache_max_mb: int
+    template_cache_dir: str | None
+    metrics_dir: str | None
+    profile_dir: str | None
+    lean_memory: bool
+    state_dir: str | None
+    output_file: str | None
+    # ? None picks the format from the extension of output_file (xlsx by default)
+    output_format: OutputFormat | None
+    intermediate_file: str | None
+    # ? Split the output into files of at most shard_rows rows and/or by the values of the shard_by column
+    shard_rows: int | None
+    shard_by: str | None
+    memory_budget_mb: int | None
+    # ? The merges of a --job file after the first one, which fills the fields above
+    extra_merges: tuple[MergeSpec, ...]
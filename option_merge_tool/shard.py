@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import multiprocessing
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+from option_merge_tool.excel import (
+    apply_column_mapping,
+    copy_dataframe_to_excel_template,
+)
+from option_merge_tool.log import logger
+from option_merge_tool.output import write_table
+from option_merge_tool.paths import TEMPORARY_SUFFIX
+
+
+if TYPE_CHECKING:
+    from typing import Any, Final
+
+    from option_merge_tool.excel import ExcelColumn
+    from option_merge_tool.settings import OutputFormat
+
+# ? Rows of an Excel sheet, without the header row of the template
+EXCEL_MAX_ROWS: Final[int] = 1_048_576 - 1
+SHARD_DIGITS: Final[int] = 3
+MANIFEST_SUFFIX: Final[str] = "_MANIFEST.json"
+# ? Below this number of rows, starting the worker processes takes longer than writing the shards one after the other
+PARALLEL_MIN_ROWS: Final[int] = 100_000
+CHECKSUM_CHUNK_SIZE: Final[int] = 1 << 20
+
+
+@dataclass(slots=True, frozen=True)
+class Shard:
+    """
+    One output file of a sharded merge. `first_row` and `last_row` (1-based, inclusive) are its
+    rows in the concatenation of the shards, `keys` the values of the `shard_by` column in it.
+    """
+
+    file: str
+    first_row: int
+    last_row: int
+    rows: int
+    sha256: str
+    keys: list[Any] | None = None
+
+
+def shard_filename(output_filename: str, number: int) -> str:
+    """MERGED_OPTIONS.xlsx -> MERGED_OPTIONS_001.xlsx for the first shard."""
+    stem, extension = os.path.splitext(output_filename)
+    return f"{stem}_{number:0{SHARD_DIGITS}d}{extension or '.xlsx'}"
+
+
+def manifest_filename(output_filename: str) -> str:
+    return f"{os.path.splitext(output_filename)[0]}{MANIFEST_SUFFIX}"
+
+
+def file_checksum(file: str) -> str:
+    checksum = hashlib.sha256()
+    with open(file, "rb") as f:
+        while chunk := f.read(CHECKSUM_CHUNK_SIZE):
+            checksum.update(chunk)
+
+    return checksum.hexdigest()
+
+
+def plan_shards(
+    dataframe: pd.DataFrame, *, shard_rows: int | None, shard_by: str | None
+) -> tuple[pd.DataFrame, list[tuple[int, int]], list[list[Any]] | None]:
+    """
+    Splits the rows into shards of at most `shard_rows` rows and returns the DataFrame in the
+    order of the shards, their (start, stop) row positions and their keys.
+
+    With `shard_by`, the rows are grouped by the value of that column (in the order in which the
+    values first appear, the rows of a value keep their order) and a value is never split across
+    two shards, unless it has more than `shard_rows` rows. Without `shard_rows`, every value gets
+    its own shard.
+    """
+    n_rows = len(dataframe)
+    if shard_by is None:
+        size = max(shard_rows or n_rows, 1)
+        return (
+            dataframe,
+            [(start, min(start + size, n_rows)) for start in range(0, n_rows, size)]
+            or [(0, 0)],
+            None,
+        )
+
+    codes, uniques = pd.factorize(dataframe[shard_by], use_na_sentinel=False)
+    dataframe = dataframe.iloc[np.argsort(codes, kind="stable")]
+    counts = np.bincount(codes, minlength=len(uniques))
+
+    bounds: list[tuple[int, int]] = []
+    keys: list[list[Any]] = []
+    start = size = 0
+    shard_keys: list[Any] = []
+    for key, count in zip(uniques, counts.tolist()):
+        if shard_keys and (shard_rows is None or size + count > shard_rows):
+            bounds.append((start, start + size))
+            keys.append(shard_keys)
+            start, size, shard_keys = start + size, 0, []
+
+        shard_keys.append(None if pd.isna(key) else key)
+        size += count
+        if shard_rows is not None and size > shard_rows:
+            logger.warning(
+                "{} = {} has {} rows, more than a shard, it is split across several files",
+                shard_by,
+                key,
+                count,
+            )
+            while size > shard_rows:
+                bounds.append((start, start + shard_rows))
+                keys.append(shard_keys)
+                start, size = start + shard_rows, size - shard_rows
+                shard_keys = [shard_keys[-1]]
+
+    if shard_keys or not bounds:
+        bounds.append((start, start + size))
+        keys.append(shard_keys)
+
+    return dataframe, bounds, keys
+
+
+def _write_shard(
+    dataframe: pd.DataFrame,
+    filename: str,
+    output_format: OutputFormat,
+    template_filename: str,
+    column_mapping: dict[int, ExcelColumn],
+    column_to_dropna: str,
+) -> str:
+    """Writes one shard like merge() writes its output, and returns its checksum."""
+    if output_format == "xlsx":
+        copy_dataframe_to_excel_template(
+            dataframe=dataframe,
+            filename=filename,
+            template_filename=template_filename,
+            column_mapping=column_mapping,
+            column_to_dropna=column_to_dropna,
+        )
+    else:
+        write_table(
+            apply_column_mapping(dataframe, column_mapping, column_to_dropna),
+            filename,
+            output_format,
+        )
+
+    return file_checksum(filename)
+
+
+def write_shards(
+    dataframe: pd.DataFrame,
+    output_filename: str,
+    *,
+    output_format: OutputFormat,
+    template_filename: str,
+    column_mapping: dict[int, ExcelColumn],
+    column_to_dropna: str,
+    shard_rows: int | None = None,
+    shard_by: str | None = None,
+    workers: int = 1,
+) -> tuple[str, list[Shard]]:
+    """
+    Writes the merged DataFrame as several output files (MERGED_OPTIONS_001.xlsx, ...), each one
+    filled into the template, and a MERGED_OPTIONS_MANIFEST.json file listing them.
+
+    The shards of an xlsx output never have more rows than an Excel sheet. They are written in
+    up to `workers` worker processes (one per shard and CPU) for large outputs.
+
+    Returns:
+        tuple[str, list[Shard]]: The path of the manifest file and the shards.
+    """
+    if output_format == "xlsx":
+        shard_rows = min(shard_rows or EXCEL_MAX_ROWS, EXCEL_MAX_ROWS)
+    dataframe, bounds, keys = plan_shards(
+        dataframe, shard_rows=shard_rows, shard_by=shard_by
+    )
+    filenames = [
+        shard_filename(output_filename, number) for number in range(1, len(bounds) + 1)
+    ]
+    arguments = (output_format, template_filename, column_mapping, column_to_dropna)
+
+    workers = min(workers, len(bounds), os.cpu_count() or 1)
+    if workers <= 1 or len(dataframe) < PARALLEL_MIN_ROWS:
+        checksums = [
+            _write_shard(dataframe.iloc[start:stop], filename, *arguments)
+            for (start, stop), filename in zip(bounds, filenames)
+        ]
+    else:
+        logger.debug(f"Writing {len(bounds)} shards in {workers} worker processes")
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            futures = [
+                executor.submit(
+                    _write_shard, dataframe.iloc[start:stop], filename, *arguments
+                )
+                for (start, stop), filename in zip(bounds, filenames)
+            ]
+            checksums = [future.result() for future in futures]
+
+    shards = [
+        Shard(
+            file=Path(filename).name,
+            first_row=start + 1,
+            last_row=stop,
+            rows=stop - start,
+            sha256=checksum,
+            keys=None if keys is None else keys[position],
+        )
+        for position, ((start, stop), filename, checksum) in enumerate(
+            zip(bounds, filenames, checksums)
+        )
+    ]
+
+    manifest_file = manifest_filename(output_filename)
+    manifest = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "output_format": output_format,
+        "template_file": os.path.abspath(template_filename),
+        "rows": len(dataframe),
+        "shard_rows": shard_rows,
+        "shard_by": shard_by,
+        "shards": [asdict(shard) for shard in shards],
+    }
+    temporary_file = f"{manifest_file}{TEMPORARY_SUFFIX}"
+    with open(temporary_file, "w", encoding="utf-8") as f:
+        # ? The keys are the cell values, e.g. numbers or dates for a column that is not text
+        json.dump(manifest, f, ensure_ascii=False, indent=2, default=str)
+    os.replace(temporary_file, manifest_file)
+
+    return manifest_file, shards
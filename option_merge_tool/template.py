@@ -0,0 +1,203 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import zipfile
+
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import TYPE_CHECKING
+
+from option_merge_tool.cache import file_fingerprint
+from option_merge_tool.log import logger
+from option_merge_tool.reader import read_header
+
+
+if TYPE_CHECKING:
+    from typing import Any, Final
+
+TEMPLATE_VERSION: Final[int] = 3
+TEMPLATE_EXTENSION: Final[str] = ".json"
+# ? Compiled templates kept in memory by each process, e.g. the workers of --watch
+MEMORY_ENTRIES: Final[int] = 16
+
+
+@dataclass(slots=True, frozen=True)
+class SheetParts:
+    """The active sheet of a template, split around the place where the data rows are streamed."""
+
+    path: str
+    name: str | None
+    head: str
+    prefix: str
+    tail: str
+
+
+@dataclass(slots=True, frozen=True)
+class TemplateColumn:
+    name: Any
+    alphabet: str
+    width: float | None = None
+    style: int | None = None
+
+
+@dataclass(slots=True, frozen=True)
+class CompiledTemplate:
+    """
+    Everything the merge needs from a template file, extracted once.
+
+    `header` has the column names with the same rules as read_header, `columns` their letters
+    and the width and style of their <col> element. `sheet` is the active sheet split for
+    stream_to_template, or None when the template cannot be streamed (`unsupported` says why)
+    and copy_to_openpyxl_template has to load it.
+    """
+
+    header: tuple[Any, ...]
+    columns: tuple[TemplateColumn, ...]
+    sheet: SheetParts | None
+    unsupported: str | None = None
+
+    @property
+    def sheet_name(self) -> str | None:
+        return self.sheet.name if self.sheet is not None else None
+
+
+_memory: OrderedDict[tuple[str, int, int], CompiledTemplate] = OrderedDict()
+
+
+def compile_template(file: str) -> CompiledTemplate:
+    """Parses the template file into a CompiledTemplate."""
+    # ? openpyxl is only imported when a template has to be compiled, not when it is loaded from the cache
+    from openpyxl.utils import get_column_letter
+
+    from option_merge_tool.template_writer import (
+        UnsupportedTemplateError,
+        read_column_formats,
+        read_sheet_parts,
+    )
+
+    header = read_header(file)
+    formats: dict[int, tuple[float | None, int | None]] = {}
+    sheet: SheetParts | None = None
+    unsupported: str | None = None
+
+    try:
+        with zipfile.ZipFile(file) as archive:
+            try:
+                sheet = read_sheet_parts(archive)
+            except UnsupportedTemplateError as err:
+                unsupported = str(err)
+            else:
+                formats = read_column_formats(archive, sheet.path)
+    except zipfile.BadZipFile:  # ? e.g. a CSV template
+        unsupported = "The template is not an xlsx file"
+
+    columns = tuple(
+        TemplateColumn(
+            name, get_column_letter(index), *formats.get(index, (None, None))
+        )
+        for index, name in enumerate(header, start=1)
+    )
+    return CompiledTemplate(
+        header=header,
+        columns=columns,
+        sheet=sheet,
+        unsupported=unsupported,
+    )
+
+
+def _cache_path(cache_dir: str, file: str) -> str:
+    description = json.dumps(
+        {"version": TEMPLATE_VERSION, "file": file_fingerprint(file)},
+        ensure_ascii=False,
+    )
+    name = hashlib.blake2b(description.encode("utf-8"), digest_size=16).hexdigest()
+
+    return os.path.join(cache_dir, f"{name}{TEMPLATE_EXTENSION}")
+
+
+def _load_compiled(path: str) -> CompiledTemplate | None:
+    if not os.path.exists(path):
+        return None
+
+    # ? The cache is plain JSON, a file planted in it can at worst give a wrong template, never run code
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != TEMPLATE_VERSION:
+            return None
+
+        compiled = state["template"]
+        return CompiledTemplate(
+            header=tuple(compiled["header"]),
+            columns=tuple(TemplateColumn(**column) for column in compiled["columns"]),
+            sheet=(
+                SheetParts(**compiled["sheet"])
+                if compiled["sheet"] is not None
+                else None
+            ),
+            unsupported=compiled["unsupported"],
+        )
+    except Exception as err:
+        logger.debug("Ignoring the unreadable compiled template {}: {!r}", path, err)
+        return None
+
+
+def _save_compiled(path: str, template: CompiledTemplate) -> None:
+    # ? JSON only keeps the names of a header as they are when they are text or numbers (e.g. not dates)
+    if not all(
+        name is None or isinstance(name, (str, int, float)) for name in template.header
+    ):
+        return
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temporary_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"version": TEMPLATE_VERSION, "template": asdict(template)},
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(temporary_path, path)
+    except Exception as err:
+        logger.debug("Could not write the compiled template {}: {!r}", path, err)
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def load_template(file: str, *, cache_dir: str | None = None) -> CompiledTemplate:
+    """
+    Returns the compiled template of the file.
+
+    It is kept in memory by path, modification time and size, and when `cache_dir` is given it
+    is also stored there keyed by the fingerprint of the file, so a later run (or another
+    process) skips the parsing of an unchanged template.
+    """
+    path = os.path.realpath(file)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+
+    template = _memory.get(key)
+    if template is not None:
+        _memory.move_to_end(key)
+        return template
+
+    cache_path = _cache_path(cache_dir, path) if cache_dir is not None else None
+    if cache_path is not None:
+        template = _load_compiled(cache_path)
+        if template is not None:
+            logger.debug(f"Loaded {os.path.basename(file)} from the template cache")
+
+    if template is None:
+        template = compile_template(path)
+        if cache_path is not None:
+            _save_compiled(cache_path, template)
+
+    _memory[key] = template
+    if len(_memory) > MEMORY_ENTRIES:
+        _memory.popitem(last=False)
+
+    return template
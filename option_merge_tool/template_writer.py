@@ -0,0 +1,315 @@
+from __future__ import annotations
+
+import os
+import posixpath
+import re
+import zipfile
+
+from numbers import Number
+from typing import TYPE_CHECKING
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+from openpyxl.cell.cell import ERROR_CODES, ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.cell import range_boundaries
+from openpyxl.utils.exceptions import IllegalCharacterError
+
+from option_merge_tool.paths import TEMPORARY_SUFFIX
+from option_merge_tool.template import SheetParts
+
+
+if TYPE_CHECKING:
+    from collections.abc import Iterable, Sequence
+    from typing import IO, Any, Final
+
+    import pandas as pd
+
+MAIN_NS: Final[str] = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS: Final[
+    str
+] = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_REL_NS: Final[
+    str
+] = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+ROWS_PER_CHUNK: Final[int] = 10_000
+
+SHEET_DATA_RE: Final[re.Pattern[str]] = re.compile(
+    r"<(?P<prefix>\w+:)?sheetData(?:\s[^>]*)?(?:/>|>(?P<rows>.*?)</(?P=prefix)?sheetData>)",
+    re.DOTALL,
+)
+DIMENSION_RE: Final[re.Pattern[str]] = re.compile(
+    r'(<(?:\w+:)?dimension\s+ref=")(?P<ref>[^"]*)(")'
+)
+
+
+class UnsupportedTemplateError(ValueError):
+    """The template sheet cannot be streamed (e.g. it already has rows below the header)."""
+
+
+def worksheet_names(archive: zipfile.ZipFile) -> list[str]:
+    """Returns the names of the worksheets in the archive, in the order of their tabs."""
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+
+    return [
+        sheet.get("name", "")
+        for sheet in workbook.iterfind(f"{{{MAIN_NS}}}sheets/{{{MAIN_NS}}}sheet")
+    ]
+
+
+def worksheet_location(
+    archive: zipfile.ZipFile, index: int | None = None
+) -> tuple[str, str | None]:
+    """
+    Returns the path and name of the worksheet at `index` in the archive, or of the active one
+    (the sheet openpyxl's `wb.active` gives) when `index` is None.
+    """
+    workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+
+    if index is None:
+        view = workbook.find(f"{{{MAIN_NS}}}bookViews/{{{MAIN_NS}}}workbookView")
+        index = int(view.get("activeTab", "0")) if view is not None else 0
+
+    sheets = workbook.findall(f"{{{MAIN_NS}}}sheets/{{{MAIN_NS}}}sheet")
+    if not sheets:
+        raise UnsupportedTemplateError("The workbook has no sheet")
+    sheet = sheets[min(index, len(sheets) - 1)]
+    rel_id = sheet.get(f"{{{REL_NS}}}id")
+
+    relationships = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+    for relationship in relationships.iter(f"{{{PACKAGE_REL_NS}}}Relationship"):
+        if relationship.get("Id") == rel_id:
+            target = relationship.get("Target", "")
+            if target.startswith("/"):
+                return target.lstrip("/"), sheet.get("name")
+            return posixpath.normpath(posixpath.join("xl", target)), sheet.get("name")
+
+    raise UnsupportedTemplateError(f"The relationship {rel_id} of the sheet is missing")
+
+
+def _split_sheet(sheet_xml: str) -> tuple[str, str, str]:
+    """
+    Splits the sheet XML into the part before the data rows (ending with the header row),
+    the element prefix (e.g. "x:") and the part after the data rows.
+    """
+    match = SHEET_DATA_RE.search(sheet_xml)
+    if match is None:
+        raise UnsupportedTemplateError("The template sheet has no sheetData")
+
+    prefix = match.group("prefix") or ""
+    header = match.group("rows") or ""
+
+    row_numbers = re.findall(
+        rf"<{prefix}row\b(?:[^>]*?\sr=\"(\d+)\")?", header, flags=re.DOTALL
+    )
+    if len(row_numbers) > 1 or any(number not in ("", "1") for number in row_numbers):
+        raise UnsupportedTemplateError(
+            "The template sheet has rows below the header row"
+        )
+
+    return (
+        f"{sheet_xml[: match.start()]}<{prefix}sheetData>{header}",
+        prefix,
+        f"</{prefix}sheetData>{sheet_xml[match.end():]}",
+    )
+
+
+def read_sheet_parts(archive: zipfile.ZipFile) -> SheetParts:
+    """
+    Reads and splits the active sheet of the template archive.
+
+    Raises:
+        UnsupportedTemplateError: If the sheet cannot be streamed (e.g. it has rows below the header row).
+    """
+    path, name = worksheet_location(archive)
+    head, prefix, tail = _split_sheet(archive.read(path).decode("utf-8"))
+
+    return SheetParts(path=path, name=name, head=head, prefix=prefix, tail=tail)
+
+
+def read_column_formats(
+    archive: zipfile.ZipFile, sheet_path: str
+) -> dict[int, tuple[float | None, int | None]]:
+    """Width and style of every column with a <col> element, by column index (1 for A)."""
+    sheet = ElementTree.fromstring(archive.read(sheet_path))
+
+    formats: dict[int, tuple[float | None, int | None]] = {}
+    for col in sheet.iterfind(f"{{{MAIN_NS}}}cols/{{{MAIN_NS}}}col"):
+        width = col.get("width")
+        style = col.get("style")
+        for index in range(int(col.get("min", "1")), int(col.get("max", "1")) + 1):
+            formats[index] = (
+                float(width) if width is not None else None,
+                int(style) if style is not None else None,
+            )
+
+    return formats
+
+
+def _update_dimension(head: str, last_column: int, last_row: int) -> str:
+    match = DIMENSION_RE.search(head)
+    if match is None:
+        return head
+
+    try:
+        min_col, min_row, max_col, _ = range_boundaries(match.group("ref"))
+    except ValueError:
+        return head
+
+    ref = "{}{}:{}{}".format(
+        get_column_letter(min_col or 1),
+        min_row or 1,
+        get_column_letter(max(max_col or 1, last_column)),
+        max(last_row, 1),
+    )
+    return f"{head[: match.start('ref')]}{ref}{head[match.end('ref'):]}"
+
+
+def _cell_body(value: Any, prefix: str) -> str:
+    """
+    Serializes a single cell the same way openpyxl does for the value type, without its opening
+    `<c r="..."` part. Empty values give an empty string and are not written at all.
+    """
+    if value is None or value == "":
+        return ""
+
+    if isinstance(value, bool):
+        return f' t="b"><{prefix}v>{int(value)}</{prefix}v></{prefix}c>'
+
+    if isinstance(value, Number):
+        if value != value:  # ? NaN
+            return ""
+        return f' t="n"><{prefix}v>{value}</{prefix}v></{prefix}c>'
+
+    value = str(value)
+    if ILLEGAL_CHARACTERS_RE.search(value):
+        raise IllegalCharacterError(f"{value} cannot be used in worksheets.")
+
+    text = escape(value)
+    if len(value) > 1 and value.startswith("="):
+        return f"><{prefix}f>{text[1:]}</{prefix}f><{prefix}v></{prefix}v></{prefix}c>"
+
+    if value in ERROR_CODES:
+        return f' t="e"><{prefix}v>{text}</{prefix}v></{prefix}c>'
+
+    stripped = value.strip()
+    space = ' xml:space="preserve"' if stripped and stripped != value else ""
+    return f' t="inlineStr"><{prefix}is><{prefix}t{space}>{text}</{prefix}t></{prefix}is></{prefix}c>'
+
+
+def _cell_bodies(values: Iterable[Any], prefix: str) -> list[str]:
+    # ? Product DBs repeat the same values a lot, so every distinct value is serialized once
+    cache: dict[Any, str] = {}
+    bodies: list[str] = []
+    for value in values:
+        try:
+            body = cache[value]
+        except KeyError:
+            body = cache[value] = _cell_body(value, prefix)
+        except TypeError:  # ? Unhashable value
+            body = _cell_body(value, prefix)
+        bodies.append(body)
+
+    return bodies
+
+
+def _write_rows(
+    stream: IO[bytes],
+    dataframe: pd.DataFrame,
+    columns: Sequence[tuple[str, str]],
+    prefix: str,
+) -> None:
+    """
+    Writes the rows of the DataFrame ROWS_PER_CHUNK at a time, the cells of a chunk are
+    serialized just before it is written so only one chunk of them is ever in memory.
+    """
+    series = [(alphabet, dataframe[name]) for name, alphabet in columns]
+    for start in range(0, len(dataframe), ROWS_PER_CHUNK):
+        column_bodies = [
+            (
+                alphabet,
+                _cell_bodies(
+                    values.iloc[start : start + ROWS_PER_CHUNK].to_list(), prefix
+                ),
+            )
+            for alphabet, values in series
+        ]
+        chunk: list[str] = []
+        for offset in range(min(ROWS_PER_CHUNK, len(dataframe) - start)):
+            row_idx = start + offset + 2  # ? Row 1 is the header of the template
+            cells = "".join(
+                f'<{prefix}c r="{alphabet}{row_idx}"{bodies[offset]}'
+                for alphabet, bodies in column_bodies
+                if bodies[offset]
+            )
+            chunk.append(f'<{prefix}row r="{row_idx}">{cells}</{prefix}row>')
+
+        stream.write("".join(chunk).encode("utf-8"))
+
+
+def stream_to_template(
+    *,
+    dataframe: pd.DataFrame,
+    filename: str,
+    template_filename: str,
+    columns: Iterable[tuple[str, str]],
+    sheet: SheetParts | None = None,
+) -> None:
+    """
+    Writes the DataFrame below the header row of the template by generating the sheet XML directly.
+
+    Every other part of the template (styles, column widths, other sheets, ...) is copied
+    byte for byte, the data rows are written in chunks so that memory does not grow with the
+    number of cells.
+
+    Args:
+        dataframe (pd.DataFrame): The DataFrame containing the data to be copied into the Excel template.
+        filename (str): The output filename, it will be saved with a '.xlsx' extension.
+        template_filename (str): The path to the Excel template file to be used as a base for the output.
+        columns (Iterable[tuple[str, str]]): Pairs of (DataFrame column name, Excel column alphabet).
+        sheet (SheetParts | None): The split active sheet of the template (e.g. from its compiled
+            template), read from the template when None.
+    Raises:
+        UnsupportedTemplateError: If the template cannot be streamed, e.g. when its active sheet
+            already has rows below the header row. copy_to_openpyxl_template handles those templates.
+        IllegalCharacterError: If a value contains characters that cannot be used in worksheets.
+    """
+    # ? Cells of a row must be in column order
+    sorted_columns = sorted(
+        ((name, alphabet) for name, alphabet in columns),
+        key=lambda column: column_index_from_string(column[1]),
+    )
+    last_column = max(
+        (column_index_from_string(alphabet) for _, alphabet in sorted_columns),
+        default=1,
+    )
+
+    output_filename = filename.replace(".csv", ".xlsx")
+    temporary_filename = f"{output_filename}{TEMPORARY_SUFFIX}"
+
+    with zipfile.ZipFile(template_filename) as template:
+        if sheet is None:
+            sheet = read_sheet_parts(template)
+        sheet_path, prefix, tail = sheet.path, sheet.prefix, sheet.tail
+        head = _update_dimension(sheet.head, last_column, len(dataframe) + 1)
+
+        try:
+            with zipfile.ZipFile(
+                temporary_filename, "w", compression=zipfile.ZIP_DEFLATED
+            ) as output:
+                for info in template.infolist():
+                    if info.filename != sheet_path:
+                        output.writestr(info, template.read(info.filename))
+                        continue
+
+                    with output.open(sheet_path, "w", force_zip64=True) as stream:
+                        stream.write(head.encode("utf-8"))
+                        _write_rows(stream, dataframe, sorted_columns, prefix)
+                        stream.write(tail.encode("utf-8"))
+        except BaseException:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+            raise
+
+    os.replace(temporary_filename, output_filename)
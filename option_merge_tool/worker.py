@@ -0,0 +1,277 @@
+from __future__ import annotations
+
+import glob
+import multiprocessing
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+import traceback
+
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from option_merge_tool.log import logger, setup_logger
+from option_merge_tool.merge import merge
+from option_merge_tool.metrics import profiled
+from option_merge_tool.out_of_core import SPILL_PREFIX
+from option_merge_tool.paths import TEMPORARY_SUFFIX
+from option_merge_tool.preflight import PreflightError
+from option_merge_tool.progress import Progress
+from option_merge_tool.reader import read_ahead
+from option_merge_tool.shard import SHARD_DIGITS
+
+
+if TYPE_CHECKING:
+    from collections.abc import Sequence
+    from multiprocessing.context import SpawnProcess
+    from multiprocessing.queues import Queue
+    from multiprocessing.synchronize import Event
+    from typing import Any, Final
+
+    import pandas as pd
+
+    from option_merge_tool.cache import InputCache
+    from option_merge_tool.merge import MergeResult
+    from option_merge_tool.settings import ReaderBackend
+
+JOIN_TIMEOUT: Final[float] = 5.0
+# ? Exit code of a merge process stopped by MergeWorker.cancel
+CANCELLED_EXIT_CODE: Final[int] = 2
+
+
+@dataclass(slots=True, frozen=True)
+class WorkerFinished:
+    result: MergeResult
+
+
+@dataclass(slots=True, frozen=True)
+class WorkerFailed:
+    error: str
+
+
+WorkerEvent = Progress | WorkerFinished | WorkerFailed
+
+
+def _stop_when_cancelled(cancelled: Event) -> None:
+    """
+    Runs in a thread of the merge process. Once the merge is cancelled, its own worker processes
+    (e.g. the sheet readers or the shard writers) are stopped before the merge process exits, so
+    that none of them is left writing behind it.
+    """
+    cancelled.wait()
+    children = multiprocessing.active_children()
+    for child in children:
+        child.terminate()
+    for child in children:
+        child.join(JOIN_TIMEOUT)
+    os._exit(CANCELLED_EXIT_CODE)
+
+
+def _run_merge(
+    events: Queue[WorkerEvent],
+    jobs: Queue[tuple[tuple[Any, ...], dict[str, Any]]],
+    cancelled: Event,
+    test_mode: bool,
+    log_file: str,
+    profile_dir: str | None,
+    input_file: str,
+    read_ahead_kwargs: dict[str, Any],
+    spill_dir: str,
+) -> None:
+    setup_logger(test_mode=test_mode, log_file=log_file)
+    threading.Thread(
+        target=_stop_when_cancelled, args=(cancelled,), daemon=True
+    ).start()
+
+    # ? The input is parsed while the settings are picked, the table never leaves this process
+    parsed: pd.DataFrame | None = None
+    try:
+        parsed = read_ahead(input_file, **read_ahead_kwargs)
+    except Exception as err:
+        # ? Not fatal, the merge parses the file itself
+        logger.warning("Could not parse the input file ahead: {!r}", err)
+
+    args, kwargs = jobs.get()
+    if args[0] != input_file:
+        parsed = None
+
+    profile = profiled(profile_dir, "gui") if profile_dir is not None else nullcontext()
+    try:
+        with profile:
+            result = merge(
+                *args,
+                progress=events.put,
+                parsed=parsed,
+                spill_dir=spill_dir,
+                **kwargs,
+            )
+    except PreflightError as err:
+        # ? The settings do not match the files, the problems are enough without a traceback
+        logger.error("The settings do not match the files:\n{}", err)
+        events.put(WorkerFailed(error=str(err)))
+    except Exception as err:
+        # ? The error text is passed as an argument so that loguru does not parse it as color markup
+        logger.error("Failed to merge: {!r}\n{}", err, traceback.format_exc())
+        events.put(WorkerFailed(error=repr(err)))
+    else:
+        events.put(WorkerFinished(result=result))
+
+
+@dataclass(slots=True, kw_only=True)
+class MergeWorker:
+    """
+    Runs `merge` in a separate process so that the GUI keeps rendering while it works.
+
+    A process (not a thread) is used because pandas holds the GIL for most of the merge and
+    because only a process can be stopped in the middle of a stage. The worker sends its
+    progress through a queue which the GUI reads with `poll` on every frame.
+
+    The process is started as soon as the input file is picked: it parses every column of the
+    file (of its `sheets`) while the settings are picked, then waits for the merge sent by
+    `submit`, which reuses that table. Only the settings and the progress go between the
+    processes, the GUI never holds the parsed input.
+
+    The spill files of an out-of-core merge are written in a directory of the worker, which is
+    removed when the merge finishes or is cancelled.
+    """
+
+    input_file: str
+    reader_backend: ReaderBackend
+    cache: InputCache | None
+    sheets: Sequence[str] | None
+    test_mode: bool
+    log_file: str
+    profile_dir: str | None = None
+
+    output_filename: str | None = field(default=None, init=False)
+    _events: Queue[WorkerEvent] | None = field(default=None, init=False)
+    _jobs: Queue[tuple[tuple[Any, ...], dict[str, Any]]] | None = field(
+        default=None, init=False
+    )
+    _process: SpawnProcess | None = field(default=None, init=False)
+    _cancelled: Event | None = field(default=None, init=False)
+    _spill_dir: str | None = field(default=None, init=False)
+    _started_at: float = field(default=0.0, init=False)
+    _finished_at: float | None = field(default=None, init=False)
+
+    def start(self) -> None:
+        """Starts the process, which parses the input file ahead of the merge."""
+        # ? spawn gives the same worker startup (and logger setup) on Windows and Linux
+        context = multiprocessing.get_context("spawn")
+        self._events = context.Queue()
+        self._jobs = context.Queue()
+        self._cancelled = context.Event()
+        self._spill_dir = tempfile.mkdtemp(prefix=SPILL_PREFIX)
+        self._process = context.Process(
+            target=_run_merge,
+            args=(
+                self._events,
+                self._jobs,
+                self._cancelled,
+                self.test_mode,
+                self.log_file,
+                self.profile_dir,
+                self.input_file,
+                {
+                    "backend": self.reader_backend,
+                    "cache": self.cache,
+                    "sheets": self.sheets,
+                },
+                self._spill_dir,
+            ),
+            daemon=True,
+        )
+        self._finished_at = None
+        self._process.start()
+
+    def submit(
+        self, args: tuple[Any, ...], kwargs: dict[str, Any], output_filename: str
+    ) -> None:
+        """Sends the merge to the process, which runs it once the input file is parsed."""
+        if self._jobs is None or self.is_submitted:
+            raise RuntimeError("The worker is not started or already has a merge")
+
+        self.output_filename = output_filename
+        self._started_at = time.perf_counter()
+        self._jobs.put((args, {**kwargs, "output_filename": output_filename}))
+
+    @property
+    def is_submitted(self) -> bool:
+        return self.output_filename is not None
+
+    @property
+    def is_running(self) -> bool:
+        return self.is_submitted and self._finished_at is None
+
+    @property
+    def elapsed(self) -> float:
+        end = self._finished_at or time.perf_counter()
+        return end - self._started_at if self.is_submitted else 0.0
+
+    def poll(self) -> list[WorkerEvent]:
+        """Returns the events sent by the worker since the last call, without blocking."""
+        if self._events is None or self._process is None or not self.is_submitted:
+            return []
+
+        events: list[WorkerEvent] = []
+        while True:
+            try:
+                events.append(self._events.get_nowait())
+            except queue.Empty:
+                break
+
+        if any(isinstance(event, (WorkerFinished, WorkerFailed)) for event in events):
+            self._stop()
+        elif self.is_running and not self._process.is_alive():
+            # ? The process died without reporting (e.g. killed or out of memory)
+            events.append(
+                WorkerFailed(
+                    error=f"The merge process exited with code {self._process.exitcode}"
+                )
+            )
+            self._stop()
+
+        return events
+
+    def cancel(self) -> None:
+        """
+        Stops the process (parsing ahead or merging) and its worker processes, the partially
+        written output files and the spill files are removed.
+        """
+        if (
+            self._process is None
+            or self._cancelled is None
+            or self._finished_at is not None
+        ):
+            return
+
+        self._cancelled.set()
+        self._process.join(JOIN_TIMEOUT)
+        if self._process.is_alive():  # ? e.g. the merge process does not respond
+            self._process.terminate()
+        self._stop()
+
+        if self.output_filename is None:
+            return
+        # ? The template writers only replace the output file (and the shards) once it is complete
+        stem, extension = os.path.splitext(self.output_filename)
+        for temporary_filename in [
+            f"{self.output_filename}{TEMPORARY_SUFFIX}",
+            *glob.glob(
+                f"{glob.escape(stem)}_{'[0-9]' * SHARD_DIGITS}{extension}{TEMPORARY_SUFFIX}"
+            ),
+        ]:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+
+    def _stop(self) -> None:
+        self._finished_at = time.perf_counter()
+        if self._process is not None:
+            self._process.join(JOIN_TIMEOUT)
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
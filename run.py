@@ -4,10 +4,21 @@ import asyncio
 import os
 
 from argparse import ArgumentParser
+from contextlib import nullcontext
+from dataclasses import replace
+from importlib.util import find_spec
+from typing import TYPE_CHECKING
 
 from option_merge_tool.log import logger
-from option_merge_tool.merge import TODAY_DATE
-from option_merge_tool.settings import Settings
+from option_merge_tool.paths import TODAY_DATE
+from option_merge_tool.settings import OUTPUT_FORMATS, READER_BACKENDS, Settings
+
+
+if TYPE_CHECKING:
+    from option_merge_tool.job import MergeSpec
+
+# ? Nothing above imports pandas, numpy or openpyxl, so --help and the argument errors return right away.
+# ? Each mode imports its backends once the arguments are validated (see benchmarks/startup.py)
 
 
 if __name__ == "__main__":
@@ -29,63 +40,286 @@ if __name__ == "__main__":
         type=str,
         default=os.path.join("logs", f"{TODAY_DATE}.log"),
     )
-    parser.add_argument(
+    input_group = parser.add_mutually_exclusive_group()
+    input_group.add_argument(
         "--input_file",
         help="Input file",
         type=str,
-        required=True,
+    )
+    input_group.add_argument(
+        "--batch",
+        help='Directory or glob pattern (e.g. "input/*.xlsx") of input files to merge in parallel, each into its own output file',
+        type=str,
+    )
+    input_group.add_argument(
+        "--watch",
+        help="Directory to watch: every input file dropped into it is merged into its own output file, until the program is stopped",
+        type=str,
+    )
+    parser.add_argument(
+        "--sheets",
+        help='Sheets of the input file to merge as a single table, separated by , ("*" for every sheet), only the first sheet by default',
+        type=str,
+    )
+    parser.add_argument(
+        "--output_file",
+        help="Output file, its extension picks the format: .xlsx fills the template, .csv/.tsv/.parquet/.arrow only keep the template's columns",
+        type=str,
+    )
+    parser.add_argument(
+        "--output_format",
+        help="Format of the output files, which replaces the extension of --output_file: xlsx fills the template, csv/tsv/parquet/arrow skip it and only keep the template's columns (the extension of --output_file by default)",
+        type=str,
+        choices=OUTPUT_FORMATS,
+    )
+    parser.add_argument(
+        "--shard_rows",
+        help="Split the output into files of at most this many rows (MERGED_OPTIONS_001.xlsx, ...) listed in a *_MANIFEST.json file, an .xlsx output is always split at the Excel row limit",
+        type=int,
+    )
+    parser.add_argument(
+        "--shard_by",
+        help="Split the output into one file per value of this column, or into files of whole values with --shard_rows",
+        type=str,
+    )
+    parser.add_argument(
+        "--intermediate_file",
+        help="Also save the merged options (every column, before the template) to this .xlsx/.csv/.tsv/.parquet/.arrow file",
+        type=str,
+    )
+    parser.add_argument(
+        "--job",
+        help="JSON or TOML job file with several merges (and optionally the input, template and output files or the dropna/duplicates columns) run on a single read of the input",
+        type=str,
     )
     parser.add_argument(
         "--template_file",
         help="Excel template file",
         type=str,
-        required=True,
     )
     parser.add_argument(
         "--first_column",
         help="First Column",
         type=str,
-        required=True,
     )
     parser.add_argument(
         "--second_column",
         help="Second Column",
         type=str,
-        required=True,
     )
     parser.add_argument(
         "--join_by",
         help="Join by rule",
         type=str,
-        required=True,
     )
     parser.add_argument(
         "--output_column",
         help="Column for saving merged options",
         type=str,
-        required=True,
     )
     parser.add_argument(
         "--column_to_dropna",
         help="Column to drop NaN values",
         type=str,
-        required=True,
     )
     parser.add_argument(
         "--columns_to_drop_dulicates",
         help="List of column names (separated by ,) to drop duplicates",
         type=str,
-        required=True,
+    )
+    parser.add_argument(
+        "--reader_backend",
+        help="Backend used to read the Excel files (auto picks calamine when it is installed)",
+        type=str,
+        choices=READER_BACKENDS,
+        default="auto",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes for --batch and --watch, or for the merges of a large --job input",
+        type=int,
+        default=os.cpu_count() or 1,
+    )
+    parser.add_argument(
+        "--port",
+        help="Port of the local HTTP status (GET /status) and submit (POST /submit) endpoint of --watch (0 disables it)",
+        type=int,
+        default=8765,
+    )
+    parser.add_argument(
+        "--poll_interval",
+        help="Seconds between two scans of the --watch directory",
+        type=float,
+        default=2.0,
+    )
+    parser.add_argument(
+        "--queue_size",
+        help="Maximum number of input files waiting for a worker in --watch mode, the other files wait in the directory",
+        type=int,
+        default=16,
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Directory of the on-disk cache of parsed input files (requires pyarrow)",
+        type=str,
+        default=os.path.join(".cache", "parsed"),
+    )
+    parser.add_argument(
+        "--cache_max_mb",
+        help="Size limit of the parsed input cache in megabytes, the least recently used entries are removed first",
+        type=int,
+        default=1024,
+    )
+    parser.add_argument(
+        "--template_cache_dir",
+        help="Directory of the compiled templates (header, column letters and sheet XML), keyed by the fingerprint of the template file",
+        type=str,
+        default=os.path.join(".cache", "templates"),
+    )
+    parser.add_argument(
+        "--no_cache",
+        help="Do not use the parsed input cache and the compiled template cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics_dir",
+        help="Directory of the JSON files with the timing, memory and row counts of every stage of a merge",
+        type=str,
+        default=os.path.join("logs", "metrics"),
+    )
+    parser.add_argument(
+        "--lean_memory",
+        help="Dictionary-encode the input columns to merge large files with less memory",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--memory_budget_mb",
+        help="Memory budget of a merge in megabytes, larger input files are merged out of core through spill files in the temporary directory (0 always merges out of core)",
+        type=int,
+        default=4096,
+    )
+    parser.add_argument(
+        "--incremental",
+        help="Only join the option groups that changed since the previous run of the same input file, and save the changed rows in a *_DELTA.xlsx file",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--state_dir",
+        help="Directory of the manifests kept between two --incremental runs",
+        type=str,
+        default=os.path.join(".cache", "incremental"),
+    )
+    parser.add_argument(
+        "--profile",
+        help="Save a cProfile report (.prof and .txt) of the run in logs/profile",
+        action="store_true",
     )
     args = parser.parse_args()
 
+    if args.batch is not None and args.gui:
+        parser.error("--batch is not supported in GUI mode")
+    if args.watch is not None and args.gui:
+        parser.error("--watch is not supported in GUI mode")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.memory_budget_mb < 0:
+        parser.error("--memory_budget_mb must not be negative")
+    if not 0 <= args.port <= 65535:
+        parser.error("--port must be between 0 and 65535")
+    if args.poll_interval <= 0:
+        parser.error("--poll_interval must be positive")
+    if args.queue_size < 1:
+        parser.error("--queue_size must be at least 1")
+    if args.shard_rows is not None and args.shard_rows < 1:
+        parser.error("--shard_rows must be at least 1")
+    # ? Checked without importing pyarrow, so that a run does not fail after the merge
+    if args.output_format in ("parquet", "arrow") and find_spec("pyarrow") is None:
+        parser.error(
+            f"--output_format {args.output_format} requires pyarrow (pip install pyarrow)"
+        )
+
+    # ? The command line arguments take precedence over the shared settings of the job file
+    merges: tuple[MergeSpec, ...] = ()
+    if args.job is not None:
+        if args.gui:
+            parser.error("--job is not supported in GUI mode")
+        if any(
+            value is not None
+            for value in (
+                args.first_column,
+                args.second_column,
+                args.join_by,
+                args.output_column,
+            )
+        ):
+            parser.error(
+                "--first_column, --second_column, --join_by and --output_column are given by the merges of --job"
+            )
+
+        from option_merge_tool.job import load_job
+
+        try:
+            job = load_job(args.job)
+        except (OSError, ValueError, ImportError) as err:
+            parser.error(f"--job: {err}")
+
+        # ? The column names of every merge get the same "\\n" unescaping as the command line ones
+        merges = tuple(
+            replace(
+                spec,
+                first_column=spec.first_column.replace("\\n", "\n"),
+                second_column=spec.second_column.replace("\\n", "\n"),
+                output_column=spec.output_column.replace("\\n", "\n"),
+            )
+            for spec in job.merges
+        )
+        args.first_column = merges[0].first_column
+        args.second_column = merges[0].second_column
+        args.join_by = merges[0].join_by
+        args.output_column = merges[0].output_column
+        if args.input_file is None and args.batch is None and args.watch is None:
+            args.input_file = job.input_file
+        for name in ("template_file", "column_to_dropna", "output_file"):
+            if getattr(args, name) is None:
+                setattr(args, name, getattr(job, name))
+        if args.columns_to_drop_dulicates is None and job.columns_to_drop_dulicates:
+            args.columns_to_drop_dulicates = ",".join(job.columns_to_drop_dulicates)
+        if args.sheets is None and job.sheets:
+            args.sheets = ",".join(job.sheets)
+
+    if args.input_file is None and args.batch is None and args.watch is None:
+        parser.error("one of the arguments --input_file --batch --watch is required")
+    # ? Checked after the job is merged in, so that its output_file is not silently ignored
+    if (args.batch is not None or args.watch is not None) and (
+        args.output_file is not None or args.intermediate_file is not None
+    ):
+        parser.error(
+            "--output_file and --intermediate_file (also from --job) are not supported with --batch or --watch"
+        )
+    missing = [
+        f"--{name}"
+        for name in (
+            "template_file",
+            "first_column",
+            "second_column",
+            "join_by",
+            "output_column",
+            "column_to_dropna",
+            "columns_to_drop_dulicates",
+        )
+        if getattr(args, name) is None
+    ]
+    if missing:
+        parser.error(f"the following arguments are required: {', '.join(missing)}")
+
     os.makedirs("logs", exist_ok=True)
     os.makedirs("output", exist_ok=True)
 
     settings = Settings(
         test_mode=args.test_mode,
         log_file=args.log_file,
-        input_file=args.input_file,
+        input_file=args.input_file or "",
+        sheets=None if args.sheets is None else args.sheets.split(","),
         template_file=args.template_file,
         first_column=args.first_column.replace("\\n", "\n"),
         second_column=args.second_column.replace("\\n", "\n"),
@@ -95,6 +329,27 @@ if __name__ == "__main__":
         columns_to_drop_dulicates=args.columns_to_drop_dulicates.replace(
             "\\n", "\n"
         ).split(","),
+        reader_backend=args.reader_backend,
+        batch=args.batch,
+        watch=args.watch,
+        port=args.port,
+        poll_interval=args.poll_interval,
+        queue_size=args.queue_size,
+        workers=args.workers,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        cache_max_mb=args.cache_max_mb,
+        template_cache_dir=None if args.no_cache else args.template_cache_dir,
+        metrics_dir=args.metrics_dir,
+        profile_dir=os.path.join("logs", "profile") if args.profile else None,
+        lean_memory=args.lean_memory,
+        state_dir=args.state_dir if args.incremental else None,
+        output_file=args.output_file,
+        output_format=args.output_format,
+        intermediate_file=args.intermediate_file,
+        shard_rows=args.shard_rows,
+        shard_by=None if args.shard_by is None else args.shard_by.replace("\\n", "\n"),
+        memory_budget_mb=args.memory_budget_mb,
+        extra_merges=merges[1:],
     )
 
     if args.gui:
@@ -102,8 +357,21 @@ if __name__ == "__main__":
     else:
         from option_merge_tool.non_gui import run
 
+    from option_merge_tool.metrics import profiled
+
+    # ? In batch, watch and GUI modes the merges run in other processes, which profile themselves
+    profile = (
+        profiled(settings.profile_dir, "run")
+        if settings.profile_dir is not None
+        and settings.batch is None
+        and settings.watch is None
+        and not args.gui
+        else nullcontext()
+    )
+
     try:
-        asyncio.run(run(settings))
+        with profile:
+            asyncio.run(run(settings))
     except Exception as err:
         logger.log("UNHANDLED ERROR", err)
         raise err from err